@@ -0,0 +1,311 @@
+#! /usr/bin/env python3
+"""
+Benchmark harness for csv_recorder, stop_at_vaportemp and modbus_server.
+
+Every example runs unchanged in its own process against a simulated fake
+device (see openinterface/fake_device.py) on HTTPS. The harness reports:
+
+- throughput: samples handled per second
+- poll-to-sink latency: from the device sending a /process document to its
+  effect being visible (csv row in the file, register in the Modbus server,
+  stop request at the device)
+- CPU and peak memory of the example process, which serves one device
+- Modbus read latency under concurrent clients
+
+Sink effects are observed by polling every millisecond, so latencies have a
+resolution of about 1 ms.
+"""
+
+import argparse
+import bisect
+import glob
+import math
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from os import path
+
+root = path.join(path.dirname(path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+from openinterface.fake_device import FakeDevice
+from openinterface.stats import Histogram
+
+auth = ('rw', 'secret')
+register_count = 44     # holding registers (see modbus_server.modbus_mapping)
+
+
+class RecordingDevice(FakeDevice):
+    """ Fake device remembering the vapor temperature of every served document """
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingDevice, self).__init__(*args, **kwargs)
+        self.documents = []     # (time.monotonic(), vaporTemp)
+
+    def read_process(self):
+        document = super(RecordingDevice, self).read_process()
+        self.documents.append((time.monotonic(), document['vacuum']['vaporTemp']))
+        return document
+
+
+def make_certfile(folder):
+    """ Creates a self signed certificate with openssl and returns the PEM file with certificate and key """
+    key, cert, pem = (path.join(folder, name) for name in ('key.pem', 'cert.pem', 'device.pem'))
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key, '-out', cert,
+                    '-days', '1', '-subj', '/CN=localhost'], check=True, capture_output=True)
+    with open(pem, 'w') as f:
+        for name in (cert, key):
+            with open(name) as part:
+                f.write(part.read())
+    return pem
+
+
+def start(args, cwd):
+    return subprocess.Popen([sys.executable] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+
+
+def finish(process, started, sig=None, timeout=30):
+    """ Stops a process (or waits for it) and collects its resource usage. The
+    output is printed if the process ended with an unexpected exit code.
+
+    :returns: (output, cpu seconds, peak rss in MB, wall seconds), cpu and
+              memory are NaN if the process was already reaped elsewhere
+    """
+    if sig is not None and process.returncode is None:
+        process.send_signal(sig)
+    output = []
+    reader = threading.Thread(target=lambda: output.append(process.stdout.read()))
+    reader.start()
+    usage = None
+    deadline = time.monotonic() + timeout
+    while process.returncode is None:
+        try:
+            pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        except ChildProcessError:
+            # reaped elsewhere, e.g. by Popen.poll(), its resource usage is lost
+            process.wait()
+            break
+        if pid:
+            process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+            break
+        if time.monotonic() > deadline:
+            process.kill()
+        time.sleep(0.01)
+    wall = time.monotonic() - started
+    reader.join()
+    if process.returncode not in (0, -sig if sig else 0):
+        print(f"{path.basename(process.args[1])} exited with {process.returncode}:")
+        print(output[0])
+    if usage is None:
+        return output[0], math.nan, math.nan, wall
+    return output[0], usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024, wall
+
+
+def watch(state, served, histogram, stop, interval=0.001):
+    """ Observes the sink of an example and measures poll-to-sink latencies
+
+    :param state: function returning something that changes when a new sample reached the sink
+    :param served: deque with the send times of the device
+    """
+    last = state()
+    while not stop.is_set():
+        current = state()
+        if current != last:
+            now = time.monotonic()
+            times = list(served)
+            i = bisect.bisect_right(times, now)
+            if i:
+                histogram.observe(now - times[i-1])
+            last = current
+        time.sleep(interval)
+
+
+def report(name, samples, wall, cpu, rss, latency):
+    print(f"{name}")
+    print(f"  throughput     {samples / wall:8.2f} samples/s ({samples} in {wall:.1f} s)")
+    if latency is not None:
+        print(f"  poll-to-sink   {latency.summary()} ({latency.count} samples)")
+    print(f"  cpu            {cpu / wall * 100:8.1f} %")
+    print(f"  peak memory    {rss:8.1f} MB")
+
+
+def bench_csv_recorder(args, certfile, folder):
+    device = FakeDevice(auth=auth, certfile=certfile, simulate=True, latency=args.latency,
+                        jitter=args.jitter, error_rate=args.error_rate).start()
+    out = path.join(folder, 'csv')
+    os.makedirs(out)
+    started = time.monotonic()
+    process = start([path.join(root, 'csv_recorder', 'csv_recorder.py'), device.host, '-u', auth[0], '-p', auth[1],
+                     '-f', out, '--flush-rows', '1', '-r', str(args.rate)], folder)
+
+    def file_size():
+        files = glob.glob(path.join(out, '*.csv'))
+        return path.getsize(files[0]) if files else 0
+
+    latency = Histogram()
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch, args=(file_size, device.served, latency, stop))
+    watcher.start()
+    time.sleep(args.seconds)
+    stop.set()
+    watcher.join()
+    output, cpu, rss, wall = finish(process, started, signal.SIGINT)
+    rows = 0
+    for name in glob.glob(path.join(out, '*.csv')):
+        with open(name) as f:
+            rows += sum(1 for line in f) - 1    # without header
+    device.stop()
+    report("csv_recorder", rows, wall, cpu, rss, latency)
+    return output
+
+
+def bench_stop_at_vaportemp(args, certfile, folder, predictive=False):
+    device = RecordingDevice(auth=auth, certfile=certfile, simulate=True, latency=args.latency,
+                             jitter=args.jitter, error_rate=args.error_rate)
+    # heat up quickly: the vapor temperature rises from 28 °C towards 65 °C and crosses the target after ~4 s
+    device.simulator.bath_tau = 1.0
+    device.simulator.vapor_tau = 10.0
+    device.process['heating']['set'] = 80.0
+    device.start()
+    target = 40.0
+    started = time.monotonic()
+    command = [path.join(root, 'stop_at_vaportemp', 'stop_at_vaportemp.py'), str(target), device.host,
+               '-u', auth[0], '-p', auth[1], '-r', str(args.rate)]
+    process = start(command + (['--predictive'] if predictive else []), folder)
+    output, cpu, rss, wall = finish(process, started, timeout=60)
+    device.stop()
+
+    name = "stop_at_vaportemp" + (" --predictive" if predictive else "")
+    # poll-to-sink: from the last document served before the stop request to its arrival
+    latency = Histogram()
+    served = list(device.served)
+    i = bisect.bisect_right(served, device.written[0]) if device.written else 0
+    if i:
+        latency.observe(device.written[0] - served[i-1])
+    report(name, len(device.documents), wall, cpu, rss, latency if latency.count else None)
+    crossed = next((t for t, value in device.documents if value >= target), None)
+    if crossed is None:
+        print(f"  target never reached, the vapor temp stayed below {target:g} °C")
+    if not device.written:
+        print("  no stop was sent")
+        return output
+    stopped_at = device.written[0]
+    at_stop = next((value for t, value in device.documents if t >= stopped_at), None)
+    if crossed is not None:
+        print(f"  stop request   {(stopped_at - crossed) * 1000:+8.1f} ms after the first served document above {target:g} °C")
+    if at_stop is not None:
+        print(f"  vapor temp     {at_stop - target:+8.2f} °C relative to the target when the stop arrived")
+    return output
+
+
+def bench_modbus_server(args, certfile, folder):
+    from pymodbus.client.sync import ModbusTcpClient
+
+    device = FakeDevice(auth=auth, certfile=certfile, simulate=True, latency=args.latency,
+                        jitter=args.jitter, error_rate=args.error_rate).start()
+    port = args.modbus_port
+    # modbus_server is configured in the script, so it is started with its configuration replaced
+    code = "; ".join([
+        "import sys, logging",
+        f"sys.path.insert(0, {path.join(root, 'modbus_server')!r})",
+        "import modbus_server as ms",
+        f"ms.api_url = {device.url!r}",
+        f"ms.api_session.auth = {auth!r}",
+        f"ms.api_loop_time = {1 / args.rate!r}",
+        f"ms.modbus_tcpport = {port}",
+        "ms.metrics_port = None",
+        "ms.log.setLevel(logging.WARNING)",
+        "ms.run_modbus_server()",
+    ])
+    started = time.monotonic()
+    process = start(['-c', code], folder)
+
+    def connect():
+        client = ModbusTcpClient('127.0.0.1', port)
+        deadline = time.monotonic() + 10
+        while not client.connect():
+            if time.monotonic() > deadline:
+                raise Exception("modbus_server didn't start")
+            time.sleep(0.1)
+        return client
+
+    watch_client = connect()
+
+    def registers():
+        rr = watch_client.read_holding_registers(0, register_count, unit=0)
+        return None if rr.isError() else tuple(rr.registers)
+
+    def read_load(histogram, errors, stop):
+        client = connect()
+        while not stop.is_set():
+            begin = time.perf_counter()
+            rr = client.read_holding_registers(0, register_count, unit=0)
+            if rr.isError():
+                errors.append(rr)
+            else:
+                histogram.observe(time.perf_counter() - begin)
+        client.close()
+
+    latency = Histogram()
+    reads = Histogram()
+    errors = []
+    stop = threading.Event()
+    threads = [threading.Thread(target=watch, args=(registers, device.served, latency, stop))]
+    threads += [threading.Thread(target=read_load, args=(reads, errors, stop)) for i in range(args.clients)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    watch_client.close()
+    # the worker threads of modbus_server don't end on a signal
+    output, cpu, rss, wall = finish(process, started, signal.SIGKILL)
+    device.stop()
+    report("modbus_server", len(device.served), wall, cpu, rss, latency)
+    print(f"  modbus reads   {reads.count / args.seconds:8.0f} reads/s from {args.clients} clients, {len(errors)} errors, "
+          f"latency {reads.summary()}")
+    return output
+
+
+if __name__ == "__main__":
+    scenarios = ['csv_recorder', 'stop_at_vaportemp', 'modbus_server']
+    parser = argparse.ArgumentParser(description='Runs the examples against a simulated device and reports throughput, latency, CPU and memory.')
+    parser.add_argument('scenarios', nargs='*', help=f"examples to run: {', '.join(scenarios)} (default all)")
+    parser.add_argument('-r', '--rate', type=float, help='sampling rate in Hz', default=10)
+    parser.add_argument('-s', '--seconds', type=float, help='duration of the csv_recorder and modbus_server runs', default=10)
+    parser.add_argument('-c', '--clients', type=int, help='concurrent modbus clients', default=4)
+    parser.add_argument('--latency', type=float, help='mean response delay of the device in seconds', default=0.0)
+    parser.add_argument('--jitter', type=float, help='response delay varies by +/- jitter seconds', default=0.0)
+    parser.add_argument('--error-rate', type=float, help='fraction of device requests failing with 503', default=0.0)
+    parser.add_argument('--certfile', type=str, help='PEM file with certificate and key (created with openssl if omitted)', required=False)
+    parser.add_argument('--modbus-port', type=int, help='port of the modbus server', default=5020)
+    parser.add_argument('-v', '--verbose', action='store_true', help='show the output of the examples')
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in scenarios:
+            parser.error(f"unknown example: {scenario}")
+
+    folder = tempfile.mkdtemp()
+    try:
+        certfile = args.certfile or make_certfile(folder)
+        print(f"device latency {args.latency * 1000:g} ms +/- {args.jitter * 1000:g} ms, "
+              f"error rate {args.error_rate:.1%}, sampling rate {args.rate:g} Hz")
+        for scenario in args.scenarios or scenarios:
+            if scenario == 'csv_recorder':
+                output = bench_csv_recorder(args, certfile, folder)
+            elif scenario == 'stop_at_vaportemp':
+                output = bench_stop_at_vaportemp(args, certfile, folder)
+                if args.verbose:
+                    print(output)
+                output = bench_stop_at_vaportemp(args, certfile, folder, predictive=True)
+            else:
+                output = bench_modbus_server(args, certfile, folder)
+            if args.verbose:
+                print(output)
+    finally:
+        shutil.rmtree(folder)
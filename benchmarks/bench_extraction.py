@@ -0,0 +1,55 @@
+#! /usr/bin/env python3
+"""
+Micro-benchmark of the field extraction used by csv_recorder and modbus_server.
+Compares rows per second of the per-call jsonpath parse path (get_value) with
+the precompiled row extractor of csv_recorder and the register plan of
+modbus_server.
+"""
+
+import argparse
+import sys
+import timeit
+from datetime import timedelta
+from os import path
+
+root = path.join(path.dirname(path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, path.join(root, 'csv_recorder'))
+sys.path.insert(0, path.join(root, 'modbus_server'))
+
+import csv_recorder
+import modbus_server
+from openinterface.sample_data import process_sample
+
+
+def bench(name, func, rows):
+    seconds = min(timeit.repeat(func, number=rows, repeat=3))
+    rate = rows / seconds
+    print(f"{name:<32} {rate:>12,.0f} rows/s {seconds / rows * 1e6:>10.1f} us/row")
+    return rate
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares jsonpath parsing per value with precompiled row extraction.')
+    parser.add_argument('-n', '--rows', type=int, help='rows per measurement', default=200)
+    args = parser.parse_args()
+
+    occured_at = timedelta(seconds=312)
+
+    # make sure both paths produce the same rows before timing them
+    csv_mapping = csv_recorder.csv_mapping
+    csv_row = csv_recorder.compile_csv_mapping(csv_mapping)
+    assert csv_row(process_sample, occured_at) == [csv_recorder.get_value(occured_at, process_sample, m[1], m[2]) for m in csv_mapping]
+    modbus_mapping = modbus_server.modbus_mapping
+    register_plan = modbus_server.register_plan
+    assert register_plan.encode(process_sample).tolist() == [modbus_server.get_value(process_sample, m) for m in modbus_mapping]
+
+    print(f"csv_recorder ({len(csv_mapping)} columns)")
+    before = bench("  get_value (parse per call)", lambda: [csv_recorder.get_value(occured_at, process_sample, m[1], m[2]) for m in csv_mapping], args.rows)
+    after = bench("  compiled row", lambda: csv_row(process_sample, occured_at), args.rows * 100)
+    print(f"  speedup {after / before:.0f}x")
+
+    print(f"modbus_server ({len(modbus_mapping)} registers)")
+    before = bench("  get_value (parse per call)", lambda: [modbus_server.get_value(process_sample, m) for m in modbus_mapping], args.rows)
+    after = bench("  register plan", lambda: register_plan.encode(process_sample), args.rows * 100)
+    print(f"  speedup {after / before:.0f}x")
@@ -0,0 +1,66 @@
+#! /usr/bin/env python3
+"""
+Benchmark of the fetch layer (openinterface/fetch.py). Compares the decode
+time per document of json and orjson for the whole document and for the
+sections of single consumers, and polls a fake device to show the bytes,
+decode time and unchanged ratio a Fetcher reports.
+"""
+
+import argparse
+import json
+import sys
+import timeit
+from os import path
+
+import requests
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+from openinterface import fetch
+from openinterface.fake_device import FakeDevice
+from openinterface.sample_data import process_sample
+
+consumers = {
+    'whole document (csv_recorder)': None,
+    'stop_at_vaportemp': ['$.vacuum.vaporTemp'],
+    'live view': ['$.heating.act', '$.vacuum.vaporTemp', '$.vacuum.act'],
+}
+
+
+def bench(name, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print(f"  {name:<36} {seconds * 1e6:8.1f} us/document")
+    return seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Decode time and unchanged ratio of the fetch layer.')
+    parser.add_argument('-n', '--documents', type=int, help='documents per measurement', default=20000)
+    parser.add_argument('--polls', type=int, help='polls of the fake device per consumer', default=200)
+    args = parser.parse_args()
+
+    body = json.dumps(process_sample).encode()
+    print(f"decoding a {len(body)} byte document")
+    bench("json.loads (resp.json())", lambda: json.loads(body), args.documents)
+    if fetch.loads is json.loads:
+        print("  orjson is not installed, the fetch layer uses json")
+    else:
+        bench("orjson.loads", lambda: fetch.loads(body), args.documents)
+    for name, paths in consumers.items():
+        fetcher = fetch.Fetcher(paths)
+        bench(f"Fetcher, {name}", lambda: (fetcher.reset(), fetcher.decode(body)), args.documents)
+    fetcher = fetch.Fetcher()
+    fetcher.decode(body)
+    bench("Fetcher, unchanged body", lambda: fetcher.decode(body), args.documents)
+
+    auth = ('rw', 'secret')
+    for simulate in (False, True):
+        device = FakeDevice(auth=auth, simulate=simulate).start()
+        session = requests.Session()
+        session.auth = auth
+        print(f"polling a fake device with {'simulated' if simulate else 'constant'} values")
+        for name, paths in consumers.items():
+            fetcher = fetch.Fetcher(paths)
+            for i in range(args.polls):
+                fetcher.fetch(session, device.url + "/process")
+            print(f"  {name}: {fetcher.stats.summary()}")
+        device.stop()
@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+"""
+Load test of modbus_server/modbus_gateway.py. Starts fake devices, runs the
+gateway against them in a subprocess and reads the registers of random units
+from several concurrent Modbus clients. Checks that a write to every unit
+reaches its own device, and reports the read latency and the thread count
+and memory of the gateway.
+"""
+
+import argparse
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from os import path
+
+from pymodbus.client.sync import ModbusTcpClient
+
+root = path.join(path.dirname(path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+from openinterface.fake_device import FakeDevice
+from openinterface.stats import Histogram
+
+register_count = 44     # holding registers per unit (see modbus_server.modbus_mapping)
+heating_set = 1         # register address of heating.set (multiplier 10)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_status(pid):
+    """ :returns: (threads, rss in MB) of a process (Linux only) """
+    status = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.split()
+    return int(status['Threads'][0]), int(status['VmRSS'][0]) / 1024
+
+
+def wait_for_units(port, units, timeout):
+    """ Waits until every unit serves the values of its device """
+    deadline = time.monotonic() + timeout
+    client = ModbusTcpClient('127.0.0.1', port)
+    try:
+        while time.monotonic() < deadline:
+            if client.connect():
+                ready = 0
+                for unit in units:
+                    rr = client.read_holding_registers(heating_set, 1, unit=unit)
+                    if not rr.isError() and rr.registers[0] != 0:
+                        ready += 1
+                if ready == len(units):
+                    return True
+            time.sleep(0.2)
+        return False
+    finally:
+        client.close()
+
+
+def read_load(port, units, seconds, histogram, errors):
+    client = ModbusTcpClient('127.0.0.1', port)
+    client.connect()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        rr = client.read_holding_registers(0, register_count, unit=random.choice(units))
+        if rr.isError():
+            errors.append(rr)
+        else:
+            histogram.observe(time.perf_counter() - started)
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test of the multi-unit Modbus gateway with fake devices.')
+    parser.add_argument('-d', '--devices', type=int, help='number of fake devices', default=32)
+    parser.add_argument('-c', '--clients', type=int, help='concurrent modbus clients', default=8)
+    parser.add_argument('-s', '--seconds', type=float, help='duration of the read load', default=10)
+    parser.add_argument('-r', '--rate', type=float, help='polling rate of the gateway in Hz', default=1)
+    args = parser.parse_args()
+
+    auth = ('rw', 'secret')
+    devices = [FakeDevice(auth=auth, name=f"R-300 {i}").start() for i in range(args.devices)]
+    units = list(range(1, args.devices + 1))
+    port = free_port()
+    gateway = subprocess.Popen([sys.executable, path.join(root, 'modbus_server', 'modbus_gateway.py'),
+                                '--http', '-u', auth[0], '-p', auth[1], '--port', str(port), '-r', str(args.rate)]
+                               + [d.host for d in devices],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_for_units(port, units, timeout=30):
+            sys.exit("gateway didn't serve all units in time")
+        threads, rss = process_status(gateway.pid)
+        print(f"gateway with {args.devices} units: {threads} threads, {rss:.0f} MB RSS")
+
+        # reads from concurrent clients while the gateway keeps polling
+        histogram = Histogram()
+        errors = []
+        clients = [threading.Thread(target=read_load, args=(port, units, args.seconds, histogram, errors))
+                   for i in range(args.clients)]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        threads, rss = process_status(gateway.pid)
+        print(f"{args.clients} clients: {histogram.count / args.seconds:,.0f} reads/s, {len(errors)} errors, "
+              f"latency {histogram.summary()}")
+        print(f"after load: {threads} threads, {rss:.0f} MB RSS")
+
+        # a different heating.set for every unit must reach its own device
+        client = ModbusTcpClient('127.0.0.1', port)
+        client.connect()
+        for unit, device in zip(units, devices):
+            client.write_register(heating_set, 200 + unit, unit=unit)
+        client.close()
+        time.sleep(1)
+        routed = sum(1 for unit, device in zip(units, devices)
+                     if {'heating': {'set': (200 + unit) / 10}} in device.writes)
+        misrouted = sum(len(device.writes) for device in devices) - routed
+        print(f"writes: {routed}/{len(units)} routed to their device, {misrouted} unexpected")
+    finally:
+        gateway.terminate()
+        gateway.wait()
+        for device in devices:
+            device.stop()
@@ -0,0 +1,84 @@
+#! /usr/bin/env python3
+"""
+Benchmark of the csv_recorder write pipeline. Writes csv rows with different
+flush policies and reports rows per second and system calls (write and fsync)
+per row.
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from os import path
+
+root = path.join(path.dirname(path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, path.join(root, 'csv_recorder'))
+
+import csv_recorder
+from buffered_writer import BufferedRowWriter
+from openinterface.sample_data import process_sample
+
+
+class CountingFileIO(io.FileIO):
+    """ A raw file that counts its write calls, each one is a write system call """
+    writes = 0
+
+    def write(self, b):
+        self.writes += 1
+        return super(CountingFileIO, self).write(b)
+
+
+def open_counting(filepath, buffer_size):
+    raw = CountingFileIO(filepath, 'w')
+    return raw, io.TextIOWrapper(io.BufferedWriter(raw, buffer_size), newline='')
+
+
+def bench(name, rows, folder, buffer_size, **policy):
+    filepath = path.join(folder, 'bench.csv')
+    raw, f = open_counting(filepath, buffer_size)
+    writer = BufferedRowWriter(csv.writer(f, dialect=csv_recorder.csv_dialect), f, **policy)
+    started = time.perf_counter()
+    for row in rows:
+        writer.writerow(row)
+    writer.close()
+    fsyncs = writer.fsyncs
+    seconds = time.perf_counter() - started
+    syscalls = raw.writes + fsyncs
+    print(f"{name:<28} {len(rows) / seconds:>10,.0f} rows/s {syscalls / len(rows):>8.3f} syscalls/row ({raw.writes} writes, {fsyncs} fsyncs)")
+    os.remove(filepath)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rows per second and syscalls per row of the csv_recorder flush policies.')
+    parser.add_argument('-n', '--rows', type=int, help='rows per measurement', default=3600)
+    parser.add_argument('-f', '--folder', type=str, help='folder for the temporary file (e.g. a network share)', default=None)
+    args = parser.parse_args()
+
+    extract_row = csv_recorder.compile_csv_mapping(csv_recorder.csv_mapping)
+    rows = [extract_row(process_sample, timedelta(seconds=i)) for i in range(args.rows)]
+    folder = args.folder or tempfile.gettempdir()
+    buffer_size = csv_recorder.write_buffer_size
+
+    # the original recorder: csv.writer on a default file object, no explicit flush
+    raw, f = open_counting(path.join(folder, 'bench.csv'), io.DEFAULT_BUFFER_SIZE)
+    writer = csv.writer(f, dialect=csv_recorder.csv_dialect)
+    started = time.perf_counter()
+    for row in rows:
+        writer.writerow(row)
+    f.close()
+    seconds = time.perf_counter() - started
+    print(f"{'original (no flush policy)':<28} {len(rows) / seconds:>10,.0f} rows/s {raw.writes / len(rows):>8.3f} syscalls/row ({raw.writes} writes, 0 fsyncs)")
+    os.remove(path.join(folder, 'bench.csv'))
+
+    bench("every row", rows, folder, buffer_size, flush_rows=1)
+    bench("every row + fsync", rows, folder, buffer_size, flush_rows=1, fsync=True)
+    bench("every 10 rows", rows, folder, buffer_size, flush_rows=10)
+    bench("every 10 rows + fsync", rows, folder, buffer_size, flush_rows=10, fsync=True)
+    bench("every 60 rows + fsync", rows, folder, buffer_size, flush_rows=60, fsync=True)
+    bench("every 1 s + fsync", rows, folder, buffer_size, flush_seconds=1, fsync=True)
+    bench("on run stop", rows, folder, buffer_size, capacity=len(rows))
@@ -0,0 +1,48 @@
+#! /usr/bin/env python3
+"""
+Micro-benchmark of the holding register encoding of modbus_server.
+Compares the encode time per cycle of the original row by row get_value
+with the vectorised RegisterPlan.
+"""
+
+import argparse
+import copy
+import sys
+import timeit
+from os import path
+
+root = path.join(path.dirname(path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+sys.path.insert(0, path.join(root, 'modbus_server'))
+
+import modbus_server
+from openinterface.sample_data import process_sample
+
+
+def bench(name, func, cycles):
+    seconds = min(timeit.repeat(func, number=cycles, repeat=3))
+    print(f"{name:<32} {seconds / cycles * 1e6:>10.1f} us/cycle")
+    return seconds / cycles
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compares the encode time per cycle of the modbus register encodings.')
+    parser.add_argument('-n', '--cycles', type=int, help='cycles per measurement', default=200)
+    args = parser.parse_args()
+
+    mapping = modbus_server.modbus_mapping
+    plan = modbus_server.register_plan
+
+    # both encodings must produce the same registers, also for missing and negative values
+    incomplete = copy.deepcopy(process_sample)
+    del incomplete['cooling']
+    incomplete['heating']['set'] = -12.5
+    incomplete['program']['type'] = 'Unknown'
+    for d in (process_sample, incomplete):
+        expected = [modbus_server.get_value(d, m) for m in mapping]
+        assert plan.encode(d).tolist() == expected
+
+    print(f"modbus_server ({len(mapping)} registers)")
+    before = bench("  get_value (row by row)", lambda: [modbus_server.get_value(process_sample, m) for m in mapping], args.cycles)
+    after = bench("  register plan", lambda: plan.encode(process_sample), args.cycles * 20)
+    print(f"  speedup {before / after:.0f}x over get_value")
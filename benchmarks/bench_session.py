@@ -0,0 +1,65 @@
+#! /usr/bin/env python3
+"""
+Compares the per-cycle latency of reading /process with a new requests.Session
+per request (the original modbus_server behaviour) against the pooled session
+of openinterface.session. Runs against a local fake device; pass --certfile to
+include the TLS handshake, which is where most of the difference comes from.
+"""
+
+import argparse
+import sys
+import time
+from os import path
+
+import requests
+import urllib3
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+from openinterface.fake_device import FakeDevice
+from openinterface.session import create_session, SessionMetrics
+
+
+def new_session_per_request(url, auth):
+    with requests.Session() as s:
+        s.auth = auth
+        s.verify = False
+        r = s.get(url)
+        r.json()
+
+
+def report(name, latencies, connections):
+    latencies = sorted(latencies)
+    mean = sum(latencies) / len(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<26} mean {mean * 1000:7.2f} ms  p95 {p95 * 1000:7.2f} ms  connections {connections}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per-cycle latency with and without connection reuse.')
+    parser.add_argument('-n', '--cycles', type=int, help='requests per measurement', default=200)
+    parser.add_argument('--certfile', type=str, help='PEM file with certificate and key to serve HTTPS', required=False)
+    args = parser.parse_args()
+
+    urllib3.disable_warnings()
+    auth = ('rw', 'secret')
+    device = FakeDevice(auth=auth, certfile=args.certfile).start()
+    url = device.url + "/process"
+
+    latencies = []
+    for i in range(args.cycles):
+        started = time.perf_counter()
+        new_session_per_request(url, auth)
+        latencies.append(time.perf_counter() - started)
+    report("new session per request", latencies, device.counters['connections'])
+
+    connections_before = device.counters['connections']
+    metrics = SessionMetrics(window=args.cycles)
+    session = create_session(auth, metrics=metrics)
+    latencies = []
+    for i in range(args.cycles):
+        started = time.perf_counter()
+        session.get(url).json()
+        latencies.append(time.perf_counter() - started)
+    report("pooled session", latencies, device.counters['connections'] - connections_before)
+    print("pooled session metrics: " + metrics.summary())
+    device.stop()
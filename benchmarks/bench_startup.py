@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+"""
+Startup time and memory of the entry points. Every entry point is loaded
+in fresh interpreters the way its script starts, up to the point where it
+parses the command line. The benchmark reports the median wall time of the
+process, the import time, the peak memory and the optional dependencies
+that were loaded. The first line is an empty interpreter for reference.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from os import path
+
+root = path.abspath(path.join(path.dirname(path.abspath(__file__)), '..'))
+
+# (name, folder added to sys.path, module)
+entry_points = [
+    ('csv_recorder', 'csv_recorder', 'csv_recorder'),
+    ('summarize_runs', 'csv_recorder', 'summarize_runs'),
+    ('segments', 'csv_recorder', 'segments'),
+    ('binary_log', 'csv_recorder', 'binary_log'),
+    ('stop_at_vaportemp', 'stop_at_vaportemp', 'stop_at_vaportemp'),
+    ('modbus_server', 'modbus_server', 'modbus_server'),
+    ('modbus_gateway', 'modbus_server', 'modbus_gateway'),
+    ('fleet_poller', 'fleet_poller', 'fleet_poller'),
+    ('snapshot', '', 'openinterface.snapshot'),
+    ('fake_device', '', 'openinterface.fake_device'),
+]
+
+# dependencies reported if an entry point loads them
+optional_modules = ['numpy', 'jsonpath_ng', 'orjson', 'requests', 'aiohttp', 'pymodbus', 'twisted', 'serial', 'zstandard']
+
+child = """
+import sys, time, json
+sys.path[:0] = [{root!r}, {folder!r}]
+started = time.perf_counter()
+if {module!r}:
+    __import__({module!r})
+seconds = time.perf_counter() - started
+print(json.dumps([seconds, [m for m in {optional!r} if m in sys.modules]]))
+"""
+
+
+def run(folder, module):
+    """ :returns: (wall seconds, import seconds, peak rss in MB, loaded optional modules) """
+    code = child.format(root=root, folder=path.join(root, folder), module=module, optional=optional_modules)
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=root, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    output = process.stdout.read()
+    pid, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - started
+    process.returncode = status     # already reaped
+    if status != 0 or not output:
+        raise Exception(f"loading {module} failed")
+    seconds, loaded = json.loads(output)
+    return wall, seconds, usage.ru_maxrss / 1024, loaded
+
+
+def bench(name, folder, module, runs):
+    results = [run(folder, module) for _ in range(runs)]
+    wall = statistics.median(r[0] for r in results)
+    imports = statistics.median(r[1] for r in results)
+    rss = max(r[2] for r in results)
+    print(f"{name:<18} {wall * 1000:7.0f} ms {imports * 1000:7.0f} ms {rss:7.1f} MB  {' '.join(results[0][3])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Startup time and peak memory of the entry points.')
+    parser.add_argument('-n', '--runs', type=int, help='fresh interpreters per entry point', default=5)
+    parser.add_argument('names', nargs='*', help='entry points to measure (default: all)')
+    args = parser.parse_args()
+
+    print(f"{'entry point':<18} {'process':>10} {'imports':>10} {'peak rss':>10}  loaded dependencies")
+    bench('(python)', '', '', args.runs)
+    for name, folder, module in entry_points:
+        if not args.names or name in args.names:
+            try:
+                bench(name, folder, module, args.runs)
+            except Exception as e:
+                print(f"{name:<18} {e}")
@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+"""
+Benchmark of csv_recorder/summarize_runs.py. Writes synthetic runs as csv files
+and binary logs and summarizes them with one and with several worker
+processes. Reports runs and rows per second and the peak memory of the
+workers, which stays bounded by the chunk size however long the runs are.
+"""
+
+import argparse
+import csv
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'csv_recorder'))
+import binary_log
+import summarize_runs
+from csv_recorder import csv_header, csv_dialect, timestamp_after_csvheader, build_filepath
+
+
+def synthetic_rows(rows, seed):
+    rnd = random.Random(seed)
+    pressure, vapor = 1013.0, 20.0
+    for i in range(rows):
+        pressure += (50 - pressure) / 30
+        vapor += (45 - vapor) / 300
+        pump = 65 + rnd.randint(-3, 3) if i % 600 < 450 else 0
+        yield [i, round(pressure, 1), 50.0, 60.0, 60.0, 10.0, 10.0, 120.0, round(vapor + rnd.gauss(0, 0.05), 1),
+               11.0, 14.5, round(3.5 + rnd.gauss(0, 0.05), 2), 0, 155, False, False, pump, True]
+
+
+def write_runs(folder, runs, rows, output_format):
+    started_at = datetime(2020, 6, 15, 8, 0)
+    for n in range(runs):
+        started_at += timedelta(hours=1)
+        if output_format == 'binary':
+            writer = binary_log.BinaryLogWriter(build_filepath(folder, 'R-300', started_at, binary_log.extension),
+                                                csv_header, 'R-300', started_at)
+            for row in synthetic_rows(rows, n):
+                writer.writerow(row)
+            writer.close()
+        else:
+            with open(build_filepath(folder, 'R-300', started_at), 'w', newline='') as f:
+                writer = csv.writer(f, dialect=csv_dialect)
+                writer.writerow(csv_header)
+                writer.writerow([started_at.strftime(timestamp_after_csvheader)])
+                writer.writerows(synthetic_rows(rows, n))
+
+
+def bench(runs, jobs, rows):
+    summarize = partial(summarize_runs.summarize_safely, tolerance=summarize_runs.vacuum_tolerance,
+                        size=summarize_runs.chunk_rows)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(jobs) as executor:
+        results = list(executor.map(summarize, runs))
+    seconds = time.perf_counter() - started
+    errors = [error for row, error in results if error is not None]
+    print(f"  {jobs:2d} workers  {len(runs) / seconds:8.1f} runs/s  {len(runs) * rows / seconds / 1e3:8.0f} k rows/s"
+          f"  {len(errors)} errors")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Throughput and memory of summarize_runs.py on synthetic recordings.')
+    parser.add_argument('-n', '--runs', type=int, help='recordings per format', default=32)
+    parser.add_argument('--rows', type=int, help='rows per recording (1 Hz: 14400 rows are 4 hours)', default=14400)
+    parser.add_argument('-j', '--jobs', type=int, help='worker processes of the parallel run (default: number of cores)', required=False)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        for output_format in ('csv', 'binary'):
+            out = path.join(folder, output_format)
+            os.makedirs(out)
+            write_runs(out, args.runs, args.rows, output_format)
+            runs = summarize_runs.group_runs(summarize_runs.find_recordings([out]))
+            size = sum(path.getsize(f) for run in runs for f in run) / 1e6
+            print(f"{output_format}: {len(runs)} runs of {args.rows} rows, {size:.1f} MB")
+            bench(runs, 1, args.rows)
+            bench(runs, args.jobs or os.cpu_count(), args.rows)
+        rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        print(f"peak memory of a worker {rss:.1f} MB")
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,259 @@
+#! /usr/bin/env python3
+"""
+Append-only binary recording format for csv_recorder
+--------------------------------------------------------------------------
+
+A binary log has the same rows and columns as the csv files, but stores every
+value as a little-endian float64 in fixed-width records:
+
+- magic bytes b'OIREC1\\n'
+- header length as little-endian uint32
+- JSON header with device name, start time, column titles and column kinds
+  (bool, int or float, taken from the first value of the column that isn't
+  missing), padded with spaces to 8 byte alignment
+- records of len(columns) float64 values, missing values are NaN
+
+Fixed-width records make the file memory-mappable: read_binary_log() returns a
+NumPy array backed by the file without parsing or copying it. A partially
+written last record (e.g. after a power cut) is ignored. Logs compressed by
+the segment archiver (.oirec.gz, .oirec.zst) can't be mapped, read_binary_log()
+decompresses them into memory and read_chunks() decompresses them as a stream.
+
+Run this module to convert a binary log into the csv format written by
+csv_recorder:
+
+    python binary_log.py recording.oirec
+"""
+
+import argparse
+import json
+import math
+import struct
+from array import array
+from datetime import datetime
+from os import path
+
+from segments import open_compressed, compression_of, compression_suffixes
+
+magic = b'OIREC1\n'
+extension = '.oirec'
+header_length_format = '<I'
+chunk_records = 1 << 16 # records read at once by read_chunks
+
+
+def value_kind(value):
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    return 'float'
+
+
+class BinaryLogWriter(object):
+    """ Writes rows into a binary log. Has the same writerow()/close()
+    interface as the csv writer used by csv_recorder.
+
+    The kind of a column is taken from its first value that isn't missing,
+    e.g. a column missing in the first rows of a run. Columns without a
+    value are floats. The header has room for the longest kinds and is
+    rewritten in place whenever the kind of a column becomes known.
+
+    :param filepath: path of the binary log
+    :param columns: column titles
+    :param device_name: name of the recorded device
+    :param started_at: start of the recording
+    """
+
+    def __init__(self, filepath, columns, device_name, started_at):
+        self.columns = list(columns)
+        self.header = {
+            'device_name': device_name,
+            'started_at': started_at.isoformat(),
+            'columns': self.columns,
+        }
+        self.kinds = [None] * len(self.columns)
+        self.undecided = len(self.columns)  # columns without a value so far
+        self.file = open(filepath, 'wb')
+        self.header_size = None
+
+    @property
+    def header_written(self):
+        return self.header_size is not None
+
+    def write_header(self):
+        header = json.dumps(dict(self.header, kinds=[k or 'float' for k in self.kinds])).encode()
+        if self.header_size is None:
+            # pad so that records start 8 byte aligned, with room for the header with the longest kinds
+            longest = json.dumps(dict(self.header, kinds=['float'] * len(self.kinds))).encode()
+            used = len(magic) + struct.calcsize(header_length_format) + len(longest)
+            self.header_size = len(longest) + (-used % 8)
+        header += b' ' * (self.header_size - len(header))
+        position = self.file.tell()
+        if position:
+            self.file.seek(0)
+        self.file.write(magic + struct.pack(header_length_format, len(header)) + header)
+        if position:
+            self.file.seek(position)
+
+    def decide_kinds(self, row):
+        decided = False
+        for i, value in enumerate(row):
+            if self.kinds[i] is None and not math.isnan(to_float(value)):
+                self.kinds[i] = value_kind(value)
+                self.undecided -= 1
+                decided = True
+        if decided or not self.header_written:
+            self.write_header()
+
+    def writerow(self, row):
+        if self.undecided:
+            self.decide_kinds(row)
+        self.file.write(array('d', [to_float(v) for v in row]).tobytes())
+
+    @property
+    def name(self):
+        return self.file.name
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def tell(self):
+        return self.file.tell()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if not self.header_written:
+            self.write_header()
+        self.file.close()
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan     # missing value
+
+
+def read_header(f):
+    """ Reads the header of a binary log
+
+    :param f: binary log opened in binary mode
+    :returns: (header dict, offset of the first record)
+    """
+    if f.read(len(magic)) != magic:
+        raise Exception("Not a binary log file", f.name)
+    size = struct.calcsize(header_length_format)
+    header_length, = struct.unpack(header_length_format, f.read(size))
+    header = json.loads(f.read(header_length))
+    return header, len(magic) + size + header_length
+
+
+def read_binary_log(filepath):
+    """ Memory-maps a binary log, compressed logs are decompressed into memory
+
+    :param filepath: path of the binary log
+    :returns: (header dict, read-only NumPy array with one row per record)
+    """
+    import numpy as np
+    if compression_of(filepath) is not None:
+        with open_compressed(filepath, 'rb') as f:
+            header, offset = read_header(f)
+            data = f.read()
+        columns = len(header['columns'])
+        records = len(data) // (8 * columns)
+        return header, np.frombuffer(data, dtype='<f8', count=records * columns).reshape(records, columns)
+    with open(filepath, 'rb') as f:
+        header, offset = read_header(f)
+    columns = len(header['columns'])
+    records = (path.getsize(filepath) - offset) // (8 * columns)
+    if records == 0:
+        return header, np.empty((0, columns))
+    data = np.memmap(filepath, dtype='<f8', mode='r', offset=offset, shape=(records, columns))
+    return header, data
+
+
+def read_chunks(filepath, size=chunk_records):
+    """ Reads a binary log in chunks, memory-mapped or decompressed as a stream
+
+    :param filepath: path of the (compressed) binary log
+    :param size: records per chunk
+    :returns: (header dict, generator of NumPy arrays with up to size rows)
+    """
+    import numpy as np
+    if compression_of(filepath) is None:
+        header, data = read_binary_log(filepath)
+
+        def chunks():
+            for start in range(0, len(data), size):
+                yield data[start:start + size]
+        return header, chunks()
+
+    f = open_compressed(filepath, 'rb')
+    header, offset = read_header(f)
+    columns = len(header['columns'])
+
+    def chunks():
+        with f:
+            while True:
+                data = f.read(size * 8 * columns)
+                records = len(data) // (8 * columns)   # a partially written last record is ignored
+                if records == 0:
+                    break
+                yield np.frombuffer(data, dtype='<f8', count=records * columns).reshape(records, columns)
+    return header, chunks()
+
+
+def csv_filepath(filepath):
+    """ :returns: path of the csv file converted from a (compressed) binary log """
+    compression = compression_of(filepath)
+    if compression is not None:
+        filepath = filepath[:-len(compression_suffixes[compression])]
+    return path.splitext(filepath)[0] + '.csv'
+
+
+def format_value(value, kind, missing_value_char):
+    if math.isnan(value):
+        return missing_value_char
+    if kind == 'bool':
+        return value != 0
+    if kind == 'int' and value.is_integer():
+        return int(value)
+    return value
+
+
+def convert_to_csv(filepath, csvpath, dialect, timestamp_format, missing_value_char):
+    """ Writes a binary log as csv file in the format of csv_recorder
+
+    :param filepath: path of the (compressed) binary log
+    :param csvpath: path of the csv file to write
+    :param dialect: csv dialect
+    :param timestamp_format: format of the timestamp line after the header, None to omit it
+    :param missing_value_char: placeholder of missing values
+    """
+    import csv
+    header, chunks = read_chunks(filepath)
+    kinds = header['kinds']
+    with open(csvpath, 'w', newline='') as f:
+        writer = csv.writer(f, dialect=dialect)
+        writer.writerow(header['columns'])
+        if timestamp_format is not None:
+            started_at = datetime.fromisoformat(header['started_at'])
+            writer.writerow([started_at.strftime(timestamp_format)])
+        for chunk in chunks:
+            for record in chunk.tolist():
+                writer.writerow([format_value(v, k, missing_value_char) for v, k in zip(record, kinds)])
+
+
+if __name__ == "__main__":
+    from csv_recorder import csv_dialect, timestamp_after_csvheader, missing_value_char
+
+    parser = argparse.ArgumentParser(description='Converts binary logs of csv_recorder into csv files.')
+    parser.add_argument('files', metavar='file', type=str, nargs='+', help='binary log files')
+    args = parser.parse_args()
+
+    for filepath in args.files:
+        csvpath = csv_filepath(filepath)
+        convert_to_csv(filepath, csvpath, csv_dialect, timestamp_after_csvheader, missing_value_char)
+        print(f"{filepath} -> {csvpath}")
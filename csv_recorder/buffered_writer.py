@@ -0,0 +1,124 @@
+"""
+Buffered, crash-safe row writing for csv_recorder
+--------------------------------------------------------------------------
+
+BufferedRowWriter keeps rows in a bounded in-memory buffer and writes them in
+one go according to a flush policy:
+
+- every flush_rows rows
+- every flush_seconds seconds
+- when the run stops (close) or the buffer is full
+
+Without a policy the rows are flushed every default_flush_seconds, so a
+running recording never lags more than about a second behind on disk.
+
+Each flush ends with an explicit file flush, so a flushed row is handed to the
+operating system with a single write call. With fsync the data is also forced
+onto the disk, which makes flushed rows survive power cuts.
+
+Crash-safe recordings are written to '<file>.part' and renamed once they are
+closed. recover_partial_files() repairs '.part' files left behind by a crash:
+an incomplete last row is cut off and the file gets its final name.
+"""
+
+import glob
+import os
+import time
+from collections import deque
+
+part_suffix = '.part'
+default_flush_seconds = 1   # flush policy if neither flush_rows nor flush_seconds is given
+
+
+class BufferedRowWriter(object):
+    """ Buffers rows and writes them to a row writer according to a flush policy
+
+    :param writer: object with writerow(row), e.g. a csv writer
+    :param file: the file the writer writes to, needs flush(), fileno() and close()
+    :param flush_rows: flush every n rows (None to disable)
+    :param flush_seconds: flush every t seconds (None to disable, default_flush_seconds if flush_rows is None too)
+    :param fsync: force flushed data onto the disk
+    :param capacity: maximum number of buffered rows, the buffer is flushed when full
+    :param final_path: rename the file to this path after closing it (crash-safe mode)
+    """
+
+    def __init__(self, writer, file, flush_rows=None, flush_seconds=None, fsync=False, capacity=1000, final_path=None):
+        self.writer = writer
+        self.file = file
+        if flush_rows is None and flush_seconds is None:
+            flush_seconds = default_flush_seconds
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.capacity = capacity if flush_rows is None else min(capacity, flush_rows)
+        self.final_path = final_path
+        self.buffer = deque()
+        self.flushed_at = time.monotonic()
+        self.flushes = 0
+        self.fsyncs = 0
+
+    def writerow(self, row):
+        self.buffer.append(row)
+        if len(self.buffer) >= self.capacity:
+            self.flush()
+        elif self.flush_seconds is not None and time.monotonic() - self.flushed_at >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        writerow = self.writer.writerow
+        buffer = self.buffer
+        while buffer:
+            writerow(buffer.popleft())
+        self.file.flush()
+        self.flushes += 1
+        if self.fsync:
+            os.fsync(self.file.fileno())
+            self.fsyncs += 1
+        self.flushed_at = time.monotonic()
+
+    def close(self):
+        self.flush()
+        filepath = getattr(self.file, 'name', None)
+        self.file.close()
+        if self.final_path is not None:
+            os.replace(filepath, self.final_path)
+
+
+def recover_file(filepath):
+    """ Cuts off an incomplete last row of a '.part' file and gives it its final name
+
+    :param filepath: path of the '.part' file
+    :returns: the final path
+    """
+    final_path = filepath[:-len(part_suffix)]
+    with open(filepath, 'r+b') as f:
+        data = f.read()
+        if final_path.endswith('.oirec'):
+            # binary log: keep whole records only
+            from binary_log import read_header
+            f.seek(0)
+            try:
+                header, offset = read_header(f)
+                record_size = 8 * len(header['columns'])
+                length = offset + (len(data) - offset) // record_size * record_size
+            except Exception:
+                length = len(data)   # header incomplete, nothing to repair
+        else:
+            # csv: keep complete lines only
+            length = data.rfind(b'\n') + 1
+        f.truncate(length)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filepath, final_path)
+    return final_path
+
+
+def recover_partial_files(folder, device_name):
+    """ Repairs the '.part' files a crashed recorder left behind in folder
+
+    :param folder: recording folder
+    :param device_name: only files of this device are recovered
+    :returns: list of recovered files
+    """
+    pattern = os.path.join(glob.escape(folder), glob.escape(device_name) + '-*' + part_suffix)
+    return [recover_file(filepath) for filepath in sorted(glob.glob(pattern))]
@@ -6,48 +6,90 @@ import argparse
 import getpass
 from datetime import datetime
 from datetime import timedelta
+from functools import partial
 import urllib3
 from os import path
 from os import getcwd
-import numpy as np
 import time
 import json
-from jsonpath_ng import jsonpath, parse
+import re
+import sys
 
-# csv mapping config
+# make the shared openinterface package importable when running from this folder
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+from openinterface.extraction import compile_path, compile_row
+from openinterface.fetch import Fetcher
+from openinterface.metrics import Registry, MetricsServer, expose_sampling_stats, expose_fetch_stats, expose_poll_guard
+from openinterface.pipeline import PollingPipeline
+from openinterface.resilience import PollGuard
+from openinterface.scheduler import add_rate_argument
+import logging
+import binary_log
+from buffered_writer import BufferedRowWriter, recover_partial_files, part_suffix
+from segments import SegmentArchiver, Segment, segment_filepath, compression_suffixes
+
+def seconds_since_start(occured_at, roti_data=None, roti_value=None, decimals=0):
+    """ Transform of "Time s": the seconds since the start of the run, whole
+    seconds like the I-300pro or rounded to decimals (see compile_csv_mapping) """
+    seconds = round(occured_at.total_seconds(), decimals)
+    return int(seconds) if decimals == 0 else seconds
+
+# csv mapping config, one tuple per column
 # - Header title
 # - a lambda for transforming data
 # - a jsonpath expression for selecting a value
-csv_mapping = np.array([
-        ["Time s", lambda occured_at, roti_data, roti_value: int(round(occured_at.total_seconds(),0)), None],
-        ["PressureAct mbar", None, '$.vacuum.act'],
-        ["PressureSet", None, '$.vacuum.set'],
-        ["BathAct", None, '$.heating.act'],
-        ["BathSet", None, '$.heating.set'],
-        ["ChillerAct", None, '$.cooling.act'],
-        ["ChillerSet", None, '$.cooling.set'],
-        ["Rotation rpm", None, '$.rotation.act'],
-        ["Vapor", None, '$.vacuum.vaporTemp'],
-        ["AutoDestIn", None, '$.vacuum.autoDestIn'],
-        ["AutoDestOut", None, '$.vacuum.autoDestOut'],
-        ["AutoDestDiff", lambda occured_at, roti_data, roti_value: round(roti_data['vacuum']['autoDestOut'] - roti_data['vacuum']['autoDestIn'], 2), None],
-        ["LiftAct", None, '$.lift.act'],
-        ["LiftEnd", None, '$.lift.limit'],
-        ["Hold", None, '$.globalStatus.onHold'],
-        ["Foam control", None, '$.globalStatus.foamActive'],
-        ["PumpAct[0.1%]", None, '$.vacuum.powerPercentAct'],
-        ["VacOpen", None, '$.vacuum.vacuumValveOpen']
-    ])
+csv_mapping = (
+        ("Time s", seconds_since_start, None),
+        ("PressureAct mbar", None, '$.vacuum.act'),
+        ("PressureSet", None, '$.vacuum.set'),
+        ("BathAct", None, '$.heating.act'),
+        ("BathSet", None, '$.heating.set'),
+        ("ChillerAct", None, '$.cooling.act'),
+        ("ChillerSet", None, '$.cooling.set'),
+        ("Rotation rpm", None, '$.rotation.act'),
+        ("Vapor", None, '$.vacuum.vaporTemp'),
+        ("AutoDestIn", None, '$.vacuum.autoDestIn'),
+        ("AutoDestOut", None, '$.vacuum.autoDestOut'),
+        ("AutoDestDiff", lambda occured_at, roti_data, roti_value: round(roti_data['vacuum']['autoDestOut'] - roti_data['vacuum']['autoDestIn'], 2), None),
+        ("LiftAct", None, '$.lift.act'),
+        ("LiftEnd", None, '$.lift.limit'),
+        ("Hold", None, '$.globalStatus.onHold'),
+        ("Foam control", None, '$.globalStatus.foamActive'),
+        ("PumpAct[0.1%]", None, '$.vacuum.powerPercentAct'),
+        ("VacOpen", None, '$.vacuum.vacuumValveOpen'),
+    )
+csv_header = [m[0] for m in csv_mapping] # column titles, the first line of every file
 csv_dialect = csv.excel # see https://docs.python.org/3/library/csv.html#dialects-and-formatting-parameters
 timestamp_after_csvheader = "%d.%m.%Y %H:%M" # set this to None if you don't wan't this second header line
 missing_value_char = '*' #set this to None for an empty cell
+write_buffer_size = 1 << 16 # bytes buffered by the file object, a flush is a single write call up to this size
+queue_size = 60 # samples that may wait for a slow disk before new samples are dropped
+size_check_rows = 100 # rows between two checks of the segment size
+
+def decimals_for_interval(interval, maximum=3):
+    """ :returns: the decimals "Time s" needs to tell samples taken every interval seconds apart """
+    decimals = 0
+    while interval < 1 and decimals < maximum and abs(round(interval, decimals) - interval) > 1e-9:
+        decimals += 1
+    return decimals
 
-def build_filepath(folder, device_name, started_at):
+def build_filepath(folder, device_name, started_at, extension='.csv'):
     started_at_str = started_at.strftime("%Y-%m-%dT%H%M%S-%f")
-    filename = f"{device_name}-{started_at_str}.csv"
+    filename = f"{device_name}-{started_at_str}{extension}"
     return path.join(folder, filename)
 
+def parse_filepath(filepath):
+    """ Reads device name and start time from a file name built by build_filepath
+
+    :returns: (device_name, started_at), None for other file names
+    """
+    match = re.match(r"(.+)-(\d{4}-\d{2}-\d{2}T\d{6}-\d{6})(\..*)?$", path.basename(filepath))
+    if match is None:
+        return None
+    return match.group(1), datetime.strptime(match.group(2), "%Y-%m-%dT%H%M%S-%f")
+
 def get_value(occured_at, roti_data, transform, jsonp):
+    from jsonpath_ng import parse   # only this slow reference implementation parses at runtime
     try:
         roti_value = None
         if jsonp is not None:
@@ -60,6 +102,184 @@ def get_value(occured_at, roti_data, transform, jsonp):
     except:
         return missing_value_char
 
+def compile_column(transform, jsonp):
+    """ Compiles one row of the mapping table into a column function with the
+    same behaviour as get_value, but without parsing the jsonpath every time """
+    accessor = compile_path(jsonp) if jsonp is not None else None
+    if transform is None:
+        def column(roti_data, occured_at):
+            roti_value = accessor(roti_data)
+            return roti_value if roti_value is not None else missing_value_char
+    elif accessor is None:
+        def column(roti_data, occured_at):
+            return transform(occured_at, roti_data, None)
+    else:
+        def column(roti_data, occured_at):
+            return transform(occured_at, roti_data, accessor(roti_data))
+    return column
+
+def compile_csv_mapping(mapping, time_decimals=0):
+    """ Compiles the mapping table into a function that returns a whole csv row
+    for a process document: extract_row(roti_data, occured_at)
+
+    :param time_decimals: decimals of the seconds_since_start columns (see decimals_for_interval)
+    """
+    columns = []
+    for title, transform, jsonp in mapping:
+        if transform is seconds_since_start:
+            transform = partial(seconds_since_start, decimals=time_decimals)
+        columns.append(compile_column(transform, jsonp))
+    return compile_row(columns, missing_value_char)
+
+class CsvRecorder(object):
+    """ Records the process data of one device into csv files. A new file is
+    started whenever the device starts running and closed once it stops.
+    Pass every polled process document to record(), and call gap() when the
+    device stops answering during a run.
+
+    :param folder: destination folder
+    :param device_name: name of the device, used in the file names
+    :param output_format: 'csv' or 'binary' (see binary_log.py)
+    :param flush_rows: write buffered rows to the file every n rows
+    :param flush_seconds: write buffered rows to the file every t seconds
+    :param crash_safe: fsync every flush, record into '.part' files and
+                       recover '.part' files left behind by a crash
+    :param rotate_bytes: start a new segment when the file reaches this size
+    :param rotate_seconds: start a new segment after this many seconds
+    :param compression: compress closed segments with 'gzip' or 'zstd' (see segments.py)
+    :param time_decimals: decimals of "Time s", 0 for whole seconds like the I-300pro (see decimals_for_interval)
+    """
+
+    def __init__(self, folder, device_name, output_format='csv', flush_rows=None, flush_seconds=None, crash_safe=False,
+                 rotate_bytes=None, rotate_seconds=None, compression=None, time_decimals=0):
+        self.folder = folder
+        self.device_name = device_name
+        self.output_format = output_format
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.crash_safe = crash_safe
+        if crash_safe:
+            for filepath in recover_partial_files(folder, device_name):
+                print(f"Recovered {filepath}")
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.archiver = SegmentArchiver(folder, compression)
+        self.extract_row = compile_csv_mapping(csv_mapping, time_decimals)
+        self.started_at = None
+        self.run_id = None
+        self.segment = 0
+        self.segment_started_at = None
+        self.segment_ended_at = None
+        self.segment_rows = 0
+        self.rows = 0   # rows recorded in all runs
+        self.gaps = 0   # gap markers recorded
+        self.current_path = None
+        self.current_file = None
+        self.current_file_writer = None
+
+    @property
+    def is_recording(self):
+        return self.current_file is not None
+
+    def record(self, poll_at, proc_msg):
+        """ Handles one polled process document
+
+        :param poll_at: the (scheduled) time the document was polled at
+        :param proc_msg: the process document
+        """
+        status = proc_msg["globalStatus"]
+        is_running = status["running"]
+        run_id = status.get("runId")
+
+        # check whether we need to start or stop the recording, a new run id starts a new run
+        if self.is_recording and (not is_running or run_id != self.run_id):
+            self.close()
+        if is_running and not self.is_recording:
+            self.start(poll_at, run_id)
+
+        # add current data (if there is an open file)
+        if self.current_file is not None:
+            if self.segment_full(poll_at):
+                self.rotate(poll_at)
+            occured_at = poll_at - self.started_at
+            self.current_file_writer.writerow(self.extract_row(proc_msg, occured_at))
+            self.segment_rows += 1
+            self.rows += 1
+            self.segment_ended_at = poll_at
+
+    def gap(self, poll_at, error):
+        """ Marks the start of an outage in the current recording: a row with
+        the time and missing values for all process data. The recording stays
+        open, the next polled document continues it.
+
+        :param poll_at: the (scheduled) time of the first failed poll
+        :param error: the exception of the failed poll
+        """
+        if self.current_file is None:
+            return
+        occured_at = poll_at - self.started_at
+        self.current_file_writer.writerow(self.extract_row({}, occured_at))
+        self.segment_rows += 1
+        self.gaps += 1
+        self.segment_ended_at = poll_at
+
+    def start(self, started_at, run_id=None):
+        # start a new run
+        self.started_at = started_at
+        self.run_id = run_id
+        self.segment = 0
+        self.open_segment(started_at)
+
+    def open_segment(self, segment_started_at):
+        self.segment_started_at = segment_started_at
+        self.segment_ended_at = segment_started_at
+        self.segment_rows = 0
+        extension = binary_log.extension if self.output_format == 'binary' else '.csv'
+        filepath = segment_filepath(build_filepath(self.folder, self.device_name, self.started_at, extension), self.segment)
+        openpath = filepath + part_suffix if self.crash_safe else filepath
+        self.current_path = filepath
+        if self.output_format == 'binary':
+            self.current_file = binary_log.BinaryLogWriter(openpath, csv_header, self.device_name, self.started_at)
+            writer = self.current_file
+        else:
+            self.current_file = open(openpath, 'w+', newline='', buffering=write_buffer_size)
+            writer = csv.writer(self.current_file, dialect=csv_dialect)
+        self.current_file_writer = BufferedRowWriter(writer, self.current_file,
+            flush_rows=self.flush_rows, flush_seconds=self.flush_seconds, fsync=self.crash_safe,
+            final_path=filepath if self.crash_safe else None)
+        if self.output_format == 'csv':
+            # write header, every segment gets the start of the run
+            self.current_file_writer.writerow(csv_header)
+            if timestamp_after_csvheader is not None:
+                self.current_file_writer.writerow([self.started_at.strftime(timestamp_after_csvheader)])
+
+    def segment_full(self, poll_at):
+        if self.segment_rows == 0:
+            return False
+        if self.rotate_seconds is not None and (poll_at - self.segment_started_at).total_seconds() >= self.rotate_seconds:
+            return True
+        # the size is checked every size_check_rows rows, rows still in the buffer are not counted
+        if self.rotate_bytes is not None and self.segment_rows % size_check_rows == 0:
+            return self.current_file.tell() >= self.rotate_bytes
+        return False
+
+    def rotate(self, poll_at):
+        self.close_segment()
+        self.segment += 1
+        self.open_segment(poll_at)
+
+    def close_segment(self):
+        # writes the remaining buffered rows and hands the file to the archiver
+        self.current_file_writer.close()
+        self.archiver.add(Segment(self.current_path, self.device_name, self.run_id, self.segment,
+                                  self.segment_started_at, self.segment_ended_at, self.segment_rows))
+        self.current_file = None
+        self.current_file_writer = None
+
+    def close(self):
+        if self.current_file is not None:
+            self.close_segment()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Remotely logs rotavapor process data into a CSV file. The format is the same as the I-300pro writes to its SD card.')
 
@@ -68,8 +288,18 @@ if __name__ == "__main__":
     parser.add_argument('-p', '--password', type=str, help='device password', required=False)
     parser.add_argument('-f', '--folder', type=str, help='destination folder for the csv files', default=getcwd())
     parser.add_argument('-c', '--cert', type=str, help="root cert file", default="root_cert.crt")
+    parser.add_argument('--format', type=str, choices=['csv', 'binary'], help="output format, binary logs can be converted to csv with binary_log.py", default='csv')
+    parser.add_argument('--flush-rows', type=int, help="write buffered rows to the file every n rows", required=False)
+    parser.add_argument('--flush-seconds', type=float, help="write buffered rows to the file every t seconds", required=False)
+    parser.add_argument('--crash-safe', action='store_true', help="fsync every flush and recover files of a crashed recording")
+    parser.add_argument('--rotate-mb', type=float, help="start a new segment file when the current one reaches this size in MB", required=False)
+    parser.add_argument('--rotate-minutes', type=float, help="start a new segment file every n minutes", required=False)
+    parser.add_argument('--compress', type=str, choices=list(compression_suffixes), help="compress closed segments in the background (zstd needs the zstandard package)", required=False)
+    parser.add_argument('--metrics-port', type=int, help="serve Prometheus metrics on http://127.0.0.1:port/metrics", required=False)
+    add_rate_argument(parser)
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
 
     # ask for password if it wasn't passed in as command line argument
     if args.password is None:
@@ -101,45 +331,44 @@ if __name__ == "__main__":
     if info_msg["systemClass"] != "Rotavapor":
         raise Exception(f"This is not a Rotavapor")
         
-    # wait for start
-    started_at = None
-    poll_at = datetime.now()
-    current_file = None
-    current_file_writer = None
-    is_recording = False
-    while True:
-        # read process data
-        proc_resp = session.get(process_endpoint)
-        if proc_resp.status_code != 200:
-            raise Exception("Unexpected status code when polling process data", proc_resp.status_code)
-        proc_msg = proc_resp.json()
-        is_running =  proc_msg["globalStatus"]["running"]
-
-        # check whether we need to start or stop the recording
-        if is_running and not is_recording:
-            # start a new file
-            started_at = poll_at
-            csvpath = build_filepath(args.folder, system_name, started_at)
-            current_file = open(csvpath, 'w+', newline='')
-            current_file_writer = csv.writer(current_file, dialect=csv_dialect)
-            # write header
-            current_file_writer.writerow(csv_mapping[:,0])
-            if timestamp_after_csvheader is not None:
-                current_file_writer.writerow([started_at.strftime(timestamp_after_csvheader)])
-            is_recording = True
-        if not is_running and is_recording:
-            # close file
-            current_file.close()
-            current_file = None
-            is_recording = False
+    # every sample is recorded, even if it didn't change, and the transforms may read
+    # any part of the document, so the fetcher only speeds up decoding
+    fetcher = Fetcher()
 
-        # add current data (if there is an open file)
-        if current_file is not None:
-            occured_at = poll_at - started_at
-            current_file_writer.writerow([get_value(occured_at, proc_msg, m[1], m[2]) for m in csv_mapping])
-
-        # delay execution so that we poll once every second
-        poll_at = poll_at + timedelta(seconds=1)
-        sleep_for = (poll_at - datetime.now()).total_seconds()
-        if sleep_for > 0:
-            time.sleep(sleep_for)
\ No newline at end of file
+    # a device that doesn't answer is retried with backoff, the recording continues once it answers again
+    guard = PollGuard(1 / args.rate, system_name)
+
+    def read_process():
+        # read process data, unchanged documents are recorded as well (see fetcher above)
+        return fetcher.fetch(session, process_endpoint, timeout=guard.timeout)[0]
+
+    # wait for start: poll at the sampling rate on one thread, write the files on another
+    recorder = CsvRecorder(args.folder, system_name, args.format, args.flush_rows, args.flush_seconds, args.crash_safe,
+        rotate_bytes=args.rotate_mb * 1e6 if args.rotate_mb else None,
+        rotate_seconds=args.rotate_minutes * 60 if args.rotate_minutes else None,
+        compression=args.compress, time_decimals=decimals_for_interval(1 / args.rate))
+    pipeline = PollingPipeline(read_process, recorder.record, interval=1 / args.rate, maxsize=queue_size,
+                               guard=guard, gap=recorder.gap)
+    if args.metrics_port is not None:
+        metrics = Registry('csv_recorder')
+        expose_sampling_stats(metrics, pipeline.stats)
+        expose_fetch_stats(metrics, fetcher.stats)
+        expose_poll_guard(metrics, guard)
+        metrics.gauge('queue_depth', 'samples waiting for the writer', pipeline.queue.qsize)
+        metrics.add('write_seconds', 'histogram', 'time the writer needs per sample', pipeline.consume_time)
+        metrics.add('rows_total', 'counter', 'rows recorded', lambda: recorder.rows)
+        metrics.add('gaps_total', 'counter', 'gap markers recorded for outages', lambda: recorder.gaps)
+        metrics.add('segments_archived_total', 'counter', 'closed segments compressed and indexed', lambda: recorder.archiver.archived)
+        server = MetricsServer(metrics, ('127.0.0.1', args.metrics_port)).start()
+        print(f"Serving metrics on {server.url}")
+    try:
+        pipeline.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        recorder.close()
+        recorder.archiver.close()
+        print(f"Samples: {pipeline.stats.summary()}")
+        print(f"Polling: {guard.summary()}, {recorder.gaps} gaps recorded")
+        print(f"Segments: {recorder.archiver.summary()}")
+        print(f"Fetch: {fetcher.stats.summary()}")
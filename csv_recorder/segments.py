@@ -0,0 +1,275 @@
+#! /usr/bin/env python3
+"""
+Segments of recordings, background compression and segment index
+--------------------------------------------------------------------------
+
+csv_recorder writes a run into one or more segment files. A new segment is
+started when the run ends, when globalStatus.runId changes, and optionally
+when the current segment reaches a size or a duration. Segments after the
+first one of a run get a number before the extension:
+
+    R-300-2020-06-15T142351-000000.csv
+    R-300-2020-06-15T142351-000000.001.csv
+
+Every segment is a complete file with its own header. The "Time s" column
+counts from the start of the run.
+
+Closed segments are handed to a SegmentArchiver. Its thread compresses them
+(gzip, or zstd if the zstandard package is installed) and appends one line
+per segment to the index file of the folder, so the recording thread never
+waits for either. The index lists file, device, run id, segment number,
+time of the first and the last row and the number of rows (index_columns,
+there is no header line). Every row is appended with a single write, so
+recorders in several threads or processes can share a folder. Rows that
+can't be parsed, e.g. cut off by a crash, are skipped when reading.
+find_segments() uses the index to locate the files of a time window:
+
+    python segments.py recordings/ --start 2020-06-15T14:00 --end 2020-06-15T15:00
+"""
+
+import argparse
+import csv
+import gzip
+import io
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+from datetime import datetime
+from os import path
+
+log = logging.getLogger(__name__)
+
+index_filename = 'segments.idx' # csv file, not named *.csv so it isn't taken for a recording
+index_columns = ['file', 'device', 'run_id', 'segment', 'started_at', 'ended_at', 'rows']
+compression_suffixes = {'gzip': '.gz', 'zstd': '.zst'}
+gzip_level = 6 # 1 (fast) to 9 (small)
+copy_buffer_size = 1 << 20 # bytes compressed at once
+
+
+def segment_filepath(filepath, segment):
+    """ Inserts the segment number before the extension, segment 0 keeps the name """
+    if segment == 0:
+        return filepath
+    base, extension = path.splitext(filepath)
+    return f"{base}.{segment:03d}{extension}"
+
+
+def segment_number(filepath):
+    """ :returns: the segment number of a file name built by segment_filepath """
+    name = path.basename(filepath)
+    compression = compression_of(name)
+    if compression is not None:
+        name = name[:-len(compression_suffixes[compression])]
+    match = re.search(r"\.(\d{3,})\.[^.]+$", name)
+    return int(match.group(1)) if match else 0
+
+
+def compression_of(filepath):
+    """ :returns: the compression of a file according to its suffix, None if it isn't compressed """
+    for compression, suffix in compression_suffixes.items():
+        if filepath.endswith(suffix):
+            return compression
+    return None
+
+
+def open_compressed(filepath, mode='rb', compression=None):
+    """ Opens a file, decompressing or compressing it
+
+    :param compression: 'gzip', 'zstd', None to choose by the suffix of filepath
+    """
+    compression = compression or compression_of(filepath)
+    if compression == 'gzip':
+        return gzip.open(filepath, mode, compresslevel=gzip_level) if 'w' in mode else gzip.open(filepath, mode)
+    if compression == 'zstd':
+        import zstandard   # optional dependency
+        return zstandard.open(filepath, mode)
+    return open(filepath, mode)
+
+
+def open_text(filepath):
+    """ Opens a (compressed) csv file for reading """
+    return io.TextIOWrapper(open_compressed(filepath, 'rb'), newline='')
+
+
+def compress_file(filepath, compression):
+    """ Compresses a file and removes the original
+
+    :param compression: 'gzip' or 'zstd'
+    :returns: path of the compressed file
+    """
+    target = filepath + compression_suffixes[compression]
+    temporary = target + '.tmp'
+    with open(filepath, 'rb') as src, open_compressed(temporary, 'wb', compression) as dst:
+        shutil.copyfileobj(src, dst, copy_buffer_size)
+    os.replace(temporary, target)
+    os.remove(filepath)
+    return target
+
+
+class Segment(object):
+    """ A closed segment file
+
+    :param filepath: path of the file
+    :param device_name: name of the recorded device
+    :param run_id: globalStatus.runId of the run
+    :param number: segment number within the run
+    :param started_at: time of the first row
+    :param ended_at: time of the last row
+    :param rows: number of rows
+    """
+
+    def __init__(self, filepath, device_name, run_id, number, started_at, ended_at, rows):
+        self.filepath = filepath
+        self.device_name = device_name
+        self.run_id = run_id
+        self.number = number
+        self.started_at = started_at
+        self.ended_at = ended_at
+        self.rows = rows
+
+    def index_row(self):
+        return [path.basename(self.filepath), self.device_name, self.run_id, self.number,
+                self.started_at.isoformat(), self.ended_at.isoformat(), self.rows]
+
+
+class SegmentArchiver(object):
+    """ Compresses closed segments and indexes them on a background thread
+
+    :param folder: recording folder, the index file is written there
+    :param compression: 'gzip', 'zstd' or None to keep the files as they are
+    """
+
+    def __init__(self, folder, compression=None):
+        if compression == 'zstd':
+            import zstandard   # fail at startup, not after the first segment
+        self.index_path = path.join(folder, index_filename)
+        self.compression = compression
+        self.queue = queue.Queue()
+        self.thread = None
+        self.archived = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    def add(self, segment):
+        """ Queues a closed segment, returns immediately """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='archiver', daemon=True)
+            self.thread.start()
+        self.queue.put(segment)
+
+    def run(self):
+        while True:
+            segment = self.queue.get()
+            if segment is None:
+                break
+            try:
+                self.archive(segment)
+            except Exception as e:
+                log.error("Archiving %s failed: %s", segment.filepath, e)
+
+    def archive(self, segment):
+        size = path.getsize(segment.filepath)
+        if self.compression is not None:
+            segment.filepath = compress_file(segment.filepath, self.compression)
+        self.raw_bytes += size
+        self.stored_bytes += path.getsize(segment.filepath)
+        append_index(self.index_path, segment)
+        self.archived += 1
+
+    def close(self):
+        """ Waits until the queued segments are archived """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def summary(self):
+        ratio = self.stored_bytes / self.raw_bytes if self.raw_bytes else 1.0
+        return f"{self.archived} segments, {self.raw_bytes / 1e6:.1f} MB stored as {self.stored_bytes / 1e6:.1f} MB ({ratio:.0%})"
+
+
+index_locks = {}    # one lock per index file, shared by the archivers of this process
+index_locks_lock = threading.Lock()
+
+
+def index_lock(index_path):
+    with index_locks_lock:
+        return index_locks.setdefault(path.abspath(index_path), threading.Lock())
+
+
+def append_index(index_path, segment):
+    """ Appends the row of a segment to the index
+
+    The row is written with a single write call on a file opened with
+    O_APPEND, so rows of archivers in other processes don't interleave.
+    """
+    line = io.StringIO()
+    csv.writer(line).writerow(segment.index_row())
+    data = line.getvalue().encode()
+    with index_lock(index_path):
+        fd = os.open(index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def parse_index_row(row):
+    """ :returns: dict with the index_columns, None if the row can't be parsed """
+    if len(row) != len(index_columns):
+        return None
+    entry = dict(zip(index_columns, row))
+    try:
+        int(entry['segment'])
+        int(entry['rows'])
+        datetime.fromisoformat(entry['started_at'])
+        datetime.fromisoformat(entry['ended_at'])
+    except ValueError:
+        return None
+    return entry
+
+
+def read_index(folder):
+    """ :returns: list of dicts with the index_columns of the segments in folder """
+    index_path = path.join(folder, index_filename)
+    if not path.exists(index_path):
+        return []
+    with open(index_path, newline='') as f:
+        # skips partial rows and the header line of older indexes
+        entries = (parse_index_row(row) for row in csv.reader(f))
+        return [entry for entry in entries if entry is not None]
+
+
+def find_segments(folder, start=None, end=None, device_name=None):
+    """ Segments with rows between start and end
+
+    :param start, end: datetimes limiting the window, None for open ends
+    :param device_name: only segments of this device
+    :returns: index entries of the segments, the 'file' entry is a path in folder
+    """
+    found = []
+    for entry in read_index(folder):
+        if device_name is not None and entry['device'] != device_name:
+            continue
+        if start is not None and datetime.fromisoformat(entry['ended_at']) < start:
+            continue
+        if end is not None and datetime.fromisoformat(entry['started_at']) > end:
+            continue
+        entry['file'] = path.join(folder, entry['file'])
+        found.append(entry)
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Lists the recorded segments with rows in a time window.')
+    parser.add_argument('folder', type=str, help='recording folder with the segment index')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='start of the window, e.g. 2020-06-15T14:00', required=False)
+    parser.add_argument('--end', type=datetime.fromisoformat, help='end of the window', required=False)
+    parser.add_argument('-d', '--device', type=str, help='only segments of this device', required=False)
+    args = parser.parse_args()
+
+    for entry in find_segments(args.folder, args.start, args.end, args.device):
+        print(f"{entry['file']}  {entry['started_at']} - {entry['ended_at']}  run {entry['run_id']}, {entry['rows']} rows")
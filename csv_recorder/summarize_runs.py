@@ -0,0 +1,337 @@
+#! /usr/bin/env python3
+"""
+Per-run summaries of csv_recorder recordings
+--------------------------------------------------------------------------
+
+Reads csv files and binary logs (.oirec) of csv_recorder, also compressed and
+split into segments (see segments.py), and writes one summary row per run
+into a single csv table, keyed by device name and start time:
+
+- samples and duration of the run
+- seconds until the vacuum reached its set point (within a tolerance)
+- peak vapor temperature and when it was reached
+- mean, standard deviation, minimum and maximum of AutoDestDiff
+- pump duty: fraction of samples with the pump running and mean pump power
+
+Files are read in chunks of rows, so memory stays bounded however long a run
+is. Every run is summarized in a worker process, so many runs are processed
+on all cores:
+
+    python summarize_runs.py recordings/ -o summary.csv
+"""
+
+import argparse
+import csv
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from glob import glob, escape
+from os import path
+
+import numpy as np
+
+import binary_log
+from buffered_writer import part_suffix
+from segments import compression_suffixes, compression_of, open_text, segment_number
+from csv_recorder import csv_dialect, timestamp_after_csvheader, missing_value_char, parse_filepath
+
+# recorded columns used by the summary (see csv_recorder.csv_mapping)
+time_column = "Time s"
+pressure_act_column = "PressureAct mbar"
+pressure_set_column = "PressureSet"
+vapor_column = "Vapor"
+autodest_diff_column = "AutoDestDiff"
+pump_column = "PumpAct[0.1%]"
+used_columns = (time_column, pressure_act_column, pressure_set_column, vapor_column, autodest_diff_column, pump_column)
+
+vacuum_tolerance = 5.0 # mbar, the vacuum counts as reached within this distance of the set point
+chunk_rows = 10000 # rows read at once
+
+summary_columns = [
+    "device", "started_at", "file", "segments", "samples", "duration_s", "time_to_vacuum_s",
+    "peak_vapor", "peak_vapor_at_s",
+    "autodest_diff_mean", "autodest_diff_std", "autodest_diff_min", "autodest_diff_max",
+    "pump_duty", "pump_mean",
+]
+
+
+def to_number(cell):
+    """ Converts a csv cell into a float, NaN for missing values """
+    if cell == 'True':
+        return 1.0
+    if cell == 'False':
+        return 0.0
+    try:
+        return float(cell)
+    except ValueError:
+        return math.nan     # missing_value_char or empty cell
+
+
+def csv_chunks(filepath, size=chunk_rows):
+    """ Reads a csv file of csv_recorder in chunks
+
+    :returns: (start time from the timestamp line or None, generator of chunks).
+              A chunk is a dict of column title to float array, with the used
+              columns that are in the file.
+    """
+    f = open_text(filepath)
+    reader = csv.reader(f, dialect=csv_dialect)
+    titles = next(reader, [])
+    started_at = None
+    first = next(reader, None)
+    if first is not None and len(first) == 1 and timestamp_after_csvheader is not None:
+        try:
+            started_at = datetime.strptime(first[0], timestamp_after_csvheader)
+            first = None
+        except ValueError:
+            pass
+    indices = {title: titles.index(title) for title in used_columns if title in titles}
+
+    def chunks():
+        with f:
+            rows = [first] if first is not None else []
+            for row in reader:
+                rows.append(row)
+                if len(rows) == size:
+                    yield to_chunk(rows)
+                    rows = []
+            if rows:
+                yield to_chunk(rows)
+
+    def to_chunk(rows):
+        chunk = {}
+        for title, i in indices.items():
+            chunk[title] = np.array([to_number(row[i]) if i < len(row) else math.nan for row in rows])
+        return chunk
+
+    return started_at, chunks()
+
+
+def binary_chunks(filepath, size=chunk_rows):
+    """ Reads a binary log in chunks, memory-mapped or decompressed as a stream
+
+    :returns: (header dict, generator of chunks), see csv_chunks
+    """
+    header, records = binary_log.read_chunks(filepath, size)
+    indices = {title: header['columns'].index(title) for title in used_columns if title in header['columns']}
+
+    def chunks():
+        for rows in records:
+            yield {title: np.array(rows[:, i]) for title, i in indices.items()}
+
+    return header, chunks()
+
+
+def recording_extension(filepath):
+    """ :returns: extension of the recording without the compression suffix """
+    compression = compression_of(filepath)
+    if compression is not None:
+        filepath = filepath[:-len(compression_suffixes[compression])]
+    return path.splitext(filepath)[1]
+
+
+class RunSummary(object):
+    """ Summary of one run, accumulated chunk by chunk
+
+    :param tolerance: mbar, the vacuum counts as reached within this distance of the set point
+    """
+
+    def __init__(self, tolerance=vacuum_tolerance):
+        self.tolerance = tolerance
+        self.samples = 0
+        self.first_time = math.nan
+        self.last_time = math.nan
+        self.vacuum_at = math.nan
+        self.peak_vapor = math.nan
+        self.peak_vapor_at = math.nan
+        # AutoDestDiff: count, mean and sum of squared deviations, merged per chunk
+        self.diff_count = 0
+        self.diff_mean = 0.0
+        self.diff_m2 = 0.0
+        self.diff_min = math.nan
+        self.diff_max = math.nan
+        self.pump_count = 0
+        self.pump_running = 0
+        self.pump_sum = 0.0
+
+    def add(self, chunk):
+        """ :param chunk: dict of column title to float array, see csv_chunks """
+        n = len(next(iter(chunk.values()))) if chunk else 0
+        if n == 0:
+            return
+        self.samples += n
+        times = chunk.get(time_column, np.full(n, math.nan))
+        known = np.isfinite(times)
+        if known.any():
+            if math.isnan(self.first_time):
+                self.first_time = times[known][0]
+            self.last_time = times[known][-1]
+
+        if math.isnan(self.vacuum_at) and pressure_act_column in chunk and pressure_set_column in chunk:
+            with np.errstate(invalid='ignore'):
+                reached = np.abs(chunk[pressure_act_column] - chunk[pressure_set_column]) <= self.tolerance
+            reached &= known
+            if reached.any():
+                self.vacuum_at = times[reached.argmax()]
+
+        vapor = chunk.get(vapor_column)
+        if vapor is not None and np.isfinite(vapor).any():
+            i = np.nanargmax(vapor)
+            if math.isnan(self.peak_vapor) or vapor[i] > self.peak_vapor:
+                self.peak_vapor = vapor[i]
+                self.peak_vapor_at = times[i]
+
+        diff = chunk.get(autodest_diff_column)
+        if diff is not None:
+            diff = diff[np.isfinite(diff)]
+            if len(diff):
+                self.add_diff(diff)
+
+        pump = chunk.get(pump_column)
+        if pump is not None:
+            pump = pump[np.isfinite(pump)]
+            self.pump_count += len(pump)
+            self.pump_running += int(np.count_nonzero(pump > 0))
+            self.pump_sum += float(pump.sum())
+
+    def add_diff(self, diff):
+        # merges the chunk into the running statistics (Chan et al.)
+        n, mean = len(diff), float(diff.mean())
+        m2 = float(((diff - mean) ** 2).sum())
+        total = self.diff_count + n
+        delta = mean - self.diff_mean
+        self.diff_mean += delta * n / total
+        self.diff_m2 += m2 + delta * delta * self.diff_count * n / total
+        self.diff_count = total
+        self.diff_min = float(np.fmin(self.diff_min, diff.min()))
+        self.diff_max = float(np.fmax(self.diff_max, diff.max()))
+
+    def result(self):
+        """ :returns: dict with the summary columns after "file" """
+        since_start = lambda t: t - self.first_time
+        return {
+            "samples": self.samples,
+            "duration_s": since_start(self.last_time),
+            "time_to_vacuum_s": since_start(self.vacuum_at),
+            "peak_vapor": self.peak_vapor,
+            "peak_vapor_at_s": since_start(self.peak_vapor_at),
+            "autodest_diff_mean": self.diff_mean if self.diff_count else math.nan,
+            "autodest_diff_std": math.sqrt(self.diff_m2 / self.diff_count) if self.diff_count else math.nan,
+            "autodest_diff_min": self.diff_min,
+            "autodest_diff_max": self.diff_max,
+            "pump_duty": self.pump_running / self.pump_count if self.pump_count else math.nan,
+            "pump_mean": self.pump_sum / self.pump_count if self.pump_count else math.nan,
+        }
+
+
+def summarize_run(filepaths, tolerance=vacuum_tolerance, size=chunk_rows):
+    """ Summarizes one run
+
+    :param filepaths: segment files of the run in order, csv files or binary logs of csv_recorder
+    :returns: dict with the summary columns
+    """
+    summary = RunSummary(tolerance)
+    device = started_at = None
+    for filepath in filepaths:
+        if recording_extension(filepath) == binary_log.extension:
+            header, chunks = binary_chunks(filepath, size)
+            device, started_at = header['device_name'], datetime.fromisoformat(header['started_at'])
+        else:
+            started_at, chunks = csv_chunks(filepath, size)
+        for chunk in chunks:
+            summary.add(chunk)
+    key = parse_filepath(filepaths[0])
+    if key is not None:
+        # the file name has the start time with microseconds
+        device, started_at = key
+    row = {
+        "device": device,
+        "started_at": started_at.isoformat() if started_at is not None else None,
+        "file": path.basename(filepaths[0]),
+        "segments": len(filepaths),
+    }
+    row.update(summary.result())
+    return row
+
+
+def summarize_safely(filepaths, tolerance, size):
+    """ :returns: (summary row or None, error message or None) """
+    try:
+        return summarize_run(filepaths, tolerance, size), None
+    except Exception as e:
+        return None, f"{filepaths[0]}: {e}"
+
+
+def find_recordings(paths, exclude=()):
+    """ Expands folders into the recordings they contain """
+    exclude = {path.abspath(p) for p in exclude}
+    files = []
+    for p in paths:
+        if path.isdir(p):
+            found = []
+            for extension in ('.csv', binary_log.extension):
+                for suffix in ('',) + tuple(compression_suffixes.values()):
+                    found += glob(path.join(escape(p), '*' + extension + suffix))
+        else:
+            found = [p]
+        files += sorted(f for f in found if path.abspath(f) not in exclude and not f.endswith(part_suffix))
+    return files
+
+
+def group_runs(files):
+    """ Groups the segment files of every run, a file without run key is a run of its own
+
+    :returns: list of file lists, the segments of a run in order
+    """
+    runs = {}
+    for filepath in files:
+        key = parse_filepath(filepath)
+        key = (key, recording_extension(filepath)) if key is not None else filepath
+        runs.setdefault(key, []).append(filepath)
+    return [sorted(segments, key=segment_number) for segments in runs.values()]
+
+
+def format_cell(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return missing_value_char
+    if isinstance(value, float):
+        return round(value, 3)
+    return value
+
+
+def write_summaries(outpath, rows):
+    with open(outpath, 'w', newline='') as f:
+        writer = csv.writer(f, dialect=csv_dialect)
+        writer.writerow(summary_columns)
+        for row in rows:
+            writer.writerow([format_cell(row[c]) for c in summary_columns])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Writes one summary row per run of csv_recorder recordings (csv or binary) into a csv table.')
+    parser.add_argument('paths', metavar='path', type=str, nargs='+', help='recordings or folders with recordings')
+    parser.add_argument('-o', '--output', type=str, help='summary csv file', default='summary.csv')
+    parser.add_argument('-j', '--jobs', type=int, help='worker processes (default: number of cores)', required=False)
+    parser.add_argument('--tolerance', type=float, help=f"mbar, the vacuum counts as reached within this distance of the set point (default {vacuum_tolerance:g})", default=vacuum_tolerance)
+    parser.add_argument('--chunk-rows', type=int, help=f"rows read at once (default {chunk_rows})", default=chunk_rows)
+    args = parser.parse_args()
+
+    runs = group_runs(find_recordings(args.paths, exclude=[args.output]))
+    summarize = partial(summarize_safely, tolerance=args.tolerance, size=args.chunk_rows)
+    jobs = args.jobs or os.cpu_count()
+    rows = []
+    errors = []
+    with ProcessPoolExecutor(jobs) as executor:
+        for row, error in executor.map(summarize, runs, chunksize=max(1, len(runs) // (jobs * 4))):
+            if error is not None:
+                errors.append(error)
+            else:
+                rows.append(row)
+    rows.sort(key=lambda row: (row["device"] or '', row["started_at"] or ''))
+    write_summaries(args.output, rows)
+    print(f"{len(rows)} runs summarized into {args.output}")
+    for error in errors:
+        print(f"Skipped {error}", file=sys.stderr)
@@ -0,0 +1,162 @@
+#! /usr/bin/env python3
+"""
+Polls the process data of many Rotavapors from a single process and feeds it
+into the sinks of the other examples: csv recording, stop at a vapor
+temperature and Modbus registers.
+"""
+
+import argparse
+import getpass
+import logging
+import sys
+from os import path
+from queue import Queue, Full
+from threading import Thread
+
+root = path.join(path.dirname(path.abspath(__file__)), '..')
+sys.path.insert(0, root)
+from openinterface.metrics import SampledLog
+from openinterface.poller import Device, FleetPoller
+from openinterface.scheduler import add_rate_argument
+
+log = logging.getLogger(__name__)
+sampled_log = SampledLog(log)
+
+
+def csv_sink(folder, interval=1, maxsize=1000):
+    """ Records every device into its own csv files (see csv_recorder)
+
+    The files are written on a writer thread, like in csv_recorder, so a slow
+    disk doesn't block the event loop. If more than maxsize samples wait for
+    the disk, new samples are dropped and counted in sink.dropped. Call
+    sink.close() to end the running recordings.
+
+    :param folder: destination folder
+    :param interval: poll interval in seconds, sets the decimals of "Time s"
+    :param maxsize: maximum number of samples of all devices waiting for the disk
+    """
+    sys.path.insert(0, path.join(root, 'csv_recorder'))
+    from csv_recorder import CsvRecorder, decimals_for_interval
+    time_decimals = decimals_for_interval(interval)
+    recorders = {}
+    samples = Queue(maxsize)
+
+    def write():
+        # the recorders are only used on this thread
+        while True:
+            item = samples.get()
+            if item is None:
+                break
+            is_gap, device, poll_at, data = item
+            recorder = recorders.get(device.host)
+            try:
+                if not is_gap:
+                    if recorder is None:
+                        recorder = recorders[device.host] = CsvRecorder(folder, device.name, time_decimals=time_decimals)
+                    recorder.record(poll_at, data)
+                elif recorder is not None:
+                    # marks the outage in a running recording
+                    recorder.gap(poll_at, data)
+            except Exception as e:
+                sampled_log.error("Recording %s failed: %s", device.name, e)
+        # ends the running recordings and waits for their segments to be archived
+        for recorder in recorders.values():
+            recorder.close()
+            recorder.archiver.close()
+
+    writer = Thread(target=write, name='csv writer', daemon=True)
+    writer.start()
+
+    def put(item):
+        try:
+            samples.put_nowait(item)
+        except Full:
+            sink.dropped += 1
+            sampled_log.warning("The disk can't keep up, %d samples dropped", sink.dropped)
+
+    def sink(device, poll_at, proc_msg):
+        put((False, device, poll_at, proc_msg))
+
+    def gap(device, poll_at, error):
+        put((True, device, poll_at, error))
+
+    def close():
+        samples.put(None)
+        writer.join()
+    sink.gap = gap
+    sink.close = close
+    sink.dropped = 0
+    return sink
+
+
+def stop_sink(target_value):
+    """ Stops every device whose vapor temp exceeds target_value (see stop_at_vaportemp) """
+    sys.path.insert(0, path.join(root, 'stop_at_vaportemp'))
+    from stop_at_vaportemp import condition, stop_msg, param_name, unit
+
+    def sink(device, poll_at, proc_msg):
+        # only stop running devices, so the stop message is sent once per run
+        if proc_msg["globalStatus"]["running"] and condition(proc_msg, target_value):
+            print(f"{device.name}: {param_name} of {target_value} {unit} has been reached.")
+            return device.put_process(stop_msg)
+    return sink
+
+
+def modbus_sink(blocks):
+    """ Writes the registers of every device into its Modbus datablock (see modbus_server)
+
+    Only changed registers are written, with the datablock's update(), so
+    they are not queued as writes to the device. Registers written by Modbus
+    clients are overwritten with the device value on the next poll.
+
+    :param blocks: dict mapping device host to a modbus_server.CallbackDataBlock
+    """
+    sys.path.insert(0, path.join(root, 'modbus_server'))
+    from modbus_server import register_plan, cnt
+    from register_plan import RegisterUpdater
+    updaters = {host: RegisterUpdater(block, 1, cnt) for host, block in blocks.items()}   # modbus address 1 = modbus_mapping[0]
+
+    def sink(device, poll_at, proc_msg):
+        updater = updaters[device.host]
+        updater.update(register_plan.encode(proc_msg), updater.block.take_written())
+    return sink
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Polls many rotavapors concurrently and records them into CSV files and/or stops them at a vapor temperature.')
+    parser.add_argument('hosts', metavar='host', type=str, nargs='+', help='hosts or IPs of rotavapors')
+    parser.add_argument('-u', '--user', type=str, help='device user', default='rw')
+    parser.add_argument('-p', '--password', type=str, help='device password (same for all devices)', required=False)
+    parser.add_argument('-f', '--folder', type=str, help='destination folder for the csv files (no recording if omitted)', required=False)
+    parser.add_argument('-t', '--temp', type=float, help='stop devices once this vapor temp in °C is reached', required=False)
+    parser.add_argument('-c', '--cert', type=str, help="root cert file", default="root_cert.crt")
+    parser.add_argument('--http', action='store_true', help='use plain http (fake devices)')
+    add_rate_argument(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    # ask for password if it wasn't passed in as command line argument
+    if args.password is None:
+        args.password = getpass.getpass()
+
+    scheme = 'http' if args.http else 'https'
+    devices = [Device(host, args.user, args.password, args.cert, scheme) for host in args.hosts]
+
+    sinks = []
+    if args.folder is not None:
+        # as many waiting samples per device as csv_recorder allows (queue_size)
+        sinks.append(csv_sink(args.folder, 1 / args.rate, maxsize=60 * len(devices)))
+    if args.temp is not None:
+        sinks.append(stop_sink(args.temp))
+    if not sinks:
+        parser.error("nothing to do, pass --folder and/or --temp")
+
+    try:
+        FleetPoller(devices, sinks, interval=1 / args.rate).run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for sink in sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
@@ -0,0 +1,317 @@
+"""
+Live view of Rotavapor process values for Jupyter
+--------------------------------------------------------------------------
+
+Plots several values of the /process document at once without slowing down
+over long runs and without freezing the notebook on slow responses:
+
+- a background thread polls the device, the plot never waits for a request
+- the recent values are kept in a fixed size NumPy ring buffer
+- the lines are redrawn with blitting, the axes are only redrawn when a
+  limit changes
+- the whole run is kept downsampled (min/max per bucket), so zoomed out views
+  show every peak with a bounded number of points
+- a device that doesn't answer is backed off (see resilience.py) and the
+  outage is shown as a gap in the lines
+
+    poller = Poller(session, process_endpoint, {'bath': '$.heating.act', 'vapor': '$.vacuum.vaporTemp'})
+    poller.start()
+    view = LiveView(poller)
+    view.start()
+"""
+
+import sys
+import threading
+import time
+from datetime import datetime
+from os import path
+
+import numpy as np
+
+# make the shared openinterface package importable when running from this folder
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+from openinterface.extraction import compile_path
+from openinterface.fetch import Fetcher
+from openinterface.resilience import PollGuard
+from openinterface.scheduler import Scheduler
+
+
+class RingBuffer(object):
+    """ The last capacity samples of several channels
+
+    :param capacity: number of samples kept
+    :param channels: number of values per sample
+    """
+
+    def __init__(self, capacity, channels):
+        self.times = np.full(capacity, np.nan)
+        self.values = np.full((capacity, channels), np.nan)
+        self.index = 0
+        self.count = 0
+
+    def append(self, t, values):
+        self.times[self.index] = t
+        self.values[self.index] = values
+        self.index = (self.index + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    def data(self):
+        """ :returns: (times, values) of the kept samples, oldest first """
+        if self.count < len(self.times):
+            return self.times[:self.count].copy(), self.values[:self.count].copy()
+        order = np.r_[self.index:len(self.times), 0:self.index]
+        return self.times[order], self.values[order]
+
+
+class HistoryBuffer(object):
+    """ All samples of a run, downsampled to at most capacity buckets
+
+    Every bucket keeps the minimum and maximum of its samples. When all buckets
+    are used, neighbouring buckets are merged and new buckets take twice as
+    many samples.
+
+    :param capacity: number of buckets (even)
+    :param channels: number of values per sample
+    """
+
+    def __init__(self, capacity, channels):
+        self.times = np.full(capacity, np.nan)
+        self.minimum = np.full((capacity, channels), np.nan)
+        self.maximum = np.full((capacity, channels), np.nan)
+        self.count = 0          # complete buckets
+        self.size = 1           # samples per bucket
+        self.pending = 0        # samples in the current bucket
+
+    def append(self, t, values):
+        values = np.asarray(values, dtype=float)
+        i = self.count
+        if self.pending == 0:
+            self.times[i] = t
+            self.minimum[i] = values
+            self.maximum[i] = values
+        else:
+            self.minimum[i] = np.fmin(self.minimum[i], values)
+            self.maximum[i] = np.fmax(self.maximum[i], values)
+        self.pending += 1
+        if self.pending == self.size:
+            self.pending = 0
+            self.count += 1
+            if self.count == len(self.times):
+                self.merge()
+
+    def merge(self):
+        half = len(self.times) // 2
+        self.times[:half] = self.times[0::2]
+        self.minimum[:half] = np.fmin(self.minimum[0::2], self.minimum[1::2])
+        self.maximum[:half] = np.fmax(self.maximum[0::2], self.maximum[1::2])
+        self.times[half:] = np.nan
+        self.minimum[half:] = np.nan
+        self.maximum[half:] = np.nan
+        self.count = half
+        self.size *= 2
+
+    def envelope(self):
+        """ :returns: (times, values) with the minimum and maximum of every bucket
+                      one after the other, which draws the envelope as one line """
+        n = self.count + (1 if self.pending else 0)
+        times = np.repeat(self.times[:n], 2)
+        values = np.empty((2 * n, self.minimum.shape[1]))
+        values[0::2] = self.minimum[:n]
+        values[1::2] = self.maximum[:n]
+        return times, values
+
+
+class Poller(object):
+    """ Polls the process document on a background thread
+
+    :param session: requests session of the device
+    :param process_endpoint: url of /process
+    :param channels: dict of label to jsonpath of the plotted values
+    :param interval: seconds between two polls
+    :param window: seconds of samples kept at full resolution
+    :param history: number of buckets of the downsampled history
+    """
+
+    def __init__(self, session, process_endpoint, channels, interval=1, window=600, history=2000):
+        self.session = session
+        self.process_endpoint = process_endpoint
+        self.labels = list(channels)
+        self.accessors = [compile_path(jsonp) for jsonp in channels.values()]
+        self.fetcher = Fetcher(list(channels.values()))     # decodes only the plotted sections
+        self.interval = interval
+        self.recent = RingBuffer(max(2, int(window / interval)), len(self.labels))
+        self.history = HistoryBuffer(history, len(self.labels))
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.guard = PollGuard(interval, process_endpoint)
+        self.values = None      # plotted values of the last changed document
+        self.errors = 0
+        self.last_error = None
+        self.running = False
+        self.thread = None
+
+    def read(self, proc_msg):
+        values = []
+        for accessor in self.accessors:
+            try:
+                values.append(float(accessor(proc_msg)))
+            except Exception:
+                values.append(np.nan)   # missing in this sample
+        return values
+
+    def run(self):
+        scheduler = Scheduler(self.interval)
+        guard = self.guard
+        while self.running:
+            if not guard.ready():
+                guard.skip()
+                sleep_for, missed = scheduler.advance()
+                time.sleep(sleep_for)
+                continue
+            started = time.monotonic()
+            try:
+                proc_msg, changed = self.fetcher.fetch(self.session, self.process_endpoint, timeout=guard.timeout)
+                if changed or self.values is None:
+                    self.values = self.read(proc_msg)
+                # unchanged values are still appended, the x axis is the time
+                values = self.values
+            except Exception as e:
+                self.errors += 1
+                self.last_error = e
+                guard.failure(e)
+                if guard.consecutive == 1:
+                    # a row of missing values breaks the lines at the outage
+                    with self.lock:
+                        self.recent.append(time.time(), [np.nan] * len(self.labels))
+            else:
+                guard.success(time.monotonic() - started)
+                t = time.time()
+                with self.lock:
+                    self.recent.append(t, values)
+                    self.history.append(t, values)
+            sleep_for, missed = scheduler.advance()
+            time.sleep(sleep_for)
+
+    def start(self):
+        if self.thread is not None:
+            self.thread.join()      # let a stopped poller finish its last poll
+        self.running = True
+        if self.started_at is None:
+            self.started_at = time.time()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+
+    def recent_data(self):
+        with self.lock:
+            return self.recent.data()
+
+    def history_data(self):
+        with self.lock:
+            return self.history.envelope()
+
+
+class LiveView(object):
+    """ Plots the channels of a Poller, one axes per channel
+
+    The x axis shows the seconds before now, so its limits stay the same while
+    new samples arrive and the lines can be blitted.
+
+    :param poller: the Poller
+    :param ylim: dict of label to (min, max), the other axes scale automatically
+    :param formats: matplotlib format strings of the lines, e.g. ['b.', 'r-']
+    """
+
+    def __init__(self, poller, ylim=None, formats=None):
+        import matplotlib.pyplot as plt
+
+        self.poller = poller
+        self.ylim = dict(ylim or {})
+        self.zoomed_out = False
+        n = len(poller.labels)
+        self.fig, axes = plt.subplots(n, 1, sharex=True, squeeze=False, figsize=(8, 2 + 1.5 * n))
+        self.axes = list(axes[:, 0])
+        self.fig.suptitle("Measurement started: " + datetime.now().strftime('%d.%m.%Y %H:%M:%S'), fontsize=10)
+        formats = formats or ['-'] * n
+        self.lines = []
+        self.texts = []
+        for ax, label, fmt in zip(self.axes, poller.labels, formats):
+            line, = ax.plot([], [], fmt, animated=True)
+            ax.set_ylabel(label)
+            ax.set_ylim(*self.ylim.get(label, (0, 100)))
+            self.lines.append(line)
+            self.texts.append(ax.text(0.01, 0.85, '', transform=ax.transAxes, animated=True))
+        self.axes[-1].set_xlabel('seconds before now')
+        self.background = None
+        self.timer = None
+        self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+        self.set_xlim()
+
+    def set_xlim(self):
+        if self.zoomed_out:
+            elapsed = max(time.time() - (self.poller.started_at or time.time()), self.poller.interval)
+            self.axes[-1].set_xlim(-elapsed, 0)
+        else:
+            self.axes[-1].set_xlim(-len(self.poller.recent.times) * self.poller.interval, 0)
+
+    def on_draw(self, event):
+        """ Keeps the background without the lines after every full redraw """
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.lines + self.texts:
+            artist.axes.draw_artist(artist)
+
+    def update(self):
+        times, values = self.poller.history_data() if self.zoomed_out else self.poller.recent_data()
+        if len(times) == 0:
+            return
+        now = time.time()
+        x = times - now
+        redraw = self.zoomed_out   # the x limits grow with the run
+        for i, (ax, line, text, label) in enumerate(zip(self.axes, self.lines, self.texts, self.poller.labels)):
+            y = values[:, i]
+            line.set_data(x, y)
+            text.set_text(f"{values[-1, i]:.1f}")
+            if label not in self.ylim and np.isfinite(y).any():
+                low, high = ax.get_ylim()
+                if np.nanmin(y) < low or np.nanmax(y) > high:
+                    margin = max((np.nanmax(y) - np.nanmin(y)) * 0.1, 1)
+                    ax.set_ylim(min(low, np.nanmin(y) - margin), max(high, np.nanmax(y) + margin))
+                    redraw = True
+        canvas = self.fig.canvas
+        if redraw or self.background is None:
+            self.set_xlim()
+            canvas.draw_idle()      # on_draw keeps the new background
+            return
+        canvas.restore_region(self.background)
+        self.draw_artists()
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+    def zoom_out(self):
+        """ Shows the whole run (downsampled) """
+        self.zoomed_out = True
+        self.set_xlim()
+        self.fig.canvas.draw_idle()
+
+    def zoom_in(self):
+        """ Shows the recent samples at full resolution """
+        self.zoomed_out = False
+        self.set_xlim()
+        self.fig.canvas.draw_idle()
+
+    def start(self, interval=1000):
+        """ Redraws every interval milliseconds """
+        if self.timer is None:
+            self.timer = self.fig.canvas.new_timer(interval=interval)
+            self.timer.add_callback(self.update)
+        self.timer.start()
+        return self
+
+    def stop(self):
+        self.timer.stop()
@@ -0,0 +1,224 @@
+#! /usr/bin/env python3
+"""
+Rotavapor R-300 fleet to Modbus gateway
+--------------------------------------------------------------------------
+
+Serves many Rotavapors from one Modbus TCP server. Every device gets its own
+Modbus unit id with its own registers, laid out like in modbus_server.py.
+
+All devices are polled concurrently by one asyncio thread (see
+openinterface/poller.py) and writes of Modbus clients are sent back to the
+device of the addressed unit from the same thread. The number of threads
+doesn't grow with the number of devices.
+"""
+
+import argparse
+import asyncio
+import getpass
+import logging
+from threading import Thread
+
+from pymodbus.server.asynchronous import StartTcpServer
+from pymodbus.device import ModbusDeviceIdentification
+from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+
+import modbus_server
+from modbus_server import CallbackDataBlock, register_plan, build_process_msg, collect_changes, count_stale_cycle, cnt
+from register_plan import RegisterUpdater
+from openinterface.poller import Device, FleetPoller
+from openinterface.scheduler import add_rate_argument
+
+log = logging.getLogger(__name__)
+
+
+class LoopQueue(object):
+    """ Queue that can be filled from any thread and is read on an event loop.
+    Passed to CallbackDataBlock, which is called from the Modbus server thread.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.queue = None
+
+    def attach(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+
+    def put(self, item):
+        if self.loop is None:
+            log.warning("Dropped Modbus write before polling started: %s", item)
+            return
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+
+class Unit(object):
+    """ Registers of one device
+
+    :param unit_id: Modbus unit id
+    :param device: the polled Device
+    :param queue: queue for writes of Modbus clients
+    """
+
+    def __init__(self, unit_id, device, queue):
+        self.unit_id = unit_id
+        self.device = device
+        # every register is tagged with the host, so writes can be routed to the device
+        self.block = CallbackDataBlock({i: device.host for i in range(1, cnt+1)}, queue)
+        self.store = ModbusSlaveContext(di=self.block, co=self.block, hr=self.block, ir=self.block)
+        self.updater = RegisterUpdater(self.block, 1, cnt)     # modbus address 1 = modbus_mapping[0]
+        self.lock = None            # keeps the writes to one device in order, created on the event loop
+
+
+class ModbusGateway(FleetPoller):
+    """ Polls devices into Modbus units and sends writes back
+
+    :param units: dict of unit id to Device
+    :param write_window: seconds to wait for further writes to send them with one request
+    :param interval, timeout, report_interval: see FleetPoller
+    """
+
+    def __init__(self, units, write_window=modbus_server.api_write_window, **kwargs):
+        self.queue = LoopQueue()
+        self.units = {device.host: Unit(unit_id, device, self.queue) for unit_id, device in units.items()}
+        self.context = ModbusServerContext(slaves={u.unit_id: u.store for u in self.units.values()}, single=False)
+        self.write_window = write_window
+        self.batches = 0
+        self.sending = set()    # write requests in flight
+        super(ModbusGateway, self).__init__(list(units.values()), [self.update], **kwargs)
+
+    async def run_async(self):
+        self.queue.attach(asyncio.get_running_loop())
+        for unit in self.units.values():
+            unit.lock = asyncio.Lock()
+        writer = asyncio.ensure_future(self.write_back())
+        try:
+            await super(ModbusGateway, self).run_async()
+        finally:
+            # the sessions of the devices are closed, writes in flight can't complete anymore
+            writer.cancel()
+            for task in self.sending:
+                task.cancel()
+            await asyncio.gather(writer, *self.sending, return_exceptions=True)
+
+    def update(self, device, poll_at, proc_msg):
+        unit = self.units[device.host]
+        unit.updater.update(register_plan.encode(proc_msg), unit.block.take_written())
+
+    def failed(self, device, poll_at, error):
+        count_stale_cycle(self.units[device.host].updater)
+
+    def skipped(self, device, poll_at):
+        # backing off: the data of the unit is getting older
+        count_stale_cycle(self.units[device.host].updater)
+
+    async def write_back(self):
+        """ Collects writes of Modbus clients for write_window seconds and
+        sends one request per written device """
+        loop = asyncio.get_running_loop()
+        queue = self.queue.queue
+        while True:
+            changes = {}    # host -> register changes
+            host, address, value = await queue.get()
+            collect_changes(changes.setdefault(host, {}), address, value)
+            deadline = loop.time() + self.write_window
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    host, address, value = await asyncio.wait_for(queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                collect_changes(changes.setdefault(host, {}), address, value)
+
+            for host, device_changes in changes.items():
+                js = build_process_msg(device_changes)
+                if js:
+                    # don't wait, a slow device must not delay the writes to the others
+                    task = asyncio.ensure_future(self.send(self.units[host], js))
+                    self.sending.add(task)
+                    task.add_done_callback(self.sending.discard)
+
+    async def send(self, unit, js):
+        async with unit.lock:
+            try:
+                await unit.device.put_process(js)
+            except Exception as e:
+                log.error("Writing to %s (unit %d) failed: %s", unit.device.name, unit.unit_id, e)
+                return
+        self.batches += 1
+        log.debug("unit %d: wrote %s", unit.unit_id, js)
+
+
+def parse_units(specs, first_unit):
+    """ Assigns Modbus unit ids to hosts
+
+    :param specs: list of 'host' or 'unit=host'
+    :param first_unit: unit id of the first host without explicit unit id
+    :returns: dict of unit id to host
+    """
+    units = {}
+    next_unit = first_unit
+    for spec in specs:
+        if '=' in spec:
+            unit_id, host = spec.split('=', 1)
+            unit_id = int(unit_id)
+        else:
+            while next_unit in units:
+                next_unit += 1
+            unit_id, host = next_unit, spec
+        if not 1 <= unit_id <= 247:
+            raise ValueError(f"Modbus unit id out of range (1-247): {unit_id}")
+        if unit_id in units:
+            raise ValueError(f"Modbus unit id {unit_id} used twice")
+        if host in units.values():
+            raise ValueError(f"Host {host} used twice")
+        units[unit_id] = host
+    return units
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serves many rotavapors from one Modbus TCP server, one unit id per device.')
+    parser.add_argument('hosts', metavar='host', type=str, nargs='+', help="hosts or IPs of rotavapors, optionally with unit id: 'unit=host'")
+    parser.add_argument('-u', '--user', type=str, help='device user', default='rw')
+    parser.add_argument('-p', '--password', type=str, help='device password (same for all devices)', required=False)
+    parser.add_argument('-c', '--cert', type=str, help="root cert file", default="root_cert.crt")
+    parser.add_argument('--http', action='store_true', help='use plain http (fake devices)')
+    parser.add_argument('--first-unit', type=int, help='unit id of the first host without explicit unit id', default=1)
+    parser.add_argument('--ip', type=str, help='Modbus TCP interface', default=modbus_server.modbus_ip)
+    parser.add_argument('--port', type=int, help='Modbus TCP port', default=modbus_server.modbus_tcpport)
+    add_rate_argument(parser, default=1 / modbus_server.api_loop_time)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+
+    try:
+        hosts = parse_units(args.hosts, args.first_unit)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # ask for password if it wasn't passed in as command line argument
+    if args.password is None:
+        args.password = getpass.getpass()
+
+    scheme = 'http' if args.http else 'https'
+    units = {unit_id: Device(host, args.user, args.password, args.cert, scheme) for unit_id, host in hosts.items()}
+    report_interval = None
+    if modbus_server.api_metrics_interval:
+        # log as often as modbus_server: api_metrics_interval counts loops of api_loop_time seconds
+        report_interval = modbus_server.api_metrics_interval * modbus_server.api_loop_time
+    gateway = ModbusGateway(units, interval=1 / args.rate, report_interval=report_interval)
+    for unit_id, host in hosts.items():
+        print(f"unit {unit_id}: {host}")
+
+    identity = ModbusDeviceIdentification()
+    identity.VendorName = 'BUCHI Labortechnik AG'
+    identity.ProductCode = 'R-300'
+    identity.VendorUrl = 'https://www.buchi.com/'
+    identity.ProductName = 'Rotavapor R-300'
+    identity.ModelName = 'Rotavapor Modbus Gateway'
+    identity.MajorMinorRevision = '1.0.0.0'
+
+    # poll and write back on one thread, serve modbus on the main thread
+    Thread(target=gateway.run, daemon=True).start()
+    StartTcpServer(gateway.context, identity=identity, address=(args.ip, args.port))
@@ -14,17 +14,28 @@ import csv
 from datetime import datetime
 import urllib3
 from os import path
-import numpy as np
 import time
 import json
-from jsonpath_ng import jsonpath, parse
-from pymodbus.server.asynchronous import StartTcpServer, StartSerialServer
+from pymodbus.server.asynchronous import StartTcpServer
 from pymodbus.device import ModbusDeviceIdentification
 from pymodbus.datastore import ModbusSparseDataBlock
 from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
-from pymodbus.transaction import ModbusRtuFramer, ModbusAsciiFramer
 from multiprocessing import Queue
-from threading import Thread
+from queue import Empty
+from threading import Thread, Lock
+import sys
+
+# make the shared openinterface package importable when running from this folder
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+from openinterface.extraction import compile_path
+from openinterface.session import create_session, SessionMetrics
+from openinterface.scheduler import Scheduler
+from openinterface.stats import SamplingStats
+from openinterface.fetch import Fetcher
+from openinterface.metrics import Registry, MetricsServer, SampledLog, expose_sampling_stats, expose_fetch_stats, expose_session_metrics, expose_poll_guard
+from openinterface.resilience import PollGuard
+from openinterface.stats import fine_bounds
+from register_plan import RegisterPlan, RegisterUpdater, Constant, Enum, TimestampPart
 
 # --------------------------------------------------------------------------- #
 # configuration
@@ -33,7 +44,14 @@ from threading import Thread
 api_user = 'user'
 api_password = 'password'
 api_url = f"https://192.168.0.2:12345/api/v1"
-api_loop_time = 1               # loop duration in seconds
+api_loop_time = 1               # loop duration in seconds (e.g. 0.1 for 10 Hz)
+api_retries = 3                 # retries of failed api requests (with exponential backoff)
+api_write_window = 0.05        # seconds to wait for further modbus writes to send them with one request
+api_metrics_interval = 60       # log connection and latency metrics every n loops (None to disable)
+
+metrics_ip = '127.0.0.1'        # address of the Prometheus metrics endpoint
+metrics_port = 9102             # port of the metrics endpoint (None to disable)
+log_sample_interval = 60        # seconds between two debug lines of the same kind
 
 modbus_type = 'TCP'             # 'TCP' or 'RTU'
 # TCP config
@@ -51,71 +69,84 @@ modbus_parity='N'     		# (E)ven, (O)dd, (N)one
 import logging
 logging.basicConfig()
 log = logging.getLogger()
-log.setLevel(logging.DEBUG)
+log.setLevel(logging.INFO)
+#log.setLevel(logging.DEBUG)     # also logs every request of urllib3 and pymodbus
 #log.setLevel(logging.CRITICAL)
 
+# per-cycle messages are logged at most once per log_sample_interval, the
+# details are counted in metrics and served on http://metrics_ip:metrics_port/metrics
+sampled_log = SampledLog(log, log_sample_interval)
+metrics = Registry('modbus_bridge')
+
 auth = (api_user, api_password)
 
+# one long-lived http client session shared by the updating and the writing
+# thread, so the TLS handshake is done once and not for every request
+api_metrics = SessionMetrics()
+# polls are not retried by the session: failed polls are backed off by a PollGuard instead
+api_session = create_session(auth, retries=api_retries, metrics=api_metrics, retry_methods=('PUT',))
+expose_session_metrics(metrics, api_metrics)
+
 # --------------------------------------------------------------------------- #
 # modbus mapping config
 # --------------------------------------------------------------------------- #
-# 
+# one tuple per holding register, starting at modbus address 1
 # - Value name (user ddefined)
-# - a lambda for transforming data
+# - a transform for the value (see register_plan.py: Constant, Enum, TimestampPart or any function)
 # - a jsonpath expression for selecting a value
 # - a multiplier: mbodbus_value = int(api_value * multiplier)
 # - readonly item - changes in registers in this rows arent send to api
 
-modbus_mapping = np.array([
-        ["communication", lambda value: 0x0000, None, 1, True],
-        ["heating.set", None, '$.heating.set', 10, False],
-        ["heating.act", None, '$.heating.act', 10, True],
-        ["heating.running", None, '$.heating.running', 1, False],
-        ["---", lambda value: 0x7FFF, None, 1, False],
-        ["cooling.set", None, '$.cooling.set', 10, False],
-        ["cooling.act", None, '$.cooling.act', 10, True],
-        ["cooling.running", None, '$.cooling.running', 1, False],
-        ["---", lambda value: 0x7FFF, None, 1, False],
-        ["vacuum.set", None, '$.vacuum.set', 10, False],
-        ["vacuum.act", None, '$.vacuum.act', 10, True],
-        ["vacuum.aerateValveOpen", None, '$.vacuum.aerateValveOpen', 1, False],
-        ["vacuum.aerateValvePulse", None, '$.vacuum.aerateValvePulse', 1, False],
-        ["vacuum.vacuumValveOpen", None, '$.vacuum.vacuumValveOpen', 1, True],
-        ["vacuum.vaporTemp", None, '$.vacuum.vaporTemp', 10, True],
-        ["vacuum.autoDestIn", None, '$.vacuum.autoDestIn', 10, True],
-        ["vacuum.autoDestOut", None, '$.vacuum.autoDestOut', 10, True],
-        ["vacuum.powerPercentAct", None, '$.vacuum.powerPercentAct', 1, True],
-        ["---", lambda value: 0x7FFF, None, 1, False],
-        ["rotation.set", None, '$.rotation.set', 10, False],
-        ["rotation.act", None, '$.rotation.act', 10, True],
-        ["rotation.running", None, '$.rotation.running', 1, False],
-        ["---", lambda value: 0x7FFF, None, 1, False],
-        ["lift.set", None, '$.lift.set', 1, False],
-        ["lift.act", None, '$.lift.act', 1, True],
-        ["lift.limit", None, '$.lift.limit', 1, False],
-        ["---", lambda value: 0x7FFF, None, 1, False],
-        ["program.type", lambda value: ['Manual','Timer','Solvent','Method','AutoDest','CloudDest','Dry','Calibration','TightnessTest'].index(value), '$.program.type', 1, True],                   # string
-        ["program.set", None, '$.program.set', 1, False],
-        ["program.remaining", None, '$.program.remaining', 1, False],
-        #["program.solventName", None, '$.program.solventName', 1, False],    # string
-        #["program.methodName", None, '$.program.methodName', 1, False],      # string
-        #["program.mode", None, '$.program.mode', 1, False],                    # string
-        ["program.flaskSize", None, '$.program.flaskSize', 1, False],
-        ["---", lambda value: 0x7FFF, None, 1, False],
-        #["globalStatus.timeStamp", None, '$.globalStatus.timeStamp', 1, True],
-        ["globalStatus.processTime", None, '$.globalStatus.processTime', 1, True],
-        ["globalStatus.runId", None, '$.globalStatus.runId', 1, True],
-        ["globalStatus.onHold", None, '$.globalStatus.onHold', 1, False],
-        ["globalStatus.foamActive", None, '$.globalStatus.foamActive', 1, True],
-        ["globalStatus.currentError", None, '$.globalStatus.currentError', 1, True],
-        ["globalStatus.running", None, '$.globalStatus.running', 1, False],
-        ["globalStatus.timeStamp - year", lambda value: datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").year, '$.globalStatus.timeStamp', 1, True],
-        ["globalStatus.timeStamp - month", lambda value: datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").month, '$.globalStatus.timeStamp', 1, True],
-        ["globalStatus.timeStamp - day", lambda value: datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").day, '$.globalStatus.timeStamp', 1, True],
-        ["globalStatus.timeStamp - hour", lambda value: datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").hour, '$.globalStatus.timeStamp', 1, True],
-        ["globalStatus.timeStamp - minute", lambda value: datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").minute, '$.globalStatus.timeStamp', 1, True],
-        ["globalStatus.timeStamp - second", lambda value: datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z").second, '$.globalStatus.timeStamp', 1, True]       
-    ])
+modbus_mapping = (
+        ("communication", Constant(0x0000), None, 1, True),
+        ("heating.set", None, '$.heating.set', 10, False),
+        ("heating.act", None, '$.heating.act', 10, True),
+        ("heating.running", None, '$.heating.running', 1, False),
+        ("---", Constant(0x7FFF), None, 1, False),
+        ("cooling.set", None, '$.cooling.set', 10, False),
+        ("cooling.act", None, '$.cooling.act', 10, True),
+        ("cooling.running", None, '$.cooling.running', 1, False),
+        ("---", Constant(0x7FFF), None, 1, False),
+        ("vacuum.set", None, '$.vacuum.set', 10, False),
+        ("vacuum.act", None, '$.vacuum.act', 10, True),
+        ("vacuum.aerateValveOpen", None, '$.vacuum.aerateValveOpen', 1, False),
+        ("vacuum.aerateValvePulse", None, '$.vacuum.aerateValvePulse', 1, False),
+        ("vacuum.vacuumValveOpen", None, '$.vacuum.vacuumValveOpen', 1, True),
+        ("vacuum.vaporTemp", None, '$.vacuum.vaporTemp', 10, True),
+        ("vacuum.autoDestIn", None, '$.vacuum.autoDestIn', 10, True),
+        ("vacuum.autoDestOut", None, '$.vacuum.autoDestOut', 10, True),
+        ("vacuum.powerPercentAct", None, '$.vacuum.powerPercentAct', 1, True),
+        ("---", Constant(0x7FFF), None, 1, False),
+        ("rotation.set", None, '$.rotation.set', 10, False),
+        ("rotation.act", None, '$.rotation.act', 10, True),
+        ("rotation.running", None, '$.rotation.running', 1, False),
+        ("---", Constant(0x7FFF), None, 1, False),
+        ("lift.set", None, '$.lift.set', 1, False),
+        ("lift.act", None, '$.lift.act', 1, True),
+        ("lift.limit", None, '$.lift.limit', 1, False),
+        ("---", Constant(0x7FFF), None, 1, False),
+        ("program.type", Enum(['Manual','Timer','Solvent','Method','AutoDest','CloudDest','Dry','Calibration','TightnessTest']), '$.program.type', 1, True),                   # string
+        ("program.set", None, '$.program.set', 1, False),
+        ("program.remaining", None, '$.program.remaining', 1, False),
+        #("program.solventName", None, '$.program.solventName', 1, False),    # string
+        #("program.methodName", None, '$.program.methodName', 1, False),      # string
+        #("program.mode", None, '$.program.mode', 1, False),                    # string
+        ("program.flaskSize", None, '$.program.flaskSize', 1, False),
+        ("---", Constant(0x7FFF), None, 1, False),
+        #("globalStatus.timeStamp", None, '$.globalStatus.timeStamp', 1, True),
+        ("globalStatus.processTime", None, '$.globalStatus.processTime', 1, True),
+        ("globalStatus.runId", None, '$.globalStatus.runId', 1, True),
+        ("globalStatus.onHold", None, '$.globalStatus.onHold', 1, False),
+        ("globalStatus.foamActive", None, '$.globalStatus.foamActive', 1, True),
+        ("globalStatus.currentError", None, '$.globalStatus.currentError', 1, True),
+        ("globalStatus.running", None, '$.globalStatus.running', 1, False),
+        ("globalStatus.timeStamp - year", TimestampPart('year'), '$.globalStatus.timeStamp', 1, True),
+        ("globalStatus.timeStamp - month", TimestampPart('month'), '$.globalStatus.timeStamp', 1, True),
+        ("globalStatus.timeStamp - day", TimestampPart('day'), '$.globalStatus.timeStamp', 1, True),
+        ("globalStatus.timeStamp - hour", TimestampPart('hour'), '$.globalStatus.timeStamp', 1, True),
+        ("globalStatus.timeStamp - minute", TimestampPart('minute'), '$.globalStatus.timeStamp', 1, True),
+        ("globalStatus.timeStamp - second", TimestampPart('second'), '$.globalStatus.timeStamp', 1, True),       
+    )
 
 missing_value = 0x8000   # placeholder for json values not defined in json
 cnt = len(modbus_mapping)     # count of holding registers
@@ -125,8 +156,11 @@ cnt = len(modbus_mapping)     # count of holding registers
 # API to Modbus part
 # --------------------------------------------------------------------------- #
 
-def get_value(json_data, m):
+get_value_errors = metrics.counter('get_value_errors_total', 'values get_value replaced with missing_value')
 
+
+def get_value(json_data, m):
+    from jsonpath_ng import parse   # only this slow reference implementation parses at runtime
     try:
         value = None
         if m[2] is not None:
@@ -137,58 +171,115 @@ def get_value(json_data, m):
         else:
             return round(value * m[3]) & 0xFFFF if value is not None else missing_value & 0xFFFF
     except:
+        get_value_errors.inc()
         return missing_value & 0xFFFF
-        
-        
-def read_api():
-    """ A worker process that runs every so often and
-    updates live values of the context.
-	
-    :param arguments: The input arguments to the call
+
+
+# the mapping compiled into one vectorised encoding step per sample
+register_plan = RegisterPlan(modbus_mapping, missing_value)
+
+# decodes only the sections used by the mapping and detects unchanged documents
+process_fetcher = Fetcher([m[2] for m in modbus_mapping if m[2] is not None])
+expose_fetch_stats(metrics, process_fetcher.stats)
+
+read_seconds = metrics.histogram('api_read_seconds', 'duration of read_api: request, decoding and encoding')
+encode_seconds = metrics.histogram('register_encode_seconds', 'extraction and encoding of the registers of a document', fine_bounds)
+metrics.add('missing_values_total', 'counter', 'register values encoded as missing_value', lambda: register_plan.missing_values)
+
+
+def read_api(timeout=None):
+    """ Reads the process data and encodes the holding registers
+
+    :param timeout: seconds to wait for the device, None to wait indefinitely
+    :returns: the registers, None if the used values didn't change since the last call
     """
         
     process_endpoint = api_url + "/process"
 
-    # configure http client session
-    with requests.Session() as s:
-        s.auth = auth
-        s.verify = False
-        urllib3.disable_warnings()
-            
-        # wait for start
-        started_at = datetime.now()
-        poll_at = datetime.now()
-
-        # read process data
-        r = s.get(process_endpoint)
-        if r.status_code != 200:
-            raise Exception("Unexpected status code when polling process data", r.status_code)
-        d = r.json()
-        
-        return [get_value(d, m) for m in modbus_mapping]
-    
+    # read process data
+    started = time.perf_counter()
+    d, changed = process_fetcher.fetch(api_session, process_endpoint, timeout=timeout)
+    if not changed:
+        read_seconds.observe(time.perf_counter() - started)
+        return None
+
+    encoding = time.perf_counter()
+    registers = register_plan.encode(d)
+    done = time.perf_counter()
+    encode_seconds.observe(done - encoding)
+    read_seconds.observe(done - started)
+    return registers
 
-def updating_writer(context):
+
+def count_stale_cycle(updater):
+    """ Adds 1 to holding register 1, the cycles without fresh data """
+    values = updater.registers.copy()
+    values[0] = min(values[0] + 1, 0x7FFF)
+    updater.update(values)
+
+
+def updating_writer(block):
     """ A worker process that runs every so often and
     updates live values of the context.
-	
-    :param arguments: The input arguments to the call
+
+    Only registers that changed since the last poll are written, and they are
+    written without passing them to the write queue.
+
+    A failed poll is not retried at the loop rate: the PollGuard backs off and
+    stops polling a device that keeps failing, except for a probe every few
+    seconds. Holding register 1 counts the cycles without fresh data, failed
+    and skipped ones alike, and is reset by the next successful poll.
+
+    :param block: The CallbackDataBlock holding the registers
     """
+    scheduler = Scheduler(api_loop_time)
+    stats = SamplingStats(api_loop_time)
+    updater = RegisterUpdater(block, 1, cnt)    # modbus address 1 = modbus_mapping[0]
+    expose_sampling_stats(metrics, stats)
+    metrics.add('registers_changed_total', 'counter', 'holding registers changed by polls', lambda: updater.total_changed)
+    metrics.add('datablock_writes_total', 'counter', 'datablock writes, one per run of adjacent registers', lambda: updater.writes)
+    errors = metrics.counter('update_errors_total', 'failed update cycles (communication register incremented)')
+    guard = PollGuard(api_loop_time, api_url)
+    expose_poll_guard(metrics, guard)
+    loops = 0
     while True:
-        log.debug("updating the context")
-        register = 3
-        slave_id = 0x00
-        address = 0x00
-        try:
-            values = read_api()
-            log.debug("new values: " + str(values))
-            context[slave_id].setValues(register, address, values)
-            log.debug(context[slave_id].getValues(register, 0x00, count=cnt))
-        except:
-            val = min(context[slave_id].getValues(register, 0x00, count=1)[0] + 1, 0x7FFF)   # add +1 of holding register 1
-            context[slave_id].setValues(register, address, [val])
-            pass
-        time.sleep(api_loop_time)
+        if guard.ready():
+            try:
+                jitter = scheduler.lateness()
+                started = time.monotonic()
+                values = read_api(guard.timeout)
+                latency = time.monotonic() - started
+                guard.success(latency)
+                stats.observe(jitter, latency)
+                written = block.take_written()
+                if values is not None or written:
+                    # registers written by clients are refreshed even if the device values didn't change
+                    updater.update(values if values is not None else updater.registers, written)
+                    sampled_log.debug("%d registers changed", updater.changed)
+            except Exception as e:
+                errors.inc()
+                guard.failure(e)
+                count_stale_cycle(updater)
+                process_fetcher.reset()     # the next document must reset the counter, even if it is unchanged
+        else:
+            # backing off: don't poll, but let clients see that the data is getting older
+            guard.skip()
+            count_stale_cycle(updater)
+
+        loops += 1
+        if api_metrics_interval and loops % api_metrics_interval == 0:
+            log.info("api session: " + api_metrics.summary())
+            log.info("register updates: " + updater.summary())
+            log.info("api fetch: " + process_fetcher.stats.summary())
+            log.info("api polling: " + guard.summary())
+            stats.report(log)
+
+        # delay execution so that we refresh once every api_loop_time, including the time the request took
+        sleep_for, missed = scheduler.advance()
+        if sleep_for == 0:
+            stats.late += 1
+        stats.missed += missed
+        time.sleep(sleep_for)
 
 
 # --------------------------------------------------------------------------- #
@@ -199,11 +290,16 @@ class CallbackDataBlock(ModbusSparseDataBlock):
     """ A datablock that stores the new value in memory
     and passes the operation to a message queue for further
     processing.
+
+    Values coming from the device are set with update(), which doesn't
+    queue them.
     """
 
     def __init__(self, registers, queue):
         self.registers = registers
         self.queue = queue
+        self.written = set()    # addresses written by modbus clients since the last take_written()
+        self.written_lock = Lock()  # setValues runs on the modbus server thread, take_written on the updating thread
         values = {k: 0 for k in registers.keys()}
         values[0xbeef] = len(values)  # the number of registers
         super(CallbackDataBlock, self).__init__(values)
@@ -214,8 +310,23 @@ class CallbackDataBlock(ModbusSparseDataBlock):
         :param values: The new values to be set
         """
         super(CallbackDataBlock, self).setValues(address, value)
+        with self.written_lock:
+            self.written.update(range(address, address + len(value)))
         self.queue.put((self.registers.get(address, None), address, value))
 
+    def update(self, address, values):
+        """ Sets values read from the device without queueing them
+        :param address: The starting address
+        :param values: The new values to be set
+        """
+        super(CallbackDataBlock, self).setValues(address, values)
+
+    def take_written(self):
+        """ :returns: the addresses written by modbus clients since the last call """
+        with self.written_lock:
+            written, self.written = self.written, set()
+        return written
+
 def rescale_value(value, index):
     """ Value calculaton from unsigned integer to signed integer and
     calculate value with decimal offset
@@ -229,28 +340,47 @@ def rescale_value(value, index):
     value = value / modbus_mapping[index-1][3]
     return value
 
+def build_process_msg(changes):
+    """ Merges register changes into one nested process document
+
+    :param changes: dict of holding register number to rescaled value
+    :returns: process document with all writable changes, e.g.
+              {'heating': {'set': 40.0}, 'vacuum': {'set': 200.0}}
+    """
+    js = {}
+    for index, value in changes.items():
+        mb = modbus_mapping[index-1]    # get row from modbus_mapping (modbus address 1 = mapping_modbus[0])
+        if mb[4] or mb[2] is None:      # skip readonly and constant values
+            continue
+        if value == rescale_value(missing_value, index):    # a client wrote back the placeholder of a missing value
+            continue
+        jsonp = mb[2][2:].split('.')    # remove '$.' from json path
+        node = js
+        for key in jsonp[:-1]:
+            node = node.setdefault(key, {})
+        node[jsonp[-1]] = value
+    return js
+
+def write_api_msg(js):
+    """ Method for writing a (partial) process document to api
+
+    :param js: The process document to send
+    """
+    process_endpoint = api_url + "/process"
+    r = api_session.put(process_endpoint, json=js)
+    if r.status_code != 200:
+        raise Exception("Unexpected status code when trying to send message to api", r.status_code)
+
 def write_api(value, index):
     """ Method for writing new moddbus value to api
 
     :param value: The input value to write
     :param index: Number of holding register
     """
-    
-    mb = modbus_mapping[index-1]    # get row from modbus_mapping (modbus address 1 = mapping_modbus[0])
-    if mb[4]: return                # skip readonly value
-    jsonp = mb[2][2:].split('.')    # remove '$.' from json path
-    js = {jsonp[0] : {jsonp[1] : value}}    
-    process_endpoint = api_url + "/process"
-    # configure http client session
-    with requests.Session() as s:
-        s = requests.Session()
-        s.auth = auth
-        s.verify = False
-        urllib3.disable_warnings()
-        r = s.put(process_endpoint, json=js)
-        if r.status_code != 200:
-            raise Exception("Unexpected status code when trying to send message to api", r.status_code)
-          
+    js = build_process_msg({index: value})
+    if js:
+        write_api_msg(js)
+
 def read_device_map():
     # A helper method for preparing modbus mapping
     registers = {}
@@ -258,24 +388,80 @@ def read_device_map():
         registers[i] = 'api'
     return registers
 
+def collect_changes(changes, address, value):
+    """ Adds the registers of one queued write to changes (last write wins)
+
+    :param changes: dict of holding register number to rescaled value
+    :param address: The starting address of the write
+    :param value: The written register values
+    """
+    sampled_log.debug("Write = %s, address = %s", value, address)
+    for i, v in enumerate(value):
+        index = address + i
+        if 1 <= index <= cnt:
+            changes[index] = rescale_value(v, index)
+
+def count_values(document):
+    """ :returns: the number of values in a (nested) process document """
+    return sum(count_values(v) if isinstance(v, dict) else 1 for v in document.values())
+
 def device_writer(queue):
     """ A worker process that processes new messages
     from a queue to write to device outputs
 
+    Writes arriving within api_write_window are merged into one process
+    document and sent with a single request.
+
     :param queue: The queue to get new messages from
     """
+    metrics.gauge('write_queue_depth', 'modbus writes waiting for device_writer', queue.qsize)
+    write_seconds = metrics.histogram('api_write_seconds', 'round trip of a write to the device')
+    write_errors = metrics.counter('api_write_errors_total', 'failed writes to the device')
+    metrics.add('api_writes_total', 'counter', 'writes sent to the device', lambda: batches)
+    metrics.add('modbus_writes_total', 'counter', 'modbus writes merged into writes to the device', lambda: merged)
+    metrics.add('values_written_total', 'counter', 'process values sent to the device', lambda: values)
+    batches = 0
+    merged = 0  # queued modbus writes sent in the batches, each would have been a request of its own
+    values = 0
     while True:
+        changes = {}
         device, address, value = queue.get()
-        scaled = rescale_value(value[0], address)
-        if len(value) < cnt:
-            log.debug("Write(%s) = %s, addres = %s" % (device, value, address))
-            log.debug("%s %s" % (modbus_mapping[address-1][0] ,scaled))
+        collect_changes(changes, address, value)
+        writes = 1
+
+        # wait a moment for further writes, e.g. a client writing register by register
+        deadline = time.monotonic() + api_write_window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
             try:
-                write_api(scaled, address)
-            except:
-                log.debug("Error: Is not possible to write to api")
-        #if not device: continue
-		
+                device, address, value = queue.get(timeout=remaining)
+            except Empty:
+                break
+            collect_changes(changes, address, value)
+            writes += 1
+
+        js = build_process_msg(changes)
+        if not js:
+            continue
+        sampled_log.debug("sending %s", js)
+        started = time.perf_counter()
+        try:
+            write_api_msg(js)
+        except Exception as e:
+            write_errors.inc()
+            sampled_log.error("Is not possible to write to api: %s", e)
+            continue
+        elapsed = time.perf_counter() - started
+        write_seconds.observe(elapsed)
+        batches += 1
+        merged += writes
+        values += count_values(js)
+        sampled_log.info("wrote %d modbus writes with one request in %.1f ms (%d requests saved so far, ~%.0f ms)",
+            writes, elapsed * 1000,
+            merged - batches, (merged - batches) * api_metrics.mean_latency() * 1000)
+
 # --------------------------------------------------------------------------- #
 # main function
 # --------------------------------------------------------------------------- #
@@ -296,8 +482,12 @@ def run_modbus_server():
     identity.ModelName = 'Rotavapor Modbus Server'
     identity.MajorMinorRevision = '1.0.0.0'
 
+    if metrics_port is not None:
+        server = MetricsServer(metrics, (metrics_ip, metrics_port)).start()
+        log.info("Serving metrics on %s", server.url)
+
     # run updating thread
-    t1 = Thread(target=updating_writer, args=(context,))
+    t1 = Thread(target=updating_writer, args=(block,))
     t1.start()
     
     # run writing thread
@@ -308,6 +498,9 @@ def run_modbus_server():
     if modbus_type == 'TCP':
         StartTcpServer(context, identity=identity, address=(modbus_ip, modbus_tcpport))
     elif modbus_type == 'RTU':
+        # the serial parts of pymodbus and twisted are only loaded for RTU
+        from pymodbus.server.asynchronous import StartSerialServer
+        from pymodbus.transaction import ModbusRtuFramer
 		# this part doesn't work because bug in pymodbus, more info: https://github.com/riptideio/pymodbus/issues/514
         StartSerialServer(context, framer=ModbusRtuFramer, identity=identity, port=modbus_port, baudrate=modbus_baudrate, parity=modbus_parity)
 
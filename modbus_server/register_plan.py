@@ -0,0 +1,199 @@
+"""
+Register encoding plan for modbus_server
+--------------------------------------------------------------------------
+
+The modbus mapping is a table of heterogeneous rows. Evaluating it row by
+row means a function call per register and repeated work: the six
+timestamp registers each parse the same timestamp string.
+
+RegisterPlan compiles the mapping once:
+
+- every source value is read once, even if several registers use it
+- transforms with a shared parse step (TimestampPart) parse once per sample
+- constant registers are computed at compile time
+- scaling and packing into 16 bit two's complement is one NumPy operation
+  over all remaining registers
+
+The transforms below are plain callables, so rows using them still work with
+modbus_server.get_value.
+
+RegisterUpdater writes an encoded block into a datablock, but only the
+registers that changed since the last poll.
+"""
+
+from datetime import datetime
+from operator import attrgetter
+
+import numpy as np
+
+from openinterface.extraction import compile_path
+
+timestamp_format = "%Y-%m-%dT%H:%M:%S%z"
+
+
+def parse_timestamp(value):
+    return datetime.strptime(value, timestamp_format)
+
+
+class Constant(object):
+    """ Transform returning a fixed register value
+
+    :param value: the register value
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, value):
+        return self.value
+
+
+class Enum(object):
+    """ Transform encoding a string as its position in a list of names
+
+    :param names: the known names, the first one is encoded as 0
+    """
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.codes = {name: i for i, name in enumerate(self.names)}
+
+    def __call__(self, value):
+        return self.codes[value]
+
+
+class TimestampPart(object):
+    """ Transform selecting one part (year, month, ...) of an ISO timestamp
+
+    :param part: attribute of datetime, e.g. 'year'
+    """
+
+    parse = staticmethod(parse_timestamp)   # shared by all parts of the same timestamp
+
+    def __init__(self, part):
+        self.part = part
+        self.pick = attrgetter(part)
+
+    def __call__(self, value):
+        return self.pick(self.parse(value))
+
+
+class RegisterPlan(object):
+    """ A modbus mapping compiled for encoding whole register blocks
+
+    :param mapping: rows of (name, transform, jsonpath, multiplier, readonly)
+    :param missing: register value for values that are missing or can't be encoded
+    """
+
+    def __init__(self, mapping, missing):
+        self.missing = missing
+        self.constants = np.full(len(mapping), missing & 0xFFFF, dtype=np.uint16)
+        sources = {}        # (jsonpath, parse) -> list of (slot, convert)
+        index = []          # register of every slot
+        multipliers = []
+        for register, (name, transform, jsonp, multiplier, readonly) in enumerate(mapping):
+            if isinstance(transform, Constant) or (jsonp is None and transform is not None):
+                try:
+                    self.constants[register] = round(transform(None) * multiplier) & 0xFFFF
+                except Exception:
+                    pass
+                continue
+            if jsonp is None:
+                continue
+            parse = getattr(transform, 'parse', None)
+            convert = getattr(transform, 'pick', transform)
+            sources.setdefault((jsonp, parse), []).append((len(index), convert))
+            index.append(register)
+            multipliers.append(multiplier)
+
+        accessors = {}
+        self.sources = []
+        for (jsonp, parse), fields in sources.items():
+            if jsonp not in accessors:
+                accessors[jsonp] = compile_path(jsonp)
+            self.sources.append((accessors[jsonp], parse, tuple(fields)))
+        self.index = np.array(index, dtype=np.intp)
+        self.multipliers = np.array(multipliers, dtype=np.float64)
+        self.slots = len(index)
+        self.missing_values = 0     # values encoded as missing, in all calls of encode()
+
+    def encode(self, data):
+        """ Encodes all registers of a process document
+
+        :param data: the process document
+        :returns: uint16 array with one value per mapping row
+        """
+        values = [np.nan] * self.slots
+        for accessor, parse, fields in self.sources:
+            try:
+                value = accessor(data)
+                if parse is not None:
+                    value = parse(value)
+            except Exception:
+                continue
+            for slot, convert in fields:
+                try:
+                    # + 0.0 accepts numbers and booleans but not strings, like get_value
+                    values[slot] = (convert(value) if convert is not None else value) + 0.0
+                except Exception:
+                    pass
+
+        scaled = np.array(values) * self.multipliers
+        registers = self.constants.copy()
+        finite = np.isfinite(scaled)
+        self.missing_values += self.slots - int(np.count_nonzero(finite))
+        registers[self.index] = np.where(finite, scaled.round(), self.missing).astype(np.int64).astype(np.uint16)
+        return registers
+
+
+class RegisterUpdater(object):
+    """ Writes only the registers that changed since the last update
+
+    The updater keeps a copy of the registers it wrote. Registers written by
+    modbus clients in the meantime are passed to update() as written, so they
+    are refreshed with the device value even if that didn't change.
+
+    :param block: datablock with an update(address, values) method that
+                  doesn't pass the values on to the device
+    :param address: datablock address of the first register
+    :param count: number of registers
+    """
+
+    def __init__(self, block, address, count):
+        self.block = block
+        self.address = address
+        self.registers = np.array(block.getValues(address, count), dtype=np.uint16)
+        self.cycles = 0             # calls of update()
+        self.changed = 0            # registers changed in the last cycle
+        self.total_changed = 0      # registers changed in all cycles
+        self.writes = 0             # datablock writes (one per run of adjacent registers)
+
+    def update(self, registers, written=()):
+        """ Writes the registers that differ from the last update
+
+        :param registers: uint16 array with all registers
+        :param written: datablock addresses written by modbus clients since the last update
+        :returns: number of changed registers
+        """
+        registers = np.asarray(registers, dtype=np.uint16)
+        changed = registers != self.registers
+        for address in written:
+            if 0 <= address - self.address < len(changed):
+                changed[address - self.address] = True
+        indices = np.flatnonzero(changed)
+        if len(indices):
+            # one datablock write per run of adjacent registers
+            for run in np.split(indices, np.flatnonzero(np.diff(indices) != 1) + 1):
+                start, end = run[0], run[-1] + 1
+                self.block.update(self.address + int(start), registers[start:end].tolist())
+                self.writes += 1
+            self.registers = registers.copy()
+        self.cycles += 1
+        self.changed = len(indices)
+        self.total_changed += self.changed
+        return self.changed
+
+    def summary(self):
+        mean = self.total_changed / self.cycles if self.cycles else 0
+        return (f"{self.cycles} cycles, {self.changed} registers changed in the last, "
+                f"{mean:.1f} per cycle on average, {self.writes} datablock writes")
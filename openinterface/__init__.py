@@ -0,0 +1,8 @@
+"""
+Shared helpers for the OpenInterface examples
+--------------------------------------------------------------------------
+
+The examples in this repository are standalone scripts. Code that is used by
+more than one of them lives in this package. Scripts add the repository root
+to sys.path so the package can be imported without installing anything.
+"""
@@ -0,0 +1,18 @@
+"""
+Helpers for (partial) process documents
+"""
+
+
+def merge(target, changes):
+    """ Recursively merges a (partial) process document into target
+
+    :param target: document that is updated in place
+    :param changes: (partial) document with the new values
+    :returns: target
+    """
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+    return target
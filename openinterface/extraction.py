@@ -0,0 +1,93 @@
+"""
+Precompiled field extraction
+--------------------------------------------------------------------------
+
+The example scripts describe their output with mapping tables that select
+values from the /process document with jsonpath expressions. Parsing those
+expressions for every value of every sample is expensive, so mapping tables
+are compiled once at startup:
+
+- compile_path() turns a jsonpath expression into an accessor function.
+  Simple dotted paths like '$.vacuum.act' become plain dict lookups, anything
+  else is parsed once by jsonpath_ng.
+- compile_row() combines a list of column functions into a single function
+  that extracts a whole row from a document in one pass.
+"""
+
+import re
+
+# matches jsonpath expressions that only consist of child member names
+simple_path_regex = re.compile(r'^\$(\.[A-Za-z_][A-Za-z0-9_]*)+$')
+
+
+def split_path(jsonp):
+    """ Splits a simple dotted jsonpath expression into its keys
+
+    :param jsonp: jsonpath expression, e.g. '$.vacuum.act'
+    :returns: tuple of keys, e.g. ('vacuum', 'act'), or None if the
+              expression is not a simple dotted path
+    """
+    if not simple_path_regex.match(jsonp):
+        return None
+    return tuple(jsonp[2:].split('.'))
+
+
+def compile_path(jsonp):
+    """ Compiles a jsonpath expression into an accessor function
+
+    The accessor returns the first value matched in the passed document and
+    raises (KeyError, TypeError, IndexError) if there is no match, which is
+    the same behaviour as `parse(jsonp).find(data)[0].value`.
+
+    :param jsonp: jsonpath expression
+    :returns: function taking a document and returning the selected value
+    """
+    keys = split_path(jsonp)
+    if keys is None:
+        # not a simple path, let jsonpath_ng do the work but parse it only once
+        from jsonpath_ng import parse
+        expression = parse(jsonp)
+        return lambda data: expression.find(data)[0].value
+
+    # unrolled lookups for the common depths, loop for everything else
+    if len(keys) == 1:
+        k0, = keys
+        return lambda data: data[k0]
+    if len(keys) == 2:
+        k0, k1 = keys
+        return lambda data: data[k0][k1]
+    if len(keys) == 3:
+        k0, k1, k2 = keys
+        return lambda data: data[k0][k1][k2]
+
+    def accessor(data):
+        for k in keys:
+            data = data[k]
+        return data
+    return accessor
+
+
+def compile_row(columns, missing):
+    """ Combines column functions into a function extracting a whole row
+
+    Every column is a function taking the document (and any extra arguments
+    passed to the row function). A column raising an exception yields the
+    missing value instead, so one absent field doesn't spoil the whole row.
+
+    :param columns: list of column functions
+    :param missing: value used for columns that raise
+    :returns: function taking a document (plus extra arguments) and returning
+              a list with one value per column
+    """
+    columns = tuple(columns)
+
+    def extract_row(data, *args):
+        row = []
+        append = row.append
+        for column in columns:
+            try:
+                append(column(data, *args))
+            except Exception:
+                append(missing)
+        return row
+    return extract_row
@@ -0,0 +1,106 @@
+"""
+Fake OpenInterface device
+--------------------------------------------------------------------------
+
+A small local server (see server.py) that answers GET /api/v1/info and
+GET/PUT /api/v1/process like a Rotavapor does, so it can be used to run the
+examples and benchmarks without a physical device:
+
+    python -m openinterface.fake_device --port 8080
+
+Optionally the process values evolve like a running distillation (see
+simulation.py), and responses are delayed or fail with 503 Service
+Unavailable at a configurable rate:
+
+    python -m openinterface.fake_device --port 8080 --simulate --latency 0.02 --error-rate 0.01
+"""
+
+import argparse
+import copy
+import random
+import time
+
+from openinterface.documents import merge
+from openinterface.sample_data import info_sample, process_sample
+from openinterface.server import OpenInterfaceServer
+from openinterface.simulation import ProcessSimulator
+
+
+class FakeDevice(OpenInterfaceServer):
+    """ A fake Rotavapor serving the sample documents (see server.py)
+
+    :param address: (host, port) to listen on, port 0 picks a free port
+    :param auth: (user, password) tuple or None to accept any request
+    :param name: system name reported by /info
+    :param certfile: PEM file with certificate and private key to serve HTTPS
+    :param simulate: let the process values evolve (see simulation.py)
+    :param latency: mean response delay in seconds
+    :param jitter: responses are delayed by latency +/- jitter seconds (uniformly distributed)
+    :param error_rate: fraction of requests answered with 503 Service Unavailable
+    :param seed: seed of the simulation, the delays and the errors
+    """
+
+    def __init__(self, address=('127.0.0.1', 0), auth=None, name=None, certfile=None,
+                 simulate=False, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        info = dict(info_sample)
+        if name is not None:
+            info['systemName'] = name
+        super(FakeDevice, self).__init__(address, info, auth=auth, certfile=certfile)
+        self.process = copy.deepcopy(process_sample)
+        self.simulator = ProcessSimulator(self.process, seed) if simulate else None
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+
+    def delay(self):
+        """ Delays a response by the configured latency
+
+        :returns: True if the request should fail
+        """
+        with self.lock:
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter) if self.jitter else self.latency
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+            if failed:
+                self.counters['errors'] += 1
+        if delay > 0:
+            time.sleep(delay)
+        return failed
+
+    def read_process(self):
+        with self.lock:
+            if self.simulator is not None:
+                self.simulator.step()
+            return copy.deepcopy(self.process)
+
+    def process_response(self):
+        """ :returns: (document, extra headers) of a GET /process """
+        return self.read_process(), None
+
+    def write_process(self, changes):
+        with self.lock:
+            if self.simulator is not None:
+                self.simulator.step()   # the changes apply from now on
+            self.writes.append(changes)
+            self.written.append(time.monotonic())
+            merge(self.process, changes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Runs a fake Rotavapor OpenInterface on HTTP or HTTPS.')
+    parser.add_argument('-i', '--ip', type=str, help='address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='port to listen on', default=8080)
+    parser.add_argument('-u', '--user', type=str, help='device user', default='rw')
+    parser.add_argument('-p', '--password', type=str, help='device password (no authentication if omitted)', required=False)
+    parser.add_argument('--certfile', type=str, help='PEM file with certificate and key to serve HTTPS', required=False)
+    parser.add_argument('--simulate', action='store_true', help='let the process values evolve like a running distillation')
+    parser.add_argument('--latency', type=float, help='mean response delay in seconds', default=0.0)
+    parser.add_argument('--jitter', type=float, help='responses are delayed by latency +/- jitter seconds', default=0.0)
+    parser.add_argument('--error-rate', type=float, help='fraction of requests answered with 503', default=0.0)
+    args = parser.parse_args()
+
+    auth = (args.user, args.password) if args.password is not None else None
+    device = FakeDevice((args.ip, args.port), auth=auth, certfile=args.certfile, simulate=args.simulate,
+                        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    print(f"Serving fake device on {device.url}")
+    device.serve_forever()
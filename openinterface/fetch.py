@@ -0,0 +1,131 @@
+"""
+Fetching and decoding of /process documents
+--------------------------------------------------------------------------
+
+Every poll downloads and decodes the whole /process document, although most
+consumers only use a few of its sections. A Fetcher is created per consumer
+and device with the jsonpaths the consumer reads:
+
+- the body is decoded with orjson if it is installed, with json otherwise
+- if the body is byte for byte the same as in the last poll, it isn't decoded
+  again and the document is reported as unchanged
+- the consumer gets a document with only the top level sections its paths
+  use, and the document is also reported as unchanged if those sections are
+  equal to the last poll
+
+JSON can't be decoded partially without scanning it in Python, which is
+slower than decoding it completely in C, so the sections are selected after
+decoding.
+
+    fetcher = Fetcher(['$.vacuum.vaporTemp'])
+    document, changed = fetcher.fetch(session, process_endpoint)
+"""
+
+import time
+
+from openinterface.extraction import split_path
+from openinterface.stats import Histogram, fine_bounds
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    import json
+    loads = json.loads
+
+decode_bounds = fine_bounds
+
+
+def sections_of(paths):
+    """ Top level sections used by jsonpaths
+
+    :param paths: jsonpath expressions
+    :returns: tuple of section names, None if the whole document is needed
+    """
+    sections = []
+    for jsonp in paths:
+        keys = split_path(jsonp) if jsonp is not None else None
+        if not keys:
+            return None     # not a simple path, it may select anything
+        if keys[0] not in sections:
+            sections.append(keys[0])
+    return tuple(sections)
+
+
+class FetchStats(object):
+    """ Counters of a Fetcher """
+
+    def __init__(self):
+        self.fetches = 0
+        self.bytes = 0
+        self.decode = Histogram(decode_bounds)
+        self.unchanged_bytes = 0     # body equal to the last poll, not decoded
+        self.unchanged = 0           # sections used by the consumer equal to the last poll
+
+    @property
+    def skip_ratio(self):
+        """ fraction of fetches without changes for the consumer """
+        return self.unchanged / self.fetches if self.fetches else 0.0
+
+    def summary(self):
+        mean = self.bytes / self.fetches if self.fetches else 0
+        return (f"{self.fetches} fetches, {self.bytes / 1024:.1f} kB ({mean:.0f} B/fetch), "
+                f"decode {self.decode.summary(1e6, 'us')}, {self.unchanged_bytes} bodies unchanged, "
+                f"{self.skip_ratio:.0%} skipped as unchanged")
+
+
+class Fetcher(object):
+    """ Decodes the /process documents of one device for one consumer
+
+    :param paths: jsonpaths the consumer reads, None for the whole document
+    """
+
+    def __init__(self, paths=None):
+        self.sections = sections_of(paths) if paths is not None else None
+        self.stats = FetchStats()
+        self.body = None
+        self.document = None
+
+    def reset(self):
+        """ Forgets the last document, so the next one counts as changed """
+        self.body = None
+        self.document = None
+
+    def select(self, document):
+        if self.sections is None:
+            return document
+        return {section: document[section] for section in self.sections if section in document}
+
+    def decode(self, body):
+        """ Decodes a response body
+
+        :param body: the body bytes
+        :returns: (document with the used sections, True if they changed since the last call)
+        """
+        stats = self.stats
+        stats.fetches += 1
+        stats.bytes += len(body)
+        if body == self.body:
+            stats.unchanged_bytes += 1
+            stats.unchanged += 1
+            return self.document, False
+        started = time.perf_counter()
+        document = self.select(loads(body))
+        stats.decode.observe(time.perf_counter() - started)
+        changed = document != self.document
+        if not changed:
+            stats.unchanged += 1
+        self.body = body
+        self.document = document
+        return document, changed
+
+    def fetch(self, session, url, timeout=None):
+        """ GETs and decodes a document with a requests session
+
+        :param timeout: seconds to wait for the response, None for the session default
+        :returns: (document with the used sections, True if they changed since the last fetch)
+        """
+        resp = session.get(url, timeout=timeout) if timeout is not None else session.get(url)
+        if resp.status_code != 200:
+            raise Exception("Unexpected status code when polling process data", resp.status_code)
+        return self.decode(resp.content)
@@ -0,0 +1,254 @@
+"""
+Metrics endpoint and sampled logging
+--------------------------------------------------------------------------
+
+Instrumenting every cycle with log lines is expensive and hard to read once a
+bridge falls behind. Instead the hot paths update counters and histograms
+(see stats.py), which cost a lock and an addition per update. A Registry
+collects them and MetricsServer serves them on a local HTTP endpoint in the
+Prometheus text format:
+
+    registry = Registry('modbus_bridge')
+    polls = registry.histogram('api_poll_seconds', 'duration of a /process poll')
+    errors = registry.counter('api_poll_errors_total', 'failed polls')
+    registry.gauge('write_queue_depth', 'queued modbus writes', queue.qsize)
+    MetricsServer(registry, ('127.0.0.1', 9102)).start()
+
+    curl http://127.0.0.1:9102/metrics
+
+Existing statistics (SamplingStats, FetchStats, ...) are exposed without
+changing them: a gauge or counter can read its value from a function when
+the endpoint is scraped.
+
+SampledLog replaces per-cycle debug lines: a message is logged at most once
+per interval, with the number of occurrences suppressed in between.
+"""
+
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openinterface.stats import Histogram
+
+log = logging.getLogger(__name__)
+
+
+class Counter(object):
+    """ Thread safe counter """
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels, extra=None):
+    items = dict(labels or {}, **(extra or {}))
+    if not items:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in items.items()) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry(object):
+    """ Metrics of one component
+
+    :param prefix: prepended to every metric name, e.g. 'modbus_bridge'
+    """
+
+    def __init__(self, prefix=None):
+        self.prefix = prefix
+        self.metrics = {}   # name -> (kind, help, [(labels, source)])
+        self.lock = threading.Lock()
+
+    def add(self, name, kind, help, source, labels=None):
+        """ Adds a series
+
+        :param kind: 'counter', 'gauge' or 'histogram'
+        :param source: Counter, Histogram, or a function returning the current value
+        :param labels: dict of label name to value, to add several series with the same name
+        """
+        if self.prefix:
+            name = f"{self.prefix}_{name}"
+        with self.lock:
+            entry = self.metrics.setdefault(name, (kind, help, []))
+            entry[2].append((labels, source))
+        return source
+
+    def counter(self, name, help, labels=None):
+        return self.add(name, 'counter', help, Counter(), labels)
+
+    def histogram(self, name, help, bounds=None, labels=None):
+        return self.add(name, 'histogram', help, Histogram(bounds) if bounds is not None else Histogram(), labels)
+
+    def gauge(self, name, help, function, labels=None):
+        return self.add(name, 'gauge', help, function, labels)
+
+    def render(self):
+        """ :returns: all metrics in the Prometheus text format """
+        with self.lock:
+            metrics = [(name, kind, help, list(series)) for name, (kind, help, series) in self.metrics.items()]
+        lines = []
+        for name, kind, help, series in metrics:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, source in series:
+                if isinstance(source, Histogram):
+                    lines += render_histogram(name, labels, source)
+                    continue
+                try:
+                    value = source.value if isinstance(source, Counter) else source()
+                except Exception as e:
+                    log.debug("Reading metric %s failed: %s", name, e)
+                    continue
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def render_histogram(name, labels, histogram):
+    counts, count, total = histogram.snapshot()
+    lines = []
+    cumulative = 0
+    for bound, n in zip(histogram.bounds, counts):
+        cumulative += n
+        lines.append(f"{name}_bucket{format_labels(labels, {'le': format_value(float(bound))})} {cumulative}")
+    lines.append(f"{name}_bucket{format_labels(labels, {'le': '+Inf'})} {count}")
+    lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+    lines.append(f"{name}_count{format_labels(labels)} {count}")
+    return lines
+
+
+def expose_sampling_stats(registry, stats, labels=None):
+    """ Exposes the SamplingStats of a polling loop """
+    registry.add('poll_seconds', 'histogram', 'duration of a poll', stats.latency, labels)
+    registry.add('poll_jitter_seconds', 'histogram', 'delay between the scheduled slot and the start of a poll', stats.jitter, labels)
+    registry.add('samples_total', 'counter', 'samples read from the device', lambda: stats.samples, labels)
+    registry.add('late_polls_total', 'counter', 'polls started after their slot', lambda: stats.late, labels)
+    registry.add('missed_slots_total', 'counter', 'slots skipped because a poll took too long', lambda: stats.missed, labels)
+    registry.add('dropped_samples_total', 'counter', 'samples dropped because the consumer fell behind', lambda: stats.dropped, labels)
+
+
+def expose_fetch_stats(registry, stats, labels=None):
+    """ Exposes the FetchStats of a Fetcher """
+    registry.add('fetch_decode_seconds', 'histogram', 'decode time of a /process body', stats.decode, labels)
+    registry.add('fetch_bytes_total', 'counter', 'bytes of fetched /process bodies', lambda: stats.bytes, labels)
+    registry.add('fetch_unchanged_total', 'counter', 'fetches without changes for the consumer', lambda: stats.unchanged, labels)
+
+
+def expose_session_metrics(registry, metrics, labels=None):
+    """ Exposes the SessionMetrics of an http session """
+    registry.add('http_requests_total', 'counter', 'requests sent to the device', lambda: metrics.requests, labels)
+    registry.add('http_connections_total', 'counter', 'connections opened to the device (TLS handshakes)', lambda: metrics.connections, labels)
+
+
+def expose_poll_guard(registry, guard, labels=None):
+    """ Exposes the counters of a PollGuard (see resilience.py) """
+    registry.add('poll_failures_total', 'counter', 'failed polls', lambda: guard.failures, labels)
+    registry.add('poll_timeouts_total', 'counter', 'failed polls that timed out', lambda: guard.timeouts_hit, labels)
+    registry.add('poll_outages_total', 'counter', 'times the device started failing', lambda: guard.outages, labels)
+    registry.add('poll_skipped_total', 'counter', 'slots skipped while backing off', lambda: guard.skipped, labels)
+    registry.add('poll_timeout_seconds', 'gauge', 'current request timeout', lambda: guard.timeout, labels)
+    registry.add('circuit_open', 'gauge', '1 while the device is only probed', lambda: int(guard.breaker.state != 'closed'), labels)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """ Serves a Registry on GET /metrics from a background thread
+
+    :param registry: the Registry
+    :param address: (ip, port), keep it on localhost unless the network is trusted
+    """
+    daemon_threads = True
+
+    def __init__(self, registry, address=('127.0.0.1', 9102)):
+        super(MetricsServer, self).__init__(address, MetricsHandler)
+        self.registry = registry
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SampledLog(object):
+    """ Logs a message at most once per interval
+
+    Messages are told apart by their format string. The first occurrence is
+    logged right away, later ones only after interval seconds, together with
+    the number of occurrences suppressed in between. Disabled levels cost a
+    single check.
+
+    :param logger: the logger
+    :param interval: seconds between two lines of the same message
+    """
+
+    def __init__(self, logger, interval=60):
+        self.logger = logger
+        self.interval = interval
+        self.last = {}          # format string -> (time logged, suppressed since)
+        self.lock = threading.Lock()
+
+    def log(self, level, msg, *args):
+        if not self.logger.isEnabledFor(level):
+            return
+        now = time.monotonic()
+        with self.lock:
+            logged_at, suppressed = self.last.get(msg, (None, 0))
+            if logged_at is not None and now - logged_at < self.interval:
+                self.last[msg] = (logged_at, suppressed + 1)
+                return
+            self.last[msg] = (now, 0)
+        if suppressed:
+            self.logger.log(level, msg + " (%d more in %.0f s)", *args, suppressed, now - logged_at)
+        else:
+            self.logger.log(level, msg, *args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
+
+    def error(self, msg, *args):
+        self.log(logging.ERROR, msg, *args)
@@ -0,0 +1,152 @@
+"""
+Producer/consumer polling pipeline
+--------------------------------------------------------------------------
+
+Runs the polling of a device and the processing of the polled samples (e.g.
+writing them to disk) on two separate threads connected by a bounded queue.
+A slow disk therefore doesn't delay the next poll, and a slow device doesn't
+block the writer.
+
+The poller keeps a fixed time grid on the monotonic clock (see scheduler.py):
+every sample is stamped with its scheduled slot. If a poll takes longer than
+the interval, the missed slots are skipped (and counted) instead of polling
+back-to-back, so the grid never drifts. If the queue is full because the
+consumer can't keep up, the sample is dropped and counted. Latency and
+jitter of every poll are collected in stats (see stats.py) and reported
+every report_interval seconds. The time the consumer needs per sample is
+collected in consume_time.
+
+Without a guard, a failed poll stops the pipeline and run() raises it. With
+a PollGuard (see resilience.py) failed polls are backed off instead: the
+slots in which the device must not be polled are skipped, and on the first
+failure of an outage gap(poll_at, error) is called on the consumer thread,
+e.g. to mark the gap in a recording.
+"""
+
+import logging
+import threading
+import time
+from queue import Queue, Full
+
+from openinterface.metrics import SampledLog
+from openinterface.scheduler import Scheduler
+from openinterface.stats import Histogram, SamplingStats, fine_bounds
+
+log = logging.getLogger(__name__)
+sampled_log = SampledLog(log)
+
+
+class PollingPipeline(object):
+    """ Polls on one thread and consumes the samples on another
+
+    :param poll: function returning one sample, e.g. the process document
+    :param consume: function(poll_at, sample) called for every sample on the consumer thread
+    :param interval: poll interval in seconds
+    :param maxsize: maximum number of samples waiting for the consumer
+    :param report_interval: log the sampling statistics every n seconds (None to disable)
+    :param guard: optional PollGuard, failed polls are retried with backoff instead of stopping the pipeline
+    :param gap: optional function(poll_at, error) called on the consumer thread when an outage starts
+    """
+    stop_marker = object()
+
+    def __init__(self, poll, consume, interval=1, maxsize=60, report_interval=60, guard=None, gap=None):
+        self.poll = poll
+        self.consume = consume
+        self.guard = guard
+        self.gap = gap
+        self.interval = interval
+        self.queue = Queue(maxsize)
+        self.stats = SamplingStats(interval)
+        self.consume_time = Histogram(fine_bounds + (0.02, 0.05, 0.1, 0.2, 0.5, 1))   # seconds per consumed sample
+        self.report_every = max(1, round(report_interval / interval)) if report_interval else None
+        self.stopped = threading.Event()
+        self.error = None
+
+    def run(self):
+        """ Runs the pipeline until stop() is called or a thread fails (blocking).
+        Samples already polled are consumed before returning. Exceptions
+        raised by consume, and by poll if there is no guard, are re-raised. """
+        poller = threading.Thread(target=self.run_poller, name='poller', daemon=True)
+        consumer = threading.Thread(target=self.run_consumer, name='consumer', daemon=True)
+        poller.start()
+        consumer.start()
+        try:
+            while poller.is_alive():
+                poller.join(0.5)
+        finally:
+            self.stopped.set()
+            poller.join()
+            self.queue.put(self.stop_marker)
+            consumer.join()
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        self.stopped.set()
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stopped.set()
+
+    def run_poller(self):
+        scheduler = Scheduler(self.interval)
+        guard = self.guard
+        while not self.stopped.is_set():
+            if guard is None or guard.ready():
+                self.poll_once(scheduler)
+            else:
+                guard.skip()
+
+            # wait for the next slot, skip slots that have already passed
+            sleep_for, missed = scheduler.advance()
+            if sleep_for == 0:
+                self.stats.late += 1
+            if missed:
+                self.stats.missed += missed
+                sampled_log.debug("poll took too long, skipped %d slot(s)", missed)
+            self.stopped.wait(sleep_for)
+
+    def poll_once(self, scheduler):
+        jitter = scheduler.lateness()
+        started = time.monotonic()
+        try:
+            sample = self.poll()
+        except Exception as e:
+            if self.guard is None:
+                return self.fail(e)
+            self.guard.failure(e)
+            if self.guard.consecutive == 1 and self.gap is not None:
+                self.put((scheduler.slot_at, e), gap=True)
+            return
+        latency = time.monotonic() - started
+        if self.guard is not None:
+            self.guard.success(latency)
+        self.stats.observe(jitter, latency)
+        self.put((scheduler.slot_at, sample))
+        if self.report_every and self.stats.samples % self.report_every == 0:
+            self.stats.report(log)
+
+    def put(self, item, gap=False):
+        try:
+            self.queue.put_nowait((gap, item))
+        except Full:
+            self.stats.dropped += 1
+
+    def run_consumer(self):
+        while True:
+            item = self.queue.get()
+            if item is self.stop_marker:
+                return
+            if self.error is not None:
+                continue    # drain the queue after a failure
+            gap, item = item
+            started = time.perf_counter()
+            try:
+                if gap:
+                    self.gap(*item)
+                else:
+                    self.consume(*item)
+            except Exception as e:
+                self.fail(e)
+            self.consume_time.observe(time.perf_counter() - started)
@@ -0,0 +1,204 @@
+"""
+Asyncio multi-device poller
+--------------------------------------------------------------------------
+
+Reads /process from many Rotavapors concurrently from one thread. Every device
+keeps one persistent keep-alive connection and is polled with the same drift
+corrected cadence the example scripts use (see scheduler.py): the next poll
+is scheduled `interval` seconds after the previous scheduled poll, not after
+the previous poll finished.
+
+Every polled document is passed to all sinks:
+
+    sink(device, poll_at, proc_msg)
+
+A sink may return an awaitable (e.g. device.put_process(...)), which is
+awaited before the next sink is called. Sinks run on the event loop, so they
+must not block for long. A sink with a gap attribute is told when a device
+stops answering, e.g. to mark the gap in a recording:
+
+    sink.gap(device, poll_at, error)
+
+A device that doesn't answer doesn't stop the others, and it isn't retried at
+the poll rate either: every device has a PollGuard (see resilience.py) that
+adapts the request timeout, backs off failed polls and only probes a device
+that keeps failing. A device that can't be reached at startup is connected
+by the same retries. So a network blip across the fleet doesn't turn into a
+burst of retries from every device at once.
+"""
+
+import asyncio
+import inspect
+import logging
+import ssl
+import time
+from os import path
+
+import aiohttp
+
+from openinterface.fetch import loads
+from openinterface.resilience import PollGuard, AdaptiveTimeout
+from openinterface.scheduler import Scheduler
+from openinterface.stats import SamplingStats
+
+log = logging.getLogger(__name__)
+
+
+class Device(object):
+    """ Connection details and HTTP calls for one Rotavapor
+
+    :param host: host or IP of the rotavapor (with optional :port)
+    :param user: device user
+    :param password: device password
+    :param cert: root cert file, certificate checks are disabled if it doesn't exist
+    :param scheme: 'https' for real devices, 'http' for the fake device
+    """
+
+    def __init__(self, host, user='rw', password='', cert='root_cert.crt', scheme='https'):
+        self.host = host
+        self.name = host    # replaced by the system name once connected
+        self.auth = aiohttp.BasicAuth(user, password)
+        base_url = f"{scheme}://{host}/api/v1"
+        self.info_endpoint = base_url + "/info"
+        self.process_endpoint = base_url + "/process"
+        if scheme != 'https':
+            self.ssl = True     # ignored for plain http
+        elif cert is not None and path.isfile(cert):
+            self.ssl = ssl.create_default_context(cafile=cert)
+        else:
+            log.warning("Root certificate missing for %s. Disabling certificate checks...", host)
+            self.ssl = False
+        self.session = None
+        self.stats = None   # SamplingStats, set once polling starts
+        self.guard = None   # PollGuard, set once polling starts
+        self.connected = False
+
+    async def get(self, endpoint, timeout=None):
+        kwargs = {'timeout': aiohttp.ClientTimeout(total=timeout)} if timeout is not None else {}
+        async with self.session.get(endpoint, auth=self.auth, ssl=self.ssl, **kwargs) as resp:
+            if resp.status != 200:
+                raise Exception("Unexpected status code when polling process data", resp.status)
+            return loads(await resp.read())
+
+    async def connect(self, session, timeout=None):
+        """ Verifies that the device is a Rotavapor and reads its name
+
+        :param session: the aiohttp session used for all requests to this device
+        :param timeout: seconds to wait for the device, None for the session default
+        """
+        self.session = session
+        info_msg = await self.get(self.info_endpoint, timeout)
+        if info_msg["systemClass"] != "Rotavapor":
+            raise Exception(f"This is not a Rotavapor: {self.host}")
+        self.name = info_msg["systemName"]
+        if self.guard is not None:
+            self.guard.name = self.name
+        self.connected = True
+        log.info("Connected to %s (%s)", self.name, self.host)
+
+    async def read_process(self, timeout=None):
+        return await self.get(self.process_endpoint, timeout)
+
+    async def put_process(self, msg):
+        async with self.session.put(self.process_endpoint, json=msg, auth=self.auth, ssl=self.ssl) as resp:
+            if resp.status != 200:
+                raise Exception("Unexpected status code when trying to send message to api", resp.status)
+
+
+class FleetPoller(object):
+    """ Polls the process data of many devices concurrently
+
+    :param devices: list of Device
+    :param sinks: list of sink callables, see module docstring
+    :param interval: poll interval in seconds
+    :param timeout: longest timeout of a single request in seconds, shorter
+                    timeouts follow the latency of the device (see resilience.py)
+    :param report_interval: log the sampling statistics of every device every n seconds (None to disable)
+    """
+
+    def __init__(self, devices, sinks, interval=1, timeout=10, report_interval=60):
+        self.devices = devices
+        self.sinks = sinks
+        self.interval = interval
+        self.timeout = timeout
+        self.report_every = max(1, round(report_interval / interval)) if report_interval else None
+        self.running = False
+
+    def run(self):
+        """ Polls until stop() is called (blocking) """
+        asyncio.run(self.run_async())
+
+    def stop(self):
+        self.running = False
+
+    async def run_async(self):
+        self.running = True
+        # one keep-alive connection per device, shared by polls and writes
+        connector = aiohttp.TCPConnector(limit_per_host=1)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*[self.poll(device, session) for device in self.devices])
+
+    async def poll(self, device, session):
+        scheduler = Scheduler(self.interval)
+        device.stats = stats = SamplingStats(self.interval)
+        device.guard = guard = PollGuard(self.interval, device.name,
+                                         timeout=AdaptiveTimeout(initial=self.timeout, maximum=self.timeout))
+        while self.running:
+            if not guard.ready():
+                guard.skip()
+                self.skipped(device, scheduler.slot_at)
+            else:
+                jitter = scheduler.lateness()
+                started = time.monotonic()
+                try:
+                    if not device.connected:
+                        await device.connect(session, guard.timeout)
+                    proc_msg = await device.read_process(guard.timeout)
+                except Exception as e:
+                    # one unreachable device must not stop the others
+                    guard.failure(e)
+                    self.failed(device, scheduler.slot_at, e)
+                    if guard.consecutive == 1:
+                        self.gap(device, scheduler.slot_at, e)
+                else:
+                    latency = time.monotonic() - started
+                    guard.success(latency)
+                    stats.observe(jitter, latency)
+                    await self.feed(device, scheduler.slot_at, proc_msg)
+                    if self.report_every and stats.samples % self.report_every == 0:
+                        stats.report(log, device.name)
+
+            # delay execution so that we poll once every interval
+            sleep_for, missed = scheduler.advance()
+            if sleep_for == 0:
+                stats.late += 1
+            stats.missed += missed
+            await asyncio.sleep(sleep_for)
+
+    def failed(self, device, poll_at, error):
+        """ Called for every failed poll, override to handle errors. The
+        error is already logged (sampled) by the PollGuard of the device. """
+
+    def skipped(self, device, poll_at):
+        """ Called for every slot skipped while the device is backed off """
+
+    def gap(self, device, poll_at, error):
+        """ Called on the first failed poll of an outage, tells the sinks """
+        for sink in self.sinks:
+            gap = getattr(sink, 'gap', None)
+            if gap is None:
+                continue
+            try:
+                gap(device, poll_at, error)
+            except Exception as e:
+                log.error("Sink %s failed for %s: %s", sink, device.name, e)
+
+    async def feed(self, device, poll_at, proc_msg):
+        for sink in self.sinks:
+            try:
+                result = sink(device, poll_at, proc_msg)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                log.error("Sink %s failed for %s: %s", sink, device.name, e)
@@ -0,0 +1,228 @@
+"""
+Resilient polling: adaptive timeouts, backoff and circuit breaking
+--------------------------------------------------------------------------
+
+A device that fails to answer should not crash the polling loop, and it
+should not be polled at full rate either: retrying a struggling device (or a
+congested network) at the sampling rate only adds to its load. A PollGuard
+decides per device when the next poll may be sent:
+
+- the request timeout adapts to the measured latency (smoothed latency plus
+  four times its deviation, like TCP's retransmission timeout) and doubles
+  after every timeout
+- after a failure, polls are paused with exponential backoff and random
+  jitter, so many clients don't retry in lockstep
+- after several failures in a row the circuit opens: the device is only
+  probed every reset_after seconds until a poll succeeds again
+
+The polling loops keep their time grid, slots in which the device must not be
+polled are skipped:
+
+    guard = PollGuard(interval, name)
+    while True:
+        if guard.ready():
+            started = time.monotonic()
+            try:
+                document = fetcher.fetch(session, url, timeout=guard.timeout)
+            except Exception as e:
+                guard.failure(e)
+            else:
+                guard.success(time.monotonic() - started)
+        else:
+            guard.skip()
+        ...sleep until the next slot
+
+The loops reuse their long-lived session for every retry, so a retry costs at
+most one new connection, and the backoff bounds how often that happens.
+"""
+
+import logging
+import random
+import time
+
+from openinterface.metrics import SampledLog
+
+log = logging.getLogger(__name__)
+
+
+def is_timeout(error):
+    """ True for the timeout exceptions of socket, requests, urllib3 and asyncio """
+    return isinstance(error, TimeoutError) or any('Timeout' in cls.__name__ for cls in type(error).__mro__)
+
+
+class Backoff(object):
+    """ Exponential backoff with jitter
+
+    The n-th delay in a row is drawn between half and all of
+    base * factor ** (n - 1), capped at maximum.
+
+    :param base: seconds of the first delay
+    :param maximum: longest delay in seconds
+    :param factor: growth per failure
+    :param rng: random.Random, e.g. seeded for tests
+    """
+
+    def __init__(self, base=1.0, maximum=30.0, factor=2.0, rng=None):
+        self.base = base
+        self.maximum = maximum
+        self.factor = factor
+        self.random = rng or random.Random()
+        self.failures = 0
+
+    def failure(self):
+        """ :returns: seconds to wait before the next attempt """
+        self.failures += 1
+        cap = min(self.maximum, self.base * self.factor ** (self.failures - 1))
+        return self.random.uniform(cap / 2, cap)
+
+    def reset(self):
+        self.failures = 0
+
+
+class AdaptiveTimeout(object):
+    """ Request timeout following the measured latency (see RFC 6298)
+
+    :param initial: timeout in seconds before the first measurement
+    :param minimum: shortest timeout in seconds
+    :param maximum: longest timeout in seconds
+    """
+
+    def __init__(self, initial=5.0, minimum=0.5, maximum=10.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.timeout = initial
+        self.smoothed = None
+        self.deviation = None
+
+    def observe(self, latency):
+        if self.smoothed is None:
+            self.smoothed = latency
+            self.deviation = latency / 2
+        else:
+            self.deviation = 0.75 * self.deviation + 0.25 * abs(self.smoothed - latency)
+            self.smoothed = 0.875 * self.smoothed + 0.125 * latency
+        self.timeout = min(max(self.smoothed + 4 * self.deviation, self.minimum), self.maximum)
+
+    def expired(self):
+        """ Called after a timeout, doubles the timeout """
+        self.timeout = min(self.timeout * 2, self.maximum)
+
+
+class CircuitBreaker(object):
+    """ Stops polling a device after repeated failures
+
+    closed: polls are sent. open: the device failed threshold times in a
+    row, it is only probed every reset_after seconds. half open: a probe is
+    allowed, its result closes or reopens the circuit.
+
+    :param threshold: failures in a row that open the circuit
+    :param reset_after: seconds between two probes of an open circuit
+    """
+
+    def __init__(self, threshold=5, reset_after=10.0):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.opened = 0     # times the circuit opened
+
+    def allow(self, now):
+        if self.state == 'open' and now - self.opened_at >= self.reset_after:
+            self.state = 'half open'
+        return self.state != 'open'
+
+    def success(self):
+        self.state = 'closed'
+        self.failures = 0
+
+    def failure(self, now):
+        self.failures += 1
+        if self.state == 'half open' or (self.state == 'closed' and self.failures >= self.threshold):
+            if self.state == 'closed':
+                self.opened += 1
+            self.state = 'open'
+            self.opened_at = now
+
+
+class PollGuard(object):
+    """ Decides when a device is polled, see module docstring
+
+    :param interval: poll interval in seconds, the first backoff delay
+    :param name: name of the device in log messages
+    :param timeout: AdaptiveTimeout (default: initial 5 s, 0.5 s to 10 s)
+    :param backoff: Backoff (default: from interval up to 30 s)
+    :param breaker: CircuitBreaker (default: opens after 5 failures, probes every 10 s)
+    :param clock: function returning the monotonic time
+    """
+
+    def __init__(self, interval=1, name='device', timeout=None, backoff=None, breaker=None, clock=time.monotonic):
+        self.name = name
+        self.timeouts = timeout or AdaptiveTimeout()
+        self.backoff = backoff or Backoff(base=interval)
+        self.breaker = breaker or CircuitBreaker()
+        self.clock = clock
+        self.log = SampledLog(log)  # per guard, so one failing device doesn't hide the others
+        self.retry_at = 0.0
+        self.consecutive = 0    # failures since the last success
+        self.failures = 0       # failed polls
+        self.timeouts_hit = 0   # failed polls that timed out
+        self.skipped = 0        # slots skipped while backing off or with an open circuit
+        self.outages = 0        # times the device started failing
+
+    @property
+    def timeout(self):
+        """ seconds to wait for the next request """
+        return self.timeouts.timeout
+
+    @property
+    def failing(self):
+        return self.consecutive > 0
+
+    def ready(self):
+        """ :returns: True if the device may be polled now """
+        now = self.clock()
+        return now >= self.retry_at and self.breaker.allow(now)
+
+    def skip(self):
+        self.skipped += 1
+
+    def success(self, latency):
+        """ Called after a successful poll that took latency seconds """
+        if self.consecutive:
+            log.info("%s answers again after %d failed polls", self.name, self.consecutive)
+        self.timeouts.observe(latency)
+        self.backoff.reset()
+        self.breaker.success()
+        self.consecutive = 0
+        self.retry_at = 0.0
+
+    def failure(self, error):
+        """ Called after a failed poll
+
+        :returns: seconds until the device is polled again
+        """
+        now = self.clock()
+        self.failures += 1
+        self.consecutive += 1
+        if self.consecutive == 1:
+            self.outages += 1
+        if is_timeout(error):
+            self.timeouts_hit += 1
+            self.timeouts.expired()
+        delay = self.backoff.failure()
+        was_open = self.breaker.state == 'open'
+        self.breaker.failure(now)
+        if self.breaker.state == 'open':
+            delay = max(delay, self.breaker.reset_after)
+            if not was_open and self.consecutive >= self.breaker.threshold:
+                log.warning("%s failed %d times in a row, probing every %.0f s: %s",
+                            self.name, self.consecutive, self.breaker.reset_after, error)
+        self.retry_at = now + delay
+        self.log.warning("Polling %s failed, retrying in %.1f s: %s", self.name, delay, error)
+        return delay
+
+    def summary(self):
+        return (f"{self.failures} failed polls ({self.timeouts_hit} timeouts) in {self.outages} outages, "
+                f"{self.skipped} slots skipped, circuit {self.breaker.state} (opened {self.breaker.opened} times), "
+                f"timeout {self.timeout:.2f} s")
@@ -0,0 +1,47 @@
+"""
+Sample OpenInterface documents of a Rotavapor R-300 with Interface I-300pro.
+Used by benchmarks and the fake device. Values are typical for a running
+AutoDest distillation.
+"""
+
+info_sample = {
+    "systemName": "R-300 Sample",
+    "systemClass": "Rotavapor",
+    "systemLine": "R-300",
+}
+
+process_sample = {
+    "heating": {"set": 40.0, "act": 39.8, "running": True},
+    "cooling": {"set": 10.0, "act": 10.3, "running": True},
+    "vacuum": {
+        "set": 470.0,
+        "act": 472.5,
+        "aerateValveOpen": False,
+        "aerateValvePulse": False,
+        "vacuumValveOpen": True,
+        "vaporTemp": 28.4,
+        "autoDestIn": 11.2,
+        "autoDestOut": 14.9,
+        "powerPercentAct": 65,
+    },
+    "rotation": {"set": 120.0, "act": 119.0, "running": True},
+    "lift": {"set": 0, "act": 0, "limit": 155},
+    "program": {
+        "type": "AutoDest",
+        "set": 0,
+        "remaining": 0,
+        "solventName": "",
+        "methodName": "",
+        "mode": "",
+        "flaskSize": 1000,
+    },
+    "globalStatus": {
+        "timeStamp": "2020-06-15T14:23:51+02:00",
+        "processTime": 312,
+        "runId": 17,
+        "onHold": False,
+        "foamActive": False,
+        "currentError": 0,
+        "running": True,
+    },
+}
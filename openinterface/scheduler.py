@@ -0,0 +1,68 @@
+"""
+Fixed-rate scheduling on the monotonic clock
+--------------------------------------------------------------------------
+
+The examples poll on a fixed time grid. The grid is kept on the monotonic
+clock, so changes of the system time (NTP, daylight saving) don't shift it.
+The wall clock time of a slot is derived from the start time, which keeps
+recorded timestamps exact multiples of the interval.
+
+    scheduler = Scheduler(interval)
+    while True:
+        poll(scheduler.slot_at)
+        sleep_for, missed = scheduler.advance()
+        time.sleep(sleep_for)
+"""
+
+import time
+from datetime import datetime, timedelta
+
+
+def add_rate_argument(parser, default=1.0):
+    """ Adds the --rate option shared by the example scripts """
+    parser.add_argument('-r', '--rate', type=float, help=f'sampling rate in Hz (default {default:g})', default=default)
+
+
+class Scheduler(object):
+    """ Slots every interval seconds, starting now
+
+    :param interval: seconds between two slots
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.started_at = datetime.now()
+        self.slot = 0
+
+    @property
+    def due(self):
+        """ monotonic time of the current slot """
+        return self.started + self.slot * self.interval
+
+    @property
+    def slot_at(self):
+        """ wall clock time of the current slot """
+        return self.started_at + timedelta(seconds=self.slot * self.interval)
+
+    def resync(self):
+        """ Restarts the grid now, e.g. after polling off the grid """
+        self.started = time.monotonic()
+        self.started_at = datetime.now()
+        self.slot = 0
+
+    def lateness(self):
+        """ :returns: seconds since the current slot was due """
+        return time.monotonic() - self.due
+
+    def advance(self):
+        """ Moves to the next slot. Slots that have passed completely are
+        skipped, a slot that has just begun is still used.
+
+        :returns: (seconds to sleep until the slot is due, number of skipped slots)
+        """
+        self.slot += 1
+        now = time.monotonic()
+        missed = int((now - self.due) // self.interval) if now > self.due else 0
+        self.slot += missed
+        return max(self.due - now, 0), missed
@@ -0,0 +1,171 @@
+"""
+Local OpenInterface server
+--------------------------------------------------------------------------
+
+Base of the local servers that answer like a Rotavapor: GET /api/v1/info and
+GET/PUT /api/v1/process over HTTP/1.1 with keep-alive (plain or TLS) and
+optional basic authentication. Subclasses provide the process data:
+
+- process_response() returns the document and extra headers of GET /process
+- write_process(changes) applies a PUT /process
+
+Both may raise ServiceUnavailable to answer 503 Service Unavailable.
+Connections and requests are counted, which makes it possible to check that
+clients reuse their connections.
+
+FakeDevice (fake_device.py) serves sample documents, SnapshotServer
+(snapshot.py) serves the snapshots of a real device.
+"""
+
+import base64
+import json
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ServiceUnavailable(Exception):
+    """ Raised by process_response/write_process to answer 503 Service Unavailable """
+
+
+class OpenInterfaceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep connections alive
+
+    def setup(self):
+        super(OpenInterfaceHandler, self).setup()
+        # headers and body are written separately, don't let Nagle delay the body
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def authorized(self):
+        if self.server.auth is None:
+            return True
+        expected = 'Basic ' + base64.b64encode(('%s:%s' % self.server.auth).encode()).decode()
+        return self.headers.get('Authorization') == expected
+
+    def reply(self, status, document=None, headers=None):
+        if isinstance(document, bytes):
+            body = document     # already encoded
+        else:
+            body = json.dumps(document).encode() if document is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.count('requests')
+        if not self.authorized():
+            return self.reply(401)
+        if self.server.delay():
+            return self.reply(503)
+        if self.path == '/api/v1/info':
+            return self.reply(200, self.server.info)
+        if self.path == '/api/v1/process':
+            try:
+                document, headers = self.server.process_response()
+            except ServiceUnavailable:
+                return self.reply(503)
+            self.reply(200, document, headers)
+            self.server.served.append(time.monotonic())
+            return
+        self.reply(404)
+
+    def do_PUT(self):
+        self.server.count('requests')
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if not self.authorized():
+            return self.reply(401)
+        if self.server.delay():
+            return self.reply(503)
+        if self.path != '/api/v1/process':
+            return self.reply(404)
+        try:
+            changes = json.loads(body)
+        except ValueError:
+            return self.reply(400)
+        try:
+            self.server.write_process(changes)
+        except ServiceUnavailable:
+            return self.reply(503)
+        self.reply(200)
+
+
+class OpenInterfaceServer(ThreadingHTTPServer):
+    """ Serves /info and /process like a device, see module docstring
+
+    :param address: (host, port) to listen on, port 0 picks a free port
+    :param info: /info document
+    :param auth: (user, password) tuple or None to accept any request
+    :param certfile: PEM file with certificate and private key to serve HTTPS
+    """
+    daemon_threads = True
+
+    def __init__(self, address, info, auth=None, certfile=None):
+        super(OpenInterfaceServer, self).__init__(address, OpenInterfaceHandler)
+        self.scheme = 'http'
+        if certfile is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.scheme = 'https'
+        self.auth = auth
+        self.info = info
+        self.writes = []                        # accepted writes
+        self.written = deque(maxlen=100000)     # time.monotonic() of every write
+        self.served = deque(maxlen=100000)      # time.monotonic() when a /process document was sent
+        self.counters = {'connections': 0, 'requests': 0, 'errors': 0}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"{self.scheme}://{host}:{port}/api/v1"
+
+    @property
+    def host(self):
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def delay(self):
+        """ Called before every request
+
+        :returns: True if the request should fail with 503
+        """
+        return False
+
+    def process_response(self):
+        """ :returns: (document or encoded body, extra headers) of a GET /process """
+        raise NotImplementedError()
+
+    def write_process(self, changes):
+        """ Applies a PUT /process
+
+        :param changes: the (partial) process document
+        """
+        raise NotImplementedError()
+
+    def start(self):
+        """ Serves requests on a background thread """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
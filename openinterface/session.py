@@ -0,0 +1,147 @@
+"""
+Pooled HTTP session with retries and metrics
+--------------------------------------------------------------------------
+
+Creating a requests.Session per request costs a full TCP and TLS handshake
+against the device. create_session() returns one long-lived session that
+keeps its connections alive, retries failed requests with exponential backoff
+and can be shared by several threads. The optional SessionMetrics count new
+connections (handshakes) and request latencies, so connection reuse can be
+verified.
+"""
+
+import threading
+import time
+from collections import deque
+from os import path
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+
+class SessionMetrics(object):
+    """ Thread safe counters of a session
+
+    :param window: number of latencies kept for the statistics
+    """
+
+    def __init__(self, window=100):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.latencies = deque(maxlen=window)
+
+    def count_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    def observe(self, seconds):
+        with self.lock:
+            self.requests += 1
+            self.latencies.append(seconds)
+
+    def mean_latency(self):
+        """ :returns: mean latency of the recent requests in seconds (0 if there were none) """
+        with self.lock:
+            latencies = list(self.latencies)
+        return sum(latencies) / len(latencies) if latencies else 0
+
+    def summary(self):
+        """ :returns: human readable one line summary """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            connections, requests = self.connections, self.requests
+        if not latencies:
+            return f"{requests} requests, {connections} connections"
+        mean = sum(latencies) / len(latencies)
+        return (f"{requests} requests, {connections} connections, "
+                f"latency mean {mean * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms "
+                f"(last {len(latencies)})")
+
+
+class MeteredAdapter(HTTPAdapter):
+    """ A transport adapter that reports new connections and request latencies """
+
+    def __init__(self, metrics, **kwargs):
+        self.metrics = metrics
+        super(MeteredAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(MeteredAdapter, self).init_poolmanager(*args, **kwargs)
+        metrics = self.metrics
+
+        class MeteredHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                metrics.count_connection()
+                return super(MeteredHTTPConnectionPool, self)._new_conn()
+
+        class MeteredHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                metrics.count_connection()
+                return super(MeteredHTTPSConnectionPool, self)._new_conn()
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': MeteredHTTPConnectionPool,
+            'https': MeteredHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super(MeteredAdapter, self).send(request, **kwargs)
+        finally:
+            self.metrics.observe(time.perf_counter() - started)
+
+
+class MethodRetry(Retry):
+    """ Retries only requests of the allowed_methods
+
+    Retry checks the method for read errors and status codes only, a refused
+    or timed out connection is retried for every method. Requests of other
+    methods give up on the first error here.
+    """
+
+    def increment(self, method=None, *args, **kwargs):
+        if method is not None and self.allowed_methods is not None and method.upper() not in self.allowed_methods:
+            return super(MethodRetry, self.new(total=0)).increment(method, *args, **kwargs)
+        return super(MethodRetry, self).increment(method, *args, **kwargs)
+
+
+def create_session(auth, cert=None, retries=3, backoff_factor=0.2, pool_maxsize=4, metrics=None,
+                   retry_methods=('GET', 'PUT')):
+    """ Creates a long-lived session for one device
+
+    :param auth: (user, password) tuple
+    :param cert: root cert file, certificate checks are disabled if None or missing
+    :param retries: number of retries for connection errors and 5xx replies
+    :param backoff_factor: retries wait backoff_factor * 2 ** (retry - 1) seconds
+    :param pool_maxsize: connections kept alive, one per thread using the session
+    :param metrics: optional SessionMetrics
+    :param retry_methods: methods retried by the session, requests of other
+        methods fail on the first error, connection errors included. Polling
+        loops with a PollGuard (see resilience.py) pass ('PUT',): the guard
+        backs off failed polls, retrying them right away would only add load
+    :returns: requests.Session
+    """
+    session = requests.Session()
+    session.auth = auth
+    if cert is not None and path.isfile(cert):
+        session.verify = cert
+    else:
+        session.verify = False
+        urllib3.disable_warnings()
+
+    # GET and PUT on /process are idempotent, so both may be retried
+    retry = MethodRetry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=(500, 502, 503, 504),
+                  allowed_methods=frozenset(retry_methods))
+    if metrics is not None:
+        adapter = MeteredAdapter(metrics, max_retries=retry, pool_maxsize=pool_maxsize)
+    else:
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
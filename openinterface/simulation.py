@@ -0,0 +1,92 @@
+"""
+Simulated process values
+--------------------------------------------------------------------------
+
+ProcessSimulator lets the values of a process document evolve over time like
+a running distillation, so the examples see realistic, changing data from the
+fake device:
+
+- actual values follow their set points with a first order lag
+- the vapor temperature follows the bath temperature minus a gradient while
+  the device is running and falls back to ambient temperature otherwise
+- process time and timestamp advance while the device is running
+- actual values get a little measurement noise
+
+The time constants are attributes, so benchmarks can speed the process up.
+"""
+
+import math
+import random
+import time
+from datetime import datetime
+
+ambient = 20.0      # °C
+
+
+def follow(value, target, dt, tau):
+    """ Moves value towards target with a first order lag of time constant tau """
+    return target + (value - target) * math.exp(-dt / tau)
+
+
+class ProcessSimulator(object):
+    """ Evolves a process document in place
+
+    :param process: the process document
+    :param seed: seed of the measurement noise
+    """
+
+    bath_tau = 120.0        # s, heating bath
+    cooling_tau = 60.0      # s, chiller
+    vacuum_tau = 15.0       # s, vacuum pump
+    rotation_tau = 2.0      # s, drive
+    vapor_tau = 30.0        # s, vapor temperature
+    gradient = 15.0         # °C, bath temperature minus vapor temperature
+    noise = 0.05            # standard deviation of the measurement noise
+
+    def __init__(self, process, seed=None):
+        self.process = process
+        self.random = random.Random(seed)
+        self.last = time.monotonic()
+        self.state = {}     # noiseless actual values
+        self.process_time = float(process['globalStatus'].get('processTime', 0))
+
+    def actual(self, section, target, dt, tau):
+        """ Lets process[section]['act'] follow target and returns the noiseless value """
+        key = (section, 'act')
+        value = self.state.get(key, self.process[section]['act'])
+        value = self.state[key] = follow(value, target, dt, tau)
+        self.process[section]['act'] = round(value + self.random.gauss(0, self.noise), 1)
+        return value
+
+    def step(self, now=None):
+        """ Advances the simulation to now
+
+        :param now: time.monotonic() of the step, defaults to now
+        """
+        now = time.monotonic() if now is None else now
+        dt = max(now - self.last, 0.0)
+        self.last = now
+        p = self.process
+        running = p['globalStatus']['running'] and not p['globalStatus']['onHold']
+
+        heating = p['heating']
+        bath = self.actual('heating', heating['set'] if heating['running'] else ambient, dt, self.bath_tau)
+        cooling = p['cooling']
+        chiller = self.actual('cooling', cooling['set'] if cooling['running'] else ambient, dt, self.cooling_tau)
+        rotation = p['rotation']
+        self.actual('rotation', rotation['set'] if rotation['running'] and running else 0.0, dt, self.rotation_tau)
+        self.actual('vacuum', p['vacuum']['set'] if running else 1013.0, dt, self.vacuum_tau)
+
+        vacuum = p['vacuum']
+        vapor = self.state.get('vaporTemp', vacuum['vaporTemp'])
+        vapor = self.state['vaporTemp'] = follow(vapor, bath - self.gradient if running else ambient, dt, self.vapor_tau)
+        vacuum['vaporTemp'] = round(vapor + self.random.gauss(0, self.noise), 1)
+        vacuum['autoDestIn'] = round(chiller + 1 + self.random.gauss(0, self.noise), 1)
+        vacuum['autoDestOut'] = round(chiller + 4.5 + self.random.gauss(0, self.noise), 1)
+        vacuum['powerPercentAct'] = max(0, min(100, round(65 + self.random.gauss(0, 3)))) if running else 0
+
+        status = p['globalStatus']
+        if running:
+            self.process_time += dt
+        status['processTime'] = int(self.process_time)
+        status['timeStamp'] = datetime.now().astimezone().isoformat(timespec='seconds')
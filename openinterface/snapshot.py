@@ -0,0 +1,276 @@
+"""
+Shared snapshot of the process document
+--------------------------------------------------------------------------
+
+If the recorder, the Modbus bridge and a stop rule run against the same
+device, each of them polls /process and the device serves three times the
+requests. SnapshotService polls the device once per interval and shares the
+latest document:
+
+- in the same process with latest(), callbacks or queues
+- with other processes through SnapshotServer, a local server with the same
+  /api/v1/info and /api/v1/process endpoints as the device. The examples
+  connect to it instead of the device without any change. Writes are
+  forwarded to the device.
+
+    python -m openinterface.snapshot 192.168.0.2 -p secret --port 8443 --certfile local.pem
+    python csv_recorder/csv_recorder.py 127.0.0.1:8443 -p secret
+
+Every snapshot has the wall clock time of the poll and an age. A snapshot
+older than stale_after seconds is not served: latest() raises StaleSnapshot
+and the server answers 503. The examples treat a 503 like any failed poll,
+their PollGuard backs off and polls again (see resilience.py). While the
+device doesn't answer, the service itself backs off with a PollGuard, so the
+consumers' polls never turn into requests to the device.
+"""
+
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+from openinterface.resilience import PollGuard
+from openinterface.scheduler import Scheduler, add_rate_argument
+from openinterface.server import OpenInterfaceServer, ServiceUnavailable
+from openinterface.session import create_session
+from openinterface.stats import SamplingStats
+
+log = logging.getLogger(__name__)
+
+
+class StaleSnapshot(Exception):
+    """ There is no snapshot younger than the staleness limit """
+
+
+class Snapshot(object):
+    """ A polled process document
+
+    :param document: the decoded process document
+    :param taken_at: wall clock time of the poll
+    :param sequence: number of the snapshot, counting from 1
+    """
+
+    def __init__(self, document, taken_at, sequence):
+        self.document = document
+        self.taken_at = taken_at
+        self.sequence = sequence
+        self.polled = time.monotonic()
+        self._body = None
+
+    @property
+    def age(self):
+        """ seconds since the poll """
+        return time.monotonic() - self.polled
+
+    @property
+    def body(self):
+        """ the document encoded as JSON, encoded once for all consumers """
+        if self._body is None:
+            self._body = json.dumps(self.document).encode()
+        return self._body
+
+
+class SnapshotService(object):
+    """ Polls one device and shares the latest process document
+
+    Consumers must not change the shared document.
+
+    :param read_process: function(timeout) returning the process document of the device
+    :param interval: seconds between two polls
+    :param stale_after: snapshots older than this are stale (default 3 intervals)
+    """
+
+    def __init__(self, read_process, interval=1, stale_after=None):
+        self.read_process = read_process
+        self.guard = PollGuard(interval)
+        self.interval = interval
+        self.stale_after = stale_after if stale_after is not None else 3 * interval
+        self.snapshot = None
+        self.callbacks = []
+        self.queues = []
+        self.stats = SamplingStats(interval)
+        self.errors = 0
+        self.updated = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def latest(self, max_age=None):
+        """ :param max_age: staleness limit of this consumer (default stale_after)
+            :returns: the latest Snapshot
+            :raises StaleSnapshot: if there is no snapshot younger than max_age """
+        snapshot = self.snapshot
+        limit = self.stale_after if max_age is None else max_age
+        if snapshot is None or snapshot.age > limit:
+            raise StaleSnapshot(f"no snapshot younger than {limit:g} s")
+        return snapshot
+
+    def wait(self, sequence=0, timeout=None):
+        """ Waits for a snapshot newer than sequence
+
+        :returns: the Snapshot, None on timeout
+        """
+        with self.updated:
+            self.updated.wait_for(lambda: self.snapshot is not None and self.snapshot.sequence > sequence, timeout)
+            snapshot = self.snapshot
+        return snapshot if snapshot is not None and snapshot.sequence > sequence else None
+
+    def subscribe(self, callback):
+        """ Calls callback(snapshot) on the polling thread for every new snapshot,
+        so it must return quickly """
+        self.callbacks.append(callback)
+
+    def queue(self, maxsize=1):
+        """ :returns: a queue receiving every new snapshot, the oldest snapshot
+                      is dropped if the consumer falls behind """
+        q = queue.Queue(maxsize)
+        self.queues.append(q)
+        return q
+
+    def publish(self, snapshot):
+        with self.updated:
+            self.snapshot = snapshot
+            self.updated.notify_all()
+        for callback in self.callbacks:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                log.error("Snapshot callback %s failed: %s", callback, e)
+        for q in self.queues:
+            while True:
+                try:
+                    q.put_nowait(snapshot)
+                    break
+                except queue.Full:
+                    try:
+                        q.get_nowait()
+                        self.stats.dropped += 1
+                    except queue.Empty:
+                        pass
+
+    def run(self):
+        scheduler = Scheduler(self.interval)
+        sequence = 0
+        guard = self.guard
+        while self.running:
+            jitter = scheduler.lateness()
+            started = time.monotonic()
+            if not guard.ready():
+                guard.skip()
+            else:
+                try:
+                    document = self.read_process(guard.timeout)
+                except Exception as e:
+                    self.errors += 1
+                    guard.failure(e)
+                else:
+                    latency = time.monotonic() - started
+                    guard.success(latency)
+                    self.stats.observe(jitter, latency)
+                    sequence += 1
+                    self.publish(Snapshot(document, scheduler.slot_at, sequence))
+            sleep_for, missed = scheduler.advance()
+            if sleep_for == 0:
+                self.stats.late += 1
+            self.stats.missed += missed
+            time.sleep(sleep_for)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+
+
+class SnapshotServer(OpenInterfaceServer):
+    """ Serves the snapshots of a SnapshotService like a device (see server.py)
+
+    :param service: the SnapshotService
+    :param info: /info document of the device
+    :param write_process: function sending a (partial) process document to the device
+    :param address, auth, certfile: see OpenInterfaceServer
+    """
+
+    def __init__(self, service, info, write_process, address=('127.0.0.1', 0), auth=None, certfile=None):
+        super(SnapshotServer, self).__init__(address, info, auth=auth, certfile=certfile)
+        self.service = service
+        self.forward = write_process
+
+    def process_response(self):
+        try:
+            snapshot = self.service.latest()
+        except StaleSnapshot:
+            raise ServiceUnavailable()
+        headers = {
+            'X-Snapshot-Time': snapshot.taken_at.isoformat(),
+            'X-Snapshot-Age': f"{snapshot.age:.3f}",
+        }
+        return snapshot.body, headers
+
+    def write_process(self, changes):
+        try:
+            self.forward(changes)
+        except Exception as e:
+            log.error("Forwarding a write to the device failed: %s", e)
+            raise ServiceUnavailable()
+        with self.lock:
+            self.writes.append(changes)
+            self.written.append(time.monotonic())
+
+
+def connect(host, auth, cert=None, scheme='https'):
+    """ Connects to a device
+
+    :returns: (info document, read_process, write_process)
+    """
+    session = create_session(auth, cert, retry_methods=('PUT',))
+    base_url = f"{scheme}://{host}/api/v1"
+    info_resp = session.get(base_url + "/info")
+    if info_resp.status_code != 200:
+        raise Exception("Unexpected status code when getting device info", info_resp.status_code)
+    info_msg = info_resp.json()
+    if info_msg["systemClass"] != "Rotavapor":
+        raise Exception(f"This is not a Rotavapor: {host}")
+
+    def read_process(timeout=None):
+        r = session.get(base_url + "/process", timeout=timeout)
+        if r.status_code != 200:
+            raise Exception("Unexpected status code when polling process data", r.status_code)
+        return r.json()
+
+    def write_process(changes):
+        r = session.put(base_url + "/process", json=changes)
+        if r.status_code != 200:
+            raise Exception("Unexpected status code when trying to send message to api", r.status_code)
+    return info_msg, read_process, write_process
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Polls a rotavapor once per interval and serves the latest process document to local clients.')
+    parser.add_argument('host', type=str, help='host or IP of the rotavapor')
+    parser.add_argument('-u', '--user', type=str, help='device user', default='rw')
+    parser.add_argument('-p', '--password', type=str, help='device password, clients use the same credentials', required=True)
+    parser.add_argument('-c', '--cert', type=str, help="root cert file of the device", default="root_cert.crt")
+    parser.add_argument('--http', action='store_true', help='connect to the device with plain http (fake devices)')
+    parser.add_argument('-i', '--ip', type=str, help='address to serve on', default='127.0.0.1')
+    parser.add_argument('--port', type=int, help='port to serve on', default=8443)
+    parser.add_argument('--certfile', type=str, help='PEM file with certificate and key to serve HTTPS (the examples expect HTTPS)', required=False)
+    parser.add_argument('--stale-after', type=float, help='seconds after which a snapshot is not served anymore (default 3 intervals)', required=False)
+    add_rate_argument(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    auth = (args.user, args.password)
+    info, read_process, write_process = connect(args.host, auth, args.cert, 'http' if args.http else 'https')
+    service = SnapshotService(read_process, 1 / args.rate, args.stale_after).start()
+    server = SnapshotServer(service, info, write_process, (args.ip, args.port), auth=auth, certfile=args.certfile)
+    print(f"Serving snapshots of {info['systemName']} on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,111 @@
+"""
+Latency and jitter statistics
+--------------------------------------------------------------------------
+
+Histogram counts observations in fixed buckets, so recording a sample is
+cheap and memory doesn't grow over long runs. Percentiles are estimated by
+interpolating within the bucket.
+
+SamplingStats collects the per-sample request latency and the jitter (how
+late a poll started compared to its slot) of a polling loop and tells when a
+device can't sustain the requested sampling rate.
+"""
+
+import bisect
+import threading
+
+# bucket upper bounds in seconds, from 0.5 ms to 10 s
+default_bounds = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)
+# bucket upper bounds in seconds for in-process steps, from 1 us to 10 ms
+fine_bounds = (1e-6, 2e-6, 5e-6, 1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3, 2e-3, 5e-3, 1e-2)
+
+
+class Histogram(object):
+    """ Thread safe histogram with fixed buckets
+
+    :param bounds: sorted upper bounds of the buckets, values above the last
+                   bound go into an overflow bucket
+    """
+
+    def __init__(self, bounds=default_bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def snapshot(self):
+        """ :returns: (bucket counts, count, sum) read at the same time """
+        with self.lock:
+            return list(self.counts), self.count, self.sum
+
+    def percentile(self, q):
+        """ Estimates a percentile
+
+        :param q: percentile between 0 and 100
+        :returns: estimated value, 0 if there are no observations
+        """
+        with self.lock:
+            counts, count, maximum = list(self.counts), self.count, self.max
+        if count == 0:
+            return 0.0
+        rank = q / 100 * count
+        cumulative = 0
+        for i, n in enumerate(counts):
+            if n and cumulative + n >= rank:
+                lower = self.bounds[i-1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else maximum
+                return min(lower + (upper - lower) * (rank - cumulative) / n, maximum)
+            cumulative += n
+        return maximum
+
+    def summary(self, unit=1000, suffix='ms'):
+        return "p50 {:.1f} / p95 {:.1f} / p99 {:.1f} {}".format(
+            self.percentile(50) * unit, self.percentile(95) * unit, self.percentile(99) * unit, suffix)
+
+
+class SamplingStats(object):
+    """ Statistics of a polling loop
+
+    :param interval: the requested poll interval in seconds
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.latency = Histogram()  # duration of a poll
+        self.jitter = Histogram()   # delay between the scheduled slot and the start of a poll
+        self.samples = 0            # samples read from the device
+        self.late = 0               # polls that started after their slot (no time left to sleep)
+        self.missed = 0             # slots skipped because a poll took more than an interval
+        self.dropped = 0            # samples lost because the consumer couldn't keep up
+
+    def observe(self, jitter, latency):
+        self.samples += 1
+        self.jitter.observe(jitter)
+        self.latency.observe(latency)
+
+    def sustainable(self):
+        """ :returns: False if the device is too slow for the requested rate """
+        return self.latency.percentile(95) < self.interval and self.missed <= self.samples * 0.01
+
+    def summary(self):
+        return (f"{self.samples} samples at {1 / self.interval:g} Hz, {self.late} late, "
+                f"{self.missed} missed slots, {self.dropped} dropped, "
+                f"latency {self.latency.summary()}, jitter {self.jitter.summary()}")
+
+    def report(self, log, device_name='device'):
+        """ Logs the summary, as warning if the rate can't be sustained """
+        if self.sustainable():
+            log.info(f"{device_name}: " + self.summary())
+        else:
+            log.warning(f"{device_name} cannot sustain {1 / self.interval:g} Hz: " + self.summary())
@@ -0,0 +1,83 @@
+"""
+Predictive stop for stop_at_vaportemp
+--------------------------------------------------------------------------
+
+In threshold mode the stop is sent after a poll has seen the value above the
+target, i.e. up to one poll interval plus the request latency after the
+crossing. While the bath heats up fast, the vapor temperature overshoots in
+that time.
+
+CrossingPredictor fits a straight line through a rolling window of recent
+samples and predicts when the target will be crossed. stop_at_vaportemp uses
+it to poll more often as the crossing approaches and to send the stop at the
+predicted time instead of waiting for a poll to see it.
+"""
+
+import numpy as np
+
+
+class CrossingPredictor(object):
+    """ Predicts when a rising value crosses a target
+
+    :param target: the threshold
+    :param window: number of recent samples used for the fit
+    :param min_samples: samples needed before predicting
+    """
+
+    def __init__(self, target, window=10, min_samples=3):
+        self.target = target
+        self.min_samples = min_samples
+        self.times = np.full(window, np.nan)
+        self.values = np.full(window, np.nan)
+        self.index = 0
+        self.slope = None
+
+    def add(self, t, value):
+        """ Adds a sample
+
+        :param t: time of the sample in seconds (monotonic clock)
+        :param value: the sampled value, None if missing
+        """
+        if value is None:
+            return
+        self.times[self.index] = t
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.times)
+
+    def eta(self, now):
+        """ Predicts the time until the crossing
+
+        :param now: current time in seconds (monotonic clock)
+        :returns: seconds until the value crosses the target (0 if it already
+                  has), None if the value isn't rising or there are too few samples
+        """
+        valid = ~np.isnan(self.times)
+        if np.count_nonzero(valid) < self.min_samples:
+            return None
+        t = self.times[valid]
+        v = self.values[valid]
+        # least squares fit of v = intercept + slope * t around the means
+        t_mean = t.mean()
+        v_mean = v.mean()
+        dt = t - t_mean
+        denominator = np.dot(dt, dt)
+        if denominator == 0:
+            return None
+        self.slope = np.dot(dt, v - v_mean) / denominator
+        if self.slope <= 0:
+            return None
+        value_now = v_mean + self.slope * (now - t_mean)
+        return max((self.target - value_now) / self.slope, 0.0)
+
+
+def next_delay(eta, interval, min_interval):
+    """ Tightens the poll interval as the crossing approaches
+
+    :param eta: predicted seconds until the crossing (or None)
+    :param interval: regular poll interval
+    :param min_interval: shortest poll interval
+    :returns: seconds until the next poll
+    """
+    if eta is None:
+        return interval
+    return min(interval, max(eta / 2, min_interval))
@@ -0,0 +1,183 @@
+"""
+Rule engine for stop_at_vaportemp
+--------------------------------------------------------------------------
+
+Rules are declared in a JSON file as a list of objects:
+
+    [
+        {"name": "vapor temp reached", "field": "$.vacuum.vaporTemp",
+         "op": ">", "value": 45, "samples": 3, "action": "stop"},
+        {"name": "vacuum stable", "field": "$.vacuum.act",
+         "stable": 2, "samples": 10, "action": "hold"},
+        {"name": "cool down after 1 h", "field": "$.globalStatus.processTime",
+         "op": ">", "value": 3600, "action": {"set": {"heating": {"set": 20}}}}
+    ]
+
+- field: jsonpath of the value in the process document
+- op/value: the rule matches if `<field> <op> <value>` (>, >=, <, <=, ==, !=)
+- stable: the rule matches if the last `samples` values differ by at most this
+- samples: number of consecutive matching samples (default 1)
+- action: 'stop', 'hold' or {"set": <partial process document>}
+
+A RuleSet is compiled once: every field is turned into a direct accessor and
+read only once per sample, even if several rules use it. Each device gets its
+own RuleEvaluator with the per-rule state. Every rule fires once.
+"""
+
+import copy
+import json
+import operator
+from collections import deque
+
+from openinterface.documents import merge
+from openinterface.extraction import compile_path
+
+operators = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+actions = {
+    'stop': {'globalStatus': {'running': False}},
+    'hold': {'globalStatus': {'onHold': True}},
+}
+
+
+class Rule(object):
+    """ A compiled rule
+
+    :param name: name shown when the rule fires
+    :param field: jsonpath of the tested value, None to test the whole document
+    :param action: process document sent when the rule fires
+    :param samples: number of consecutive matching samples
+    :param test: function(value) -> bool for threshold rules
+    :param tolerance: maximum spread of the last samples for stability rules
+    """
+
+    def __init__(self, name, field, action, samples=1, test=None, tolerance=None):
+        self.name = name
+        self.field = field
+        self.action = action
+        self.samples = samples
+        self.test = test
+        self.tolerance = tolerance
+        self.field_index = None     # set by the RuleSet
+
+    @property
+    def stops(self):
+        return self.action.get('globalStatus', {}).get('running') is False
+
+    def tracker(self):
+        """ :returns: function(value) -> bool keeping the per device state of this rule """
+        samples, test, tolerance = self.samples, self.test, self.tolerance
+        if tolerance is None:
+            count = 0
+
+            def update(value):
+                nonlocal count
+                count = count + 1 if value is not None and test(value) else 0
+                return count >= samples
+        else:
+            window = deque(maxlen=samples)
+
+            def update(value):
+                if value is None:
+                    window.clear()
+                    return False
+                window.append(value)
+                return len(window) == samples and max(window) - min(window) <= tolerance
+        return update
+
+
+def compile_action(action):
+    if isinstance(action, dict):
+        return action['set']
+    return actions[action]
+
+
+def compile_rule(spec):
+    """ Compiles one rule declaration (see module docstring) """
+    action = compile_action(spec.get('action', 'stop'))
+    samples = int(spec.get('samples', 1))
+    name = spec.get('name', spec['field'])
+    if 'stable' in spec:
+        return Rule(name, spec['field'], action, samples, tolerance=float(spec['stable']))
+    op, value = operators[spec['op']], spec['value']
+    return Rule(name, spec['field'], action, samples, test=lambda v: op(v, value))
+
+
+class RuleSet(object):
+    """ Rules compiled for fast evaluation
+
+    :param rules: list of Rule
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        fields = []
+        for rule in self.rules:
+            if rule.field not in fields:
+                fields.append(rule.field)
+            rule.field_index = fields.index(rule.field)
+        self.accessors = [compile_path(f) if f is not None else (lambda doc: doc) for f in fields]
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath) as f:
+            return cls([compile_rule(spec) for spec in json.load(f)])
+
+    def evaluator(self):
+        return RuleEvaluator(self)
+
+    def read_fields(self, proc_msg):
+        values = []
+        for accessor in self.accessors:
+            try:
+                values.append(accessor(proc_msg))
+            except Exception:
+                values.append(None)     # field missing in this sample
+        return values
+
+
+class RuleEvaluator(object):
+    """ Evaluates a RuleSet against the samples of one device """
+
+    def __init__(self, ruleset):
+        self.ruleset = ruleset
+        self.pending = [(rule, rule.tracker()) for rule in ruleset.rules]
+
+    def evaluate(self, proc_msg):
+        """ Checks all pending rules against one sample
+
+        :param proc_msg: the process document
+        :returns: list of rules that fired with this sample
+        """
+        values = self.ruleset.read_fields(proc_msg)
+        fired = []
+        for rule, update in self.pending:
+            value = values[rule.field_index]
+            try:
+                matched = update(value)
+            except Exception:
+                matched = False
+            if matched:
+                fired.append(rule)
+        if fired:
+            self.pending = [(rule, update) for rule, update in self.pending if rule not in fired]
+        return fired
+
+    @property
+    def done(self):
+        return not self.pending
+
+
+def action_msg(fired):
+    """ Merges the actions of the fired rules into one process document """
+    msg = {}
+    for rule in fired:
+        merge(msg, copy.deepcopy(rule.action))     # actions are shared by all devices
+    return msg
@@ -1,11 +1,20 @@
 import requests
 import argparse
 import getpass
-from datetime import datetime, timedelta
 import time
 import urllib3
 from os import path
-from jsonpath_ng import jsonpath, parse
+import sys
+import logging
+
+# make the shared openinterface package importable when running from this folder
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+from openinterface.scheduler import Scheduler, add_rate_argument
+from openinterface.stats import SamplingStats
+from openinterface.extraction import compile_path
+from openinterface.fetch import Fetcher
+from openinterface.resilience import PollGuard, Backoff
+from rules import Rule, RuleSet, action_msg
 
 # path to the relevant parameter in the process json
 path_to_param = '$.vacuum.vaporTemp'
@@ -13,9 +22,17 @@ path_to_param = '$.vacuum.vaporTemp'
 param_name = 'vapor temp'
 # unit of parameter for help / console
 unit = '°C'
-path_to_param_expr = parse(path_to_param)
+path_to_param_expr = compile_path(path_to_param)
 # stop condition as lambda. first argument is the process json as dict, second the target value
-condition = lambda proc_msg, target: path_to_param_expr.find(proc_msg)[0].value > target
+condition = lambda proc_msg, target: path_to_param_expr(proc_msg) > target
+# message that is sent to the rotavapor once the condition is met
+stop_msg = { 'globalStatus' : { 'running' : False } }
+# predictive mode: number of recent samples used to predict when the threshold is crossed
+predict_window = 10
+# predictive mode: shortest poll interval in seconds while the crossing approaches
+predict_min_interval = 0.1
+# seconds the parameter is watched after stopping to log the overshoot (0 to exit immediately)
+overshoot_window = 10
 
 if __name__ == "__main__":
     # parse command line arguments
@@ -24,7 +41,11 @@ if __name__ == "__main__":
     parser.add_argument('host', type=str, help='host or IP of rotavapor')
     parser.add_argument('-u', '--user', type=str, help='device user (rw or ro)', default='rw')
     parser.add_argument('-p', '--password', type=str, help='device password', required=False)
+    parser.add_argument('--rules', type=str, help='JSON file with further rules (see rules.py)', required=False)
+    parser.add_argument('--predictive', action='store_true', help=f'predict when the {param_name} threshold is crossed and stop at that time')
+    add_rate_argument(parser)
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
 
     # ask for password if it wasn't passed in as command line argument
     if args.password is None:
@@ -61,29 +82,137 @@ if __name__ == "__main__":
         raise Exception(f"This is not a Rotavapor")
 
         
+    # the threshold of the command line is the first rule, the rules file can add more
+    rules = [Rule(f"{param_name} of {target_value} {unit}", None, stop_msg, test=lambda proc_msg: condition(proc_msg, target_value))]
+    if args.rules is not None:
+        rules += RuleSet.load(args.rules).rules
+    evaluator = RuleSet(rules).evaluator()
+
     # wait for condition and stop
-    poll_at = datetime.now()
+    interval = 1 / args.rate
+    scheduler = Scheduler(interval)
+    stats = SamplingStats(interval)
+    report_every = max(1, round(60 / interval))   # report the sampling statistics every minute
+    param_accessor = path_to_param_expr
+    predictor = None
+    if args.predictive:
+        from predictive import CrossingPredictor, next_delay     # needs NumPy, not loaded otherwise
+        predictor = CrossingPredictor(target_value, predict_window)
+    stopped = False
+    # a device that doesn't answer is retried with backoff instead of ending the script
+    guard = PollGuard(interval, system_name)
+
+    # only the sections of the parameter and the rule fields are kept
+    fetcher = Fetcher([path_to_param] + [rule.field for rule in rules if rule.field is not None])
+
+    def read_process():
+        # unchanged documents are evaluated too: the rules count samples and the predictor needs their times
+        return fetcher.fetch(session, process_endpoint, timeout=guard.timeout)[0]
+
+    def try_read_process():
+        # polls unless the guard backs off, returns None if there is no new document
+        if not guard.ready():
+            guard.skip()
+            return None
+        started = time.monotonic()
+        try:
+            proc_msg = read_process()
+        except Exception as e:
+            guard.failure(e)
+            return None
+        guard.success(time.monotonic() - started)
+        return proc_msg
+
+    def read_param(proc_msg):
+        try:
+            return param_accessor(proc_msg)
+        except Exception:
+            return None
+
+    def send(msg):
+        # the message must reach the device: failed requests and 5xx replies are
+        # retried with backoff, a 4xx reply (e.g. read only user) won't get better
+        backoff = Backoff(base=interval, maximum=10)
+        while True:
+            try:
+                proc_put_resp = session.put(process_endpoint, json=msg, timeout=guard.timeout)
+            except requests.RequestException as e:
+                error = e
+            else:
+                if proc_put_resp.status_code == 200:
+                    return
+                error = Exception("Unexpected status code when trying to stop rotavapor", proc_put_resp.status_code)
+                if proc_put_resp.status_code < 500:
+                    raise error
+            delay = backoff.failure()
+            logging.warning(f"Sending to {system_name} failed, retrying in {delay:.1f} s: {error}")
+            time.sleep(delay)
+
     while True:
-        # read temperature
-        proc_resp = session.get(process_endpoint)
-        if proc_resp.status_code != 200:
-            raise Exception("Unexpected status code when polling process data", proc_resp.status_code)
-        proc_msg = proc_resp.json()
-
-        # check of we reached target temperature
-        if condition(proc_msg, target_value):
-            print(f"{param_name} of {target_value} {unit} has been reached.")
-            # send stop message
-            stop_msg = { 'globalStatus' : { 'running' : False } }
-            proc_put_resp = session.put(process_endpoint, json=stop_msg)
-            if proc_put_resp.status_code != 200:
-                raise Exception("Unexpected status code when trying to stop rotavapor", proc_put_resp.status_code)
-            break
-
-        # delay execution so that we poll once every second
-        poll_at = poll_at + timedelta(seconds=1)
-        sleep_for = (poll_at - datetime.now()).total_seconds()
-        if sleep_for > 0:
-            time.sleep(sleep_for)
+        # read temperature, skipped while the device doesn't answer
+        jitter = scheduler.lateness()
+        started = time.monotonic()
+        proc_msg = try_read_process()
+        if proc_msg is not None:
+            stats.observe(jitter, time.monotonic() - started)
+            if stats.samples % report_every == 0:
+                stats.report(logging.getLogger(), system_name)
+
+            # check all rules in one pass, e.g. if we reached target temperature
+            fired = evaluator.evaluate(proc_msg)
+            if fired:
+                for rule in fired:
+                    print(f"{rule.name} has been reached.")
+                # send the actions of all fired rules (e.g. stop message) with one request
+                send(action_msg(fired))
+                stopped = any(rule.stops for rule in fired)
+                if stopped or evaluator.done:
+                    break
+
+        # delay execution so that we poll at the sampling rate
+        sleep_for, missed = scheduler.advance()
+        if sleep_for == 0:
+            stats.late += 1
+        stats.missed += missed
+
+        if predictor is not None and proc_msg is not None:
+            predictor.add(started, read_param(proc_msg))
+            eta = predictor.eta(time.monotonic())
+            put_latency = stats.latency.sum / stats.latency.count
+            delay = next_delay(eta, sleep_for, predict_min_interval)
+            if eta is not None and eta - put_latency <= delay:
+                # the crossing happens before the next poll: stop at the predicted time
+                time.sleep(max(eta - put_latency, 0))
+                print(f"{param_name} of {target_value} {unit} is predicted to be reached now.")
+                send(stop_msg)
+                stopped = True
+                break
+            if delay < sleep_for:
+                # poll more often as the crossing approaches
+                time.sleep(delay)
+                scheduler.resync()
+                continue
+
+        time.sleep(sleep_for)
 
+    stats.report(logging.getLogger(), system_name)
+    logging.info(f"{system_name}: {fetcher.stats.summary()}")
+    logging.info(f"{system_name}: {guard.summary()}")
 
+    # watch the parameter for a while to see how far it overshoots the target
+    if stopped and overshoot_window > 0:
+        peak = None
+        watch_until = time.monotonic() + overshoot_window
+        while time.monotonic() < watch_until:
+            proc_msg = try_read_process()
+            value = read_param(proc_msg) if proc_msg is not None else None
+            if value is not None and (peak is None or value > peak):
+                peak = value
+            time.sleep(interval)
+        if peak is not None:
+            print(f"Overshoot: peak {param_name} {peak} {unit}, {peak - target_value:+.2f} {unit} relative to the target")
+        if predictor is not None and predictor.slope is not None and stats.latency.count:
+            # threshold mode sees the crossing on average half an interval later and then sends the stop
+            delay = interval / 2 + stats.latency.sum / stats.latency.count
+            print(f"Threshold mode would have stopped about {delay:.2f} s later, "
+                  f"with {param_name} about {predictor.slope * delay:.2f} {unit} higher")
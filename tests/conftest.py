@@ -0,0 +1,7 @@
+import sys
+from os import path
+
+# the examples import their sibling modules directly, like when run from their folders
+root = path.join(path.dirname(path.abspath(__file__)), '..')
+for folder in ('jupyter_lab', 'fleet_poller', 'stop_at_vaportemp', 'modbus_server', 'csv_recorder', ''):
+    sys.path.insert(0, path.join(root, folder))
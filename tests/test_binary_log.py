@@ -0,0 +1,68 @@
+import csv
+from datetime import datetime
+
+import numpy as np
+
+import binary_log
+from segments import compress_file
+
+columns = ['Time s', 'Vapor', 'Hold', 'LiftEnd']
+started_at = datetime(2020, 6, 15, 14, 23, 51)
+
+
+def write_log(filepath):
+    writer = binary_log.BinaryLogWriter(str(filepath), columns, 'R-300', started_at)
+    writer.writerow([0, 20.5, False, '*'])
+    writer.writerow([1, '*', True, 120])    # LiftEnd gets its kind from its first value
+    writer.writerow([2, 21.0, False, 125])
+    writer.close()
+    return str(filepath)
+
+
+def test_header_is_rewritten_when_kinds_are_known(tmp_path):
+    filepath = write_log(tmp_path / 'R-300.oirec')
+    header, data = binary_log.read_binary_log(filepath)
+    assert header['device_name'] == 'R-300'
+    assert header['started_at'] == started_at.isoformat()
+    assert header['columns'] == columns
+    assert header['kinds'] == ['int', 'float', 'bool', 'int']
+    assert np.isnan(data[0, 3]) and np.isnan(data[1, 1])
+    assert data[2].tolist() == [2.0, 21.0, 0.0, 125.0]
+    with open(filepath, 'rb') as f:
+        header, offset = binary_log.read_header(f)
+    assert offset % 8 == 0
+
+
+def test_columns_without_values_are_floats(tmp_path):
+    writer = binary_log.BinaryLogWriter(str(tmp_path / 'R-300.oirec'), columns, 'R-300', started_at)
+    writer.close()
+    header, data = binary_log.read_binary_log(str(tmp_path / 'R-300.oirec'))
+    assert header['kinds'] == ['float'] * 4
+    assert data.shape == (0, 4)
+
+
+def test_compressed_log_reads_like_the_original(tmp_path):
+    filepath = write_log(tmp_path / 'R-300.oirec')
+    header, data = binary_log.read_binary_log(filepath)
+    expected = np.array(data)
+    compressed = compress_file(filepath, 'gzip')
+    assert compressed.endswith('.oirec.gz')
+    header, data = binary_log.read_binary_log(compressed)
+    np.testing.assert_array_equal(data, expected)
+    header, chunks = binary_log.read_chunks(compressed, size=2)
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+
+
+def test_convert_to_csv(tmp_path):
+    filepath = compress_file(write_log(tmp_path / 'R-300.oirec'), 'gzip')
+    csvpath = binary_log.csv_filepath(filepath)
+    assert csvpath == str(tmp_path / 'R-300.csv')
+    binary_log.convert_to_csv(filepath, csvpath, csv.excel, "%d.%m.%Y %H:%M", '*')
+    with open(csvpath, newline='') as f:
+        assert list(csv.reader(f)) == [
+            columns,
+            ['15.06.2020 14:23'],
+            ['0', '20.5', 'False', '*'],
+            ['1', '*', 'True', '120'],
+            ['2', '21.0', 'False', '125'],
+        ]
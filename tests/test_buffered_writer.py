@@ -0,0 +1,50 @@
+import csv
+from datetime import datetime
+
+import binary_log
+from buffered_writer import BufferedRowWriter, recover_file, recover_partial_files, part_suffix
+
+
+def test_recover_csv_cuts_incomplete_row(tmp_path):
+    filepath = tmp_path / ('R-300-2020-06-15T142351-000000.csv' + part_suffix)
+    filepath.write_bytes(b'Time s,Vapor\r\n0,20.5\r\n1,20.')
+    final_path = recover_file(str(filepath))
+    assert final_path == str(tmp_path / 'R-300-2020-06-15T142351-000000.csv')
+    assert not filepath.exists()
+    with open(final_path, newline='') as f:
+        assert list(csv.reader(f)) == [['Time s', 'Vapor'], ['0', '20.5']]
+
+
+def test_recover_binary_log_keeps_whole_records(tmp_path):
+    filepath = str(tmp_path / ('R-300-2020-06-15T142351-000000.oirec' + part_suffix))
+    writer = binary_log.BinaryLogWriter(filepath, ['Time s', 'Vapor'], 'R-300', datetime(2020, 6, 15, 14, 23, 51))
+    writer.writerow([0, 20.5])
+    writer.writerow([1, 21.0])
+    writer.close()
+    with open(filepath, 'ab') as f:
+        f.write(b'\x00' * 11)   # part of a third record
+    header, data = binary_log.read_binary_log(recover_file(filepath))
+    assert header['kinds'] == ['int', 'float']
+    assert data.tolist() == [[0.0, 20.5], [1.0, 21.0]]
+
+
+def test_recover_partial_files_of_one_device(tmp_path):
+    for name in ('R-300-2020-06-15T142351-000000.csv', 'R-300 B-2020-06-15T142351-000000.csv'):
+        (tmp_path / (name + part_suffix)).write_bytes(b'Time s\r\n0\r\n')
+    recovered = recover_partial_files(str(tmp_path), 'R-300')
+    assert recovered == [str(tmp_path / 'R-300-2020-06-15T142351-000000.csv')]
+    assert (tmp_path / ('R-300 B-2020-06-15T142351-000000.csv' + part_suffix)).exists()
+
+
+def test_writer_flushes_every_second_by_default(tmp_path, monkeypatch):
+    import buffered_writer
+    now = [0.0]
+    monkeypatch.setattr(buffered_writer.time, 'monotonic', lambda: now[0])
+    with open(tmp_path / 'rows.csv', 'w', newline='') as f:
+        writer = BufferedRowWriter(csv.writer(f), f)
+        writer.writerow([0])
+        assert writer.flushes == 0
+        now[0] = 1.0
+        writer.writerow([1])
+        assert writer.flushes == 1
+        assert not writer.buffer
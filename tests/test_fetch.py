@@ -0,0 +1,54 @@
+import copy
+import json
+
+import pytest
+import requests
+
+from openinterface.fake_device import FakeDevice
+from openinterface.fetch import Fetcher, sections_of
+from openinterface.sample_data import process_sample
+
+auth = ('rw', 'secret')
+
+
+def test_sections_of_simple_paths():
+    assert sections_of(['$.vacuum.act', '$.heating.set', '$.vacuum.set']) == ('vacuum', 'heating')
+    assert sections_of(['$.vacuum.act', '$..act']) is None
+
+
+def test_changes_of_unused_sections_are_ignored():
+    fetcher = Fetcher(['$.heating.act'])
+    document, changed = fetcher.decode(json.dumps(process_sample).encode())
+    assert changed
+    assert list(document) == ['heating']
+
+    other = copy.deepcopy(process_sample)
+    other['vacuum']['act'] += 1
+    assert fetcher.decode(json.dumps(other).encode()) == (document, False)
+    assert fetcher.decode(json.dumps(other).encode()) == (document, False)   # same body, not decoded
+    assert (fetcher.stats.unchanged, fetcher.stats.unchanged_bytes, fetcher.stats.decode.count) == (2, 1, 2)
+
+    other['heating']['act'] += 1
+    document, changed = fetcher.decode(json.dumps(other).encode())
+    assert changed
+    assert document['heating']['act'] == other['heating']['act']
+
+
+def test_fetch_from_device():
+    server = FakeDevice(auth=auth).start()
+    session = requests.Session()
+    session.auth = auth
+    url = server.url + '/process'
+    try:
+        fetcher = Fetcher()
+        assert fetcher.fetch(session, url, timeout=1) == (server.process, True)
+        assert not fetcher.fetch(session, url)[1]
+        server.process['heating']['set'] = 42.0
+        document, changed = fetcher.fetch(session, url)
+        assert changed and document['heating']['set'] == 42.0
+        fetcher.reset()
+        assert fetcher.fetch(session, url)[1]
+        with pytest.raises(Exception):
+            fetcher.fetch(requests.Session(), url)    # 401 without credentials
+    finally:
+        server.stop()
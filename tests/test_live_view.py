@@ -0,0 +1,64 @@
+import time
+
+import numpy as np
+import requests
+
+from live_view import HistoryBuffer, Poller
+from openinterface.fake_device import FakeDevice
+
+
+def test_merge_halves_buckets_keeping_extremes():
+    history = HistoryBuffer(4, 1)
+    for t, value in enumerate([5, 1, 7, 3]):
+        history.append(t, [value])
+    # the fourth sample filled all buckets, neighbours were merged
+    assert (history.count, history.size, history.pending) == (2, 2, 0)
+    assert history.times[:2].tolist() == [0, 2]
+    assert history.minimum[:2, 0].tolist() == [1, 3]
+    assert history.maximum[:2, 0].tolist() == [5, 7]
+    assert np.isnan(history.times[2:]).all()
+
+
+def test_buckets_take_more_samples_after_merge():
+    history = HistoryBuffer(4, 2)
+    for t in range(4):
+        history.append(t, [t, -t])
+    history.append(4, [10, np.nan])
+    assert (history.count, history.pending) == (2, 1)
+    history.append(5, [2, -5])
+    assert (history.count, history.pending) == (3, 0)
+    assert history.times[2] == 4
+    assert history.minimum[2].tolist() == [2, -5]
+    assert history.maximum[2].tolist() == [10, -5]
+
+
+def test_envelope_includes_pending_bucket():
+    history = HistoryBuffer(4, 1)
+    for t, value in enumerate([5, 1, 7, 3, 4]):
+        history.append(t, [value])
+    times, values = history.envelope()
+    assert times.tolist() == [0, 0, 2, 2, 4, 4]
+    assert values[:, 0].tolist() == [1, 5, 3, 7, 4, 4]
+
+
+def test_poller_reads_values_of_changed_documents_only():
+    server = FakeDevice(auth=('rw', 'secret')).start()
+    session = requests.Session()
+    session.auth = ('rw', 'secret')
+    poller = Poller(session, server.url + '/process', {'Bath': '$.heating.act'}, interval=0.02, window=1, history=10)
+    reads = []
+    read = poller.read
+    poller.read = lambda proc_msg: reads.append(proc_msg) or read(proc_msg)
+    try:
+        poller.start()
+        deadline = time.monotonic() + 5
+        while poller.recent.count < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        poller.stop()
+        poller.thread.join()
+        server.stop()
+    times, values = poller.recent_data()
+    assert len(times) >= 5     # unchanged documents still add a sample
+    assert len(reads) == 1
+    assert (values[:, 0] == server.process['heating']['act']).all()
@@ -0,0 +1,92 @@
+import socket
+
+import pytest
+
+from openinterface.fake_device import FakeDevice
+from openinterface.poller import Device, FleetPoller
+
+auth = ('rw', 'secret')
+
+
+@pytest.fixture
+def devices():
+    servers = [FakeDevice(auth=auth, name=f"R-300 {i}").start() for i in range(2)]
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Collector(object):
+    """ sink stopping the poller once answering devices delivered enough samples
+
+    :param samples: samples per device
+    :param answering: number of devices expected to answer
+    """
+
+    def __init__(self, samples, answering):
+        self.samples = samples
+        self.answering = answering
+        self.received = {}
+        self.gaps = []
+        self.poller = None
+
+    def __call__(self, device, poll_at, proc_msg):
+        self.received.setdefault(device.name, []).append((poll_at, proc_msg))
+        if len(self.received) == self.answering and all(len(r) >= self.samples for r in self.received.values()):
+            self.poller.stop()
+
+    def gap(self, device, poll_at, error):
+        self.gaps.append(device.host)
+
+
+def run(poller, collector):
+    collector.poller = poller
+    poller.run()
+
+
+def test_polls_all_devices(devices):
+    collector = Collector(3, 2)
+    fleet = [Device(server.host, *auth, scheme='http') for server in devices]
+    run(FleetPoller(fleet, [collector], interval=0.05, report_interval=None), collector)
+    assert sorted(collector.received) == ["R-300 0", "R-300 1"]
+    for samples in collector.received.values():
+        times = [poll_at for poll_at, proc_msg in samples]
+        assert times == sorted(times)
+        assert 'vacuum' in samples[0][1]
+    for server in devices:
+        assert server.counters['connections'] == 1     # one keep-alive connection per device
+
+
+def test_unreachable_device_does_not_stop_the_others(devices):
+    collector = Collector(10, 1)
+    offline = Device(f"127.0.0.1:{free_port()}", *auth, scheme='http')
+    fleet = [Device(devices[0].host, *auth, scheme='http'), offline]
+    run(FleetPoller(fleet, [collector], interval=0.05, report_interval=None), collector)
+    assert len(collector.received["R-300 0"]) >= 10
+    assert collector.gaps == [offline.host]     # one gap for the outage
+    assert offline.guard.failing
+    assert not offline.connected
+
+
+def test_csv_sink_records_every_device(devices, tmp_path):
+    from fleet_poller import csv_sink
+    for server in devices:
+        server.process['globalStatus']['running'] = True
+    collector = Collector(3, 2)
+    sink = csv_sink(str(tmp_path), interval=0.05)
+    fleet = [Device(server.host, *auth, scheme='http') for server in devices]
+    try:
+        run(FleetPoller(fleet, [sink, collector], interval=0.05, report_interval=None), collector)
+    finally:
+        sink.close()
+    recordings = sorted(p.name for p in tmp_path.glob('*.csv'))
+    assert [name.split('-2')[0] for name in recordings] == ["R-300 0", "R-300 1"]
+    rows = (tmp_path / recordings[0]).read_text().splitlines()
+    assert rows[2].split(',')[0] == '0.0'     # "Time s" keeps the decimals of the interval
+    assert sink.dropped == 0
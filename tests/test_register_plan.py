@@ -0,0 +1,94 @@
+import copy
+
+import numpy as np
+
+from register_plan import Constant, Enum, RegisterPlan, RegisterUpdater, TimestampPart
+from openinterface.sample_data import process_sample
+
+missing = 0x8000
+
+mapping = (
+    ("version", Constant(3), None, 1, True),
+    ("heating.set", None, '$.heating.set', 10, False),
+    ("heating.running", None, '$.heating.running', 1, False),
+    ("program.type", Enum(['Manual', 'AutoDest']), '$.program.type', 1, True),
+    ("started.hour", TimestampPart('hour'), '$.globalStatus.processStartTime', 1, True),
+    ("started.minute", TimestampPart('minute'), '$.globalStatus.processStartTime', 1, True),
+    ("reserved", None, None, 1, True),
+)
+
+
+def document(heating_set=40.0, program='Manual'):
+    return {
+        'heating': {'set': heating_set, 'running': True},
+        'program': {'type': program},
+        'globalStatus': {'processStartTime': '2020-06-15T14:23:51+0200'},
+    }
+
+
+def test_encode():
+    plan = RegisterPlan(mapping, missing)
+    assert plan.encode(document()).tolist() == [3, 400, 1, 0, 14, 23, missing]
+
+
+def test_encode_negative_and_missing_values():
+    plan = RegisterPlan(mapping, missing)
+    d = document(heating_set=-12.5, program='Unknown')
+    del d['heating']['running']
+    registers = plan.encode(d)
+    assert registers[1] == -125 & 0xFFFF
+    assert registers[2] == missing
+    assert registers[3] == missing
+    assert plan.missing_values == 2
+
+
+def test_encode_matches_get_value():
+    import modbus_server
+    incomplete = copy.deepcopy(process_sample)
+    del incomplete['cooling']
+    incomplete['heating']['set'] = -12.5
+    for d in (process_sample, incomplete):
+        expected = [modbus_server.get_value(d, m) for m in modbus_server.modbus_mapping]
+        assert modbus_server.register_plan.encode(d).tolist() == expected
+
+
+class Block(object):
+    """ datablock recording the update() calls """
+
+    def __init__(self, count):
+        self.values = [0] * (count + 1)
+        self.updates = []
+
+    def getValues(self, address, count):
+        return self.values[address:address + count]
+
+    def update(self, address, values):
+        self.values[address:address + len(values)] = values
+        self.updates.append((address, values))
+
+
+def test_updater_writes_changed_runs_only():
+    block = Block(6)
+    updater = RegisterUpdater(block, 1, 6)
+    assert updater.update(np.array([1, 2, 0, 0, 5, 6])) == 4
+    assert block.updates == [(1, [1, 2]), (5, [5, 6])]
+
+    block.updates.clear()
+    assert updater.update(np.array([1, 2, 0, 0, 5, 7])) == 1
+    assert block.updates == [(6, [7])]
+    assert block.values[1:] == [1, 2, 0, 0, 5, 7]
+
+    block.updates.clear()
+    assert updater.update(np.array([1, 2, 0, 0, 5, 7])) == 0
+    assert block.updates == []
+    assert (updater.cycles, updater.total_changed, updater.writes) == (3, 5, 3)
+
+
+def test_updater_refreshes_registers_written_by_clients():
+    block = Block(4)
+    updater = RegisterUpdater(block, 1, 4)
+    updater.update([1, 2, 3, 4])
+    block.values[2] = 99    # a client wrote register 2
+    block.updates.clear()
+    assert updater.update([1, 2, 3, 4], written={2, 40}) == 1
+    assert block.updates == [(2, [2])]
@@ -0,0 +1,102 @@
+import random
+import socket
+
+import pytest
+
+from openinterface.resilience import AdaptiveTimeout, Backoff, CircuitBreaker, PollGuard, is_timeout
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_guard(clock, threshold=3, reset_after=10.0):
+    return PollGuard(1.0, 'test', backoff=Backoff(base=1.0, maximum=8.0, rng=random.Random(1)),
+                     breaker=CircuitBreaker(threshold, reset_after), clock=clock)
+
+
+def test_is_timeout():
+    assert is_timeout(TimeoutError())
+    assert is_timeout(socket.timeout())
+    assert not is_timeout(ConnectionError())
+
+
+def test_backoff_grows_with_jitter_up_to_maximum():
+    backoff = Backoff(base=1.0, maximum=8.0, rng=random.Random(1))
+    delays = [backoff.failure() for _ in range(6)]
+    for delay, cap in zip(delays, [1, 2, 4, 8, 8, 8]):
+        assert cap / 2 <= delay <= cap
+    backoff.reset()
+    assert backoff.failure() <= 1.0
+
+
+def test_adaptive_timeout_follows_latency():
+    timeouts = AdaptiveTimeout(initial=5.0, minimum=0.5, maximum=10.0)
+    for _ in range(50):
+        timeouts.observe(0.2)
+    assert timeouts.timeout == 0.5
+    timeouts.expired()
+    assert timeouts.timeout == 1.0
+    for _ in range(5):
+        timeouts.expired()
+    assert timeouts.timeout == 10.0
+
+
+def test_failure_backs_off_until_retry(clock):
+    guard = make_guard(clock)
+    assert guard.ready()
+    delay = guard.failure(ConnectionError())
+    assert 0.5 <= delay <= 1.0
+    assert not guard.ready()
+    assert guard.failing
+    clock.now += delay
+    assert guard.ready()
+
+
+def test_circuit_opens_after_threshold_and_probes(clock):
+    guard = make_guard(clock, threshold=3, reset_after=10.0)
+    for _ in range(3):
+        clock.now = guard.retry_at
+        delay = guard.failure(ConnectionError())
+    assert guard.breaker.state == 'open'
+    assert delay >= 10.0
+    clock.now += 9.0
+    assert not guard.ready()
+    clock.now += 1.0
+    assert guard.ready()
+    assert guard.breaker.state == 'half open'
+
+    # a failed probe opens the circuit again
+    guard.failure(ConnectionError())
+    assert guard.breaker.state == 'open'
+    assert guard.breaker.opened == 1
+
+    clock.now = guard.retry_at
+    assert guard.ready()
+    guard.success(0.1)
+    assert guard.breaker.state == 'closed'
+    assert not guard.failing
+    assert guard.ready()
+
+
+def test_counts_outages_and_timeouts(clock):
+    guard = make_guard(clock)
+    timeout = guard.timeout
+    guard.failure(TimeoutError())
+    guard.failure(ConnectionError())
+    assert guard.timeout == 2 * timeout
+    guard.success(0.1)
+    guard.failure(ConnectionError())
+    guard.skip()
+    assert (guard.failures, guard.timeouts_hit, guard.outages, guard.skipped) == (3, 1, 2, 1)
+    assert guard.consecutive == 1
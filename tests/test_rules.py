@@ -0,0 +1,66 @@
+from rules import RuleSet, action_msg, compile_rule
+
+
+def sample(vapor_temp=None, vacuum=None):
+    msg = {'globalStatus': {'running': True}, 'vacuum': {}}
+    if vapor_temp is not None:
+        msg['vacuum']['vaporTemp'] = vapor_temp
+    if vacuum is not None:
+        msg['vacuum']['act'] = vacuum
+    return msg
+
+
+def evaluator(*specs):
+    return RuleSet([compile_rule(spec) for spec in specs]).evaluator()
+
+
+def test_threshold_needs_consecutive_samples():
+    rules = evaluator({"name": "hot", "field": "$.vacuum.vaporTemp", "op": ">", "value": 45, "samples": 3})
+    assert rules.evaluate(sample(46)) == []
+    assert rules.evaluate(sample(44)) == []     # resets the count
+    assert rules.evaluate(sample(46)) == []
+    assert rules.evaluate(sample(47)) == []
+    fired = rules.evaluate(sample(48))
+    assert [rule.name for rule in fired] == ["hot"]
+    assert fired[0].stops
+    assert rules.done
+
+
+def test_missing_field_resets_the_count():
+    rules = evaluator({"field": "$.vacuum.vaporTemp", "op": ">=", "value": 45, "samples": 2})
+    assert rules.evaluate(sample(45)) == []
+    assert rules.evaluate(sample()) == []
+    assert rules.evaluate(sample(45)) == []
+    assert len(rules.evaluate(sample(45))) == 1
+
+
+def test_stable_rule():
+    rules = evaluator({"name": "stable", "field": "$.vacuum.act", "stable": 2, "samples": 3, "action": "hold"})
+    assert rules.evaluate(sample(vacuum=100)) == []
+    assert rules.evaluate(sample(vacuum=105)) == []
+    assert rules.evaluate(sample(vacuum=104)) == []     # spread of 5
+    fired = rules.evaluate(sample(vacuum=103))
+    assert [rule.name for rule in fired] == ["stable"]
+    assert not fired[0].stops
+
+
+def test_every_rule_fires_once_and_actions_merge():
+    rules = evaluator(
+        {"name": "hot", "field": "$.vacuum.vaporTemp", "op": ">", "value": 45, "action": "hold"},
+        {"name": "cool", "field": "$.vacuum.vaporTemp", "op": ">", "value": 40,
+         "action": {"set": {"heating": {"set": 20}}}},
+    )
+    fired = rules.evaluate(sample(46))
+    assert [rule.name for rule in fired] == ["hot", "cool"]
+    assert action_msg(fired) == {'globalStatus': {'onHold': True}, 'heating': {'set': 20}}
+    assert rules.evaluate(sample(50)) == []
+    assert rules.done
+
+
+def test_evaluators_keep_state_per_device():
+    ruleset = RuleSet([compile_rule({"field": "$.vacuum.vaporTemp", "op": ">", "value": 45, "samples": 2})])
+    first, second = ruleset.evaluator(), ruleset.evaluator()
+    first.evaluate(sample(46))
+    assert second.evaluate(sample(46)) == []
+    assert len(first.evaluate(sample(46))) == 1
+    assert not second.done
@@ -0,0 +1,53 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from openinterface import scheduler as scheduler_module
+from openinterface.scheduler import Scheduler
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(scheduler_module, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_advance_sleeps_until_next_slot(clock):
+    scheduler = Scheduler(1.0)
+    clock.now += 0.25
+    assert scheduler.advance() == (0.75, 0)
+    assert scheduler.slot == 1
+
+
+def test_advance_uses_slot_that_has_just_begun(clock):
+    scheduler = Scheduler(1.0)
+    clock.now += 1.5
+    assert scheduler.advance() == (0, 0)
+    assert scheduler.slot == 1
+    assert scheduler.lateness() == pytest.approx(0.5)
+
+
+def test_advance_skips_passed_slots_and_keeps_the_grid(clock):
+    scheduler = Scheduler(0.5)
+    clock.now += 1.7
+    sleep_for, missed = scheduler.advance()
+    assert missed == 2
+    assert scheduler.slot == 3
+    assert sleep_for == 0
+    assert scheduler.due == pytest.approx(101.5)
+    assert scheduler.slot_at - scheduler.started_at == timedelta(seconds=1.5)
+
+    clock.now = 101.75
+    assert scheduler.advance() == (pytest.approx(0.25), 0)
+    assert scheduler.due == pytest.approx(102.0)
+
+
+def test_resync_restarts_the_grid(clock):
+    scheduler = Scheduler(1.0)
+    scheduler.advance()
+    clock.now = 250.3
+    scheduler.resync()
+    assert scheduler.slot == 0
+    assert scheduler.due == 250.3
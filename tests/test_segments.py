@@ -0,0 +1,87 @@
+import copy
+import csv
+import gzip
+import threading
+from datetime import datetime, timedelta
+
+from csv_recorder import CsvRecorder
+from openinterface.sample_data import process_sample
+from segments import (Segment, SegmentArchiver, append_index, find_segments, index_filename, read_index,
+                      segment_filepath, segment_number)
+
+started_at = datetime(2020, 6, 15, 14, 23, 51)
+
+
+def segment(folder, number, device='R-300', minutes=10):
+    filepath = folder / segment_filepath(f"{device}-2020-06-15T142351-000000.csv", number)
+    filepath.write_text('Time s\r\n0\r\n')
+    start = started_at + timedelta(minutes=minutes * number)
+    return Segment(str(filepath), device, 'run 1', number, start, start + timedelta(minutes=minutes), 600)
+
+
+def test_segment_numbers_survive_compression():
+    filepath = segment_filepath('R-300-2020-06-15T142351-000000.csv', 2)
+    assert filepath == 'R-300-2020-06-15T142351-000000.002.csv'
+    assert segment_number(filepath + '.gz') == 2
+    assert segment_number('R-300-2020-06-15T142351-000000.csv') == 0
+
+
+def test_archiver_compresses_and_finds_segments(tmp_path):
+    archiver = SegmentArchiver(str(tmp_path), 'gzip')
+    for number in range(3):
+        archiver.add(segment(tmp_path, number))
+    archiver.add(segment(tmp_path, 0, device='R-300 B'))
+    archiver.close()
+    assert archiver.archived == 4
+    assert not list(tmp_path.glob('*.csv'))
+    with gzip.open(tmp_path / 'R-300-2020-06-15T142351-000000.001.csv.gz') as f:
+        assert f.read() == b'Time s\r\n0\r\n'
+
+    window = find_segments(str(tmp_path), started_at + timedelta(minutes=15), started_at + timedelta(minutes=25), 'R-300')
+    assert [entry['segment'] for entry in window] == ['1', '2']
+    assert window[0]['file'] == str(tmp_path / 'R-300-2020-06-15T142351-000000.001.csv.gz')
+    assert len(find_segments(str(tmp_path))) == 4
+
+
+def test_archivers_share_the_index(tmp_path):
+    index_path = str(tmp_path / index_filename)
+    segments = [segment(tmp_path, number) for number in range(50)]
+
+    def append(part):
+        for s in part:
+            append_index(index_path, s)
+    threads = [threading.Thread(target=append, args=(segments[i::5],)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(int(entry['segment']) for entry in read_index(str(tmp_path))) == list(range(50))
+
+
+def test_index_skips_rows_that_dont_parse(tmp_path):
+    with open(tmp_path / index_filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['file', 'device', 'run_id', 'segment', 'started_at', 'ended_at', 'rows'])  # older header
+        writer.writerow(segment(tmp_path, 0).index_row())
+        f.write('R-300-2020-06-15T142351-000000.001.csv,R-300,run 1,1,2020-06')   # cut off by a crash
+    append_index(str(tmp_path / index_filename), segment(tmp_path, 2))
+    assert [entry['segment'] for entry in read_index(str(tmp_path))] == ['0']
+
+
+def test_recorder_rotates_segments(tmp_path):
+    proc_msg = copy.deepcopy(process_sample)
+    proc_msg['globalStatus'].update(running=True, runId=7)
+    recorder = CsvRecorder(str(tmp_path), 'R-300', rotate_seconds=10)
+    for second in range(25):
+        recorder.record(started_at + timedelta(seconds=second), proc_msg)
+    proc_msg['globalStatus']['running'] = False
+    recorder.record(started_at + timedelta(seconds=25), proc_msg)
+    recorder.archiver.close()
+
+    entries = read_index(str(tmp_path))
+    assert [(entry['segment'], entry['rows']) for entry in entries] == [('0', '10'), ('1', '10'), ('2', '5')]
+    assert entries[1]['started_at'] == (started_at + timedelta(seconds=10)).isoformat()
+    with open(tmp_path / entries[2]['file'], newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[1] == [started_at.strftime('%d.%m.%Y %H:%M')]   # the start of the run
+    assert [row[0] for row in rows[2:]] == ['20', '21', '22', '23', '24']
@@ -0,0 +1,28 @@
+import socket
+
+import pytest
+import requests
+
+from openinterface.session import SessionMetrics, create_session
+
+
+def closed_port_url():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/api/v1/process"
+
+
+def test_poll_is_not_retried_after_connection_error():
+    metrics = SessionMetrics()
+    session = create_session(('rw', 'secret'), retries=3, backoff_factor=0, metrics=metrics, retry_methods=('PUT',))
+    with pytest.raises(requests.ConnectionError):
+        session.get(closed_port_url(), timeout=1)
+    assert metrics.connections == 1
+
+
+def test_write_is_retried_after_connection_error():
+    metrics = SessionMetrics()
+    session = create_session(('rw', 'secret'), retries=3, backoff_factor=0, metrics=metrics, retry_methods=('PUT',))
+    with pytest.raises(requests.ConnectionError):
+        session.put(closed_port_url(), json={}, timeout=1)
+    assert metrics.connections == 4
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import requests
+
+from openinterface.sample_data import info_sample, process_sample
+from openinterface.snapshot import Snapshot, SnapshotServer, SnapshotService
+
+auth = ('rw', 'secret')
+
+
+def serve(service, forward):
+    server = SnapshotServer(service, info_sample, forward, auth=auth).start()
+    session = requests.Session()
+    session.auth = auth
+    return server, session
+
+
+def test_serves_latest_snapshot_and_forwards_writes():
+    service = SnapshotService(lambda timeout: process_sample, interval=1)
+    service.publish(Snapshot(process_sample, datetime.now(), 1))
+    forwarded = []
+    server, session = serve(service, forwarded.append)
+    try:
+        assert session.get(server.url + '/info').json() == info_sample
+        r = session.get(server.url + '/process')
+        assert r.status_code == 200
+        assert r.json() == process_sample
+        assert 'X-Snapshot-Age' in r.headers
+        assert session.put(server.url + '/process', json={'heating': {'set': 40}}).status_code == 200
+        assert forwarded == [{'heating': {'set': 40}}]
+        assert server.writes == forwarded
+        assert session.get(server.url + '/process', auth=('rw', 'wrong')).status_code == 401
+    finally:
+        server.stop()
+
+
+def test_answers_503_without_fresh_snapshot():
+    service = SnapshotService(lambda timeout: process_sample, interval=1, stale_after=0)
+
+    def unreachable(changes):
+        raise ConnectionError()
+    server, session = serve(service, unreachable)
+    try:
+        assert session.get(server.url + '/process').status_code == 503
+        service.publish(Snapshot(process_sample, datetime.now(), 1))
+        assert session.get(server.url + '/process').status_code == 503    # already older than stale_after
+        assert session.put(server.url + '/process', json={'heating': {'set': 40}}).status_code == 503
+        assert server.writes == []
+    finally:
+        server.stop()
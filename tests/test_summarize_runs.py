@@ -0,0 +1,44 @@
+import copy
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from csv_recorder import CsvRecorder
+from openinterface.sample_data import process_sample
+from summarize_runs import find_recordings, group_runs, summarize_run
+
+started_at = datetime(2020, 6, 15, 14, 23, 51)
+diffs = [second % 3 for second in range(20)]
+
+
+def record_run(folder, output_format, compression=None):
+    """ records a run of 20 s in segments of 7 s """
+    proc_msg = copy.deepcopy(process_sample)
+    proc_msg['globalStatus'].update(running=True, runId=1)
+    vacuum = proc_msg['vacuum']
+    recorder = CsvRecorder(folder, 'R-300', output_format, rotate_seconds=7, compression=compression)
+    for second in range(20):
+        vacuum.update(act=max(100 - 10 * second, 50), set=50)
+        vacuum['vaporTemp'] = 20 + second if second < 12 else 40 - second
+        vacuum.update(autoDestIn=10, autoDestOut=10 + diffs[second])
+        vacuum['powerPercentAct'] = 500 if second < 10 else 0
+        recorder.record(started_at + timedelta(seconds=second), proc_msg)
+    proc_msg['globalStatus']['running'] = False
+    recorder.record(started_at + timedelta(seconds=20), proc_msg)
+    recorder.archiver.close()
+
+
+@pytest.mark.parametrize('output_format, compression', [('csv', None), ('binary', None), ('binary', 'gzip')])
+def test_summarizes_a_run_in_segments(tmp_path, output_format, compression):
+    record_run(str(tmp_path), output_format, compression)
+    runs = group_runs(find_recordings([str(tmp_path)]))
+    assert len(runs) == 1
+    row = summarize_run(runs[0], size=4)    # chunks end within the segments
+    assert (row['device'], row['started_at'], row['segments']) == ('R-300', started_at.isoformat(), 3)
+    assert (row['samples'], row['duration_s'], row['time_to_vacuum_s']) == (20, 19, 5)
+    assert (row['peak_vapor'], row['peak_vapor_at_s']) == (31, 11)
+    assert row['autodest_diff_mean'] == pytest.approx(np.mean(diffs))
+    assert row['autodest_diff_std'] == pytest.approx(np.std(diffs))
+    assert (row['autodest_diff_min'], row['autodest_diff_max']) == (0, 2)
+    assert (row['pump_duty'], row['pump_mean']) == (0.5, 250)